@@ -1,21 +1,27 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import hashlib
+import http.client
 import json
 import re
 import sqlite3
 import sys
-import urllib.request
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from corpus_manifest import MAX_GARBAGE, copies_of, db_generation, quality_clause
+
 DB = Path("/ai_data/ai_corpus/manifest.sqlite")
+SEARCHD_URL = "http://127.0.0.1:8790"
+RETRIEVAL_CACHE = DB.parent / "retrieval_cache.sqlite"
+HYBRID_DEPTH = 5   # --hybrid: each ranking is k*5 (min 40) deep before fusion
 OLLAMA_URL = "http://127.0.0.1:11434/api/chat"
-
-BOILERPLATE = (
-    "project gutenberg",
-    "start of the project gutenberg ebook",
-    "transcriber's note",
-    "gutenberg license",
-)
+TRI_RUNS = Path.home() / "FineTuningAI" / "tri_runs"   # same layout tri_ollama / tri_html_report use
 
 STOPWORDS = {
     "the","a","an","and","or","not","to","of","in","on","for","with","by","as","at","from",
@@ -47,8 +53,12 @@ ANCHOR_TERMS = (
     "calling",
 )
 
-def connect_db():
-    con = sqlite3.connect(str(DB))
+def connect_db(readonly=False):
+    if readonly:
+        # read-only connections may be closed from another thread (--batch cleanup)
+        con = sqlite3.connect(f"file:{DB}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        con = sqlite3.connect(str(DB))
     con.row_factory = sqlite3.Row
     return con
 
@@ -95,7 +105,8 @@ def make_anchor_first_query(question: str) -> str:
 
     return " OR ".join(fts_term(h) for h in out)
 
-def search_chunks(con, fts_q, k, ext="", like="", path_eq="", work_id="", work_like=""):
+def doc_filter(ext="", like="", path_eq="", work_id="", work_like=""):
+    """WHERE clause (or "") + params selecting docs for the path/work filters."""
     where_meta = []
     params_meta = []
 
@@ -119,62 +130,196 @@ def search_chunks(con, fts_q, k, ext="", like="", path_eq="", work_id="", work_l
         where_meta.append("lower(work_title) like ?")
         params_meta.append(f"%{work_like.lower()}%")
 
-    meta_clause = ("WHERE " + " AND ".join(where_meta)) if where_meta else ""
-    fetch_n = max(k * 60, k)
+    return ("WHERE " + " AND ".join(where_meta)) if where_meta else "", params_meta
+
+def search_chunks(con, fts_q, k, ext="", like="", path_eq="", work_id="", work_like="",
+                  max_garbage=MAX_GARBAGE, min_chars=0, lang=""):
+    meta_clause, params_meta = doc_filter(ext, like, path_eq, work_id, work_like)
+    # boilerplate / OCR noise / language are stored per chunk, so LIMIT k is exact
+    quality_sql, quality_params = quality_clause("c", max_garbage=max_garbage,
+                                                 min_chars=min_chars, lang=lang)
 
     sql = f"""
-      SELECT bm25(chunks_fts) AS score, chunks_fts.chunk_id
+      SELECT bm25(chunks_fts) AS score, c.chunk_id
       FROM chunks_fts
+      JOIN chunks c ON c.id = chunks_fts.rowid
       JOIN (
-        SELECT doc_id FROM docs {meta_clause}
-      ) d ON d.doc_id = chunks_fts.doc_id
-      WHERE chunks_fts MATCH ?
+        SELECT DISTINCT coalesce(dup_of, doc_id) AS doc_id FROM docs {meta_clause}
+      ) d ON d.doc_id = c.doc_id
+      WHERE chunks_fts MATCH ?{quality_sql}
       ORDER BY score
       LIMIT ?
     """
 
     try:
-        rows = con.execute(sql, (*params_meta, fts_q, fetch_n)).fetchall()
+        rows = con.execute(sql, (*params_meta, fts_q, *quality_params, k)).fetchall()
     except sqlite3.OperationalError as e:
         raise sqlite3.OperationalError(f"FTS query error: {e}\nQuery was: {fts_q!r}")
 
-    out = []
-    for r in rows:
-        cid = r["chunk_id"]
-        txt = con.execute("SELECT text FROM chunks WHERE chunk_id=?", (cid,)).fetchone()
-        if not txt:
-            continue
-
-        low = txt["text"].lower()
-        if any(b in low for b in BOILERPLATE):
-            continue
-
-        out.append(cid)
-        if len(out) >= k:
-            break
+    return [r["chunk_id"] for r in rows]
 
-    return out
-
-def fetch_chunk(con, chunk_id):
+def filter_chunk_ids(con, chunk_ids, ext="", like="", path_eq="", work_id="", work_like="",
+                     max_garbage=MAX_GARBAGE, min_chars=0, lang=""):
+    """The subset of chunk_ids (order kept) passing the same filters as search_chunks."""
+    if not chunk_ids:
+        return []
+    meta_clause, params_meta = doc_filter(ext, like, path_eq, work_id, work_like)
+    quality_sql, quality_params = quality_clause("c", max_garbage=max_garbage,
+                                                 min_chars=min_chars, lang=lang)
+    marks = ",".join("?" * len(chunk_ids))
+    rows = con.execute(f"""
+      SELECT c.chunk_id
+      FROM chunks c
+      JOIN (
+        SELECT DISTINCT coalesce(dup_of, doc_id) AS doc_id FROM docs {meta_clause}
+      ) d ON d.doc_id = c.doc_id
+      WHERE c.chunk_id IN ({marks}){quality_sql}
+    """, (*params_meta, *chunk_ids, *quality_params)).fetchall()
+    keep = {r["chunk_id"] for r in rows}
+    return [cid for cid in chunk_ids if cid in keep]
+
+def rrf_fuse(rankings, k=60):
+    """Reciprocal rank fusion: sum of 1/(k + rank) over the rankings an id appears in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, 1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda cid: -scores[cid])
+
+# One retrieved chunk. The first eight fields are what build_prompt / --show-sources
+# print; doc_id/start/end/score drive pack_sources (merging and budget order).
+Source = namedtuple("Source", "rel_path ext work_title work_id vol_idx vol_total chunk_id text "
+                              "doc_id start end score")
+
+def fetch_chunk(con, chunk_id, score=0.0):
     row = con.execute("""
-      SELECT d.rel_path, d.ext, d.work_title, d.work_id, d.vol_idx, d.vol_total, c.chunk_id, c.text
+      SELECT d.rel_path, d.ext, d.work_title, d.work_id, d.vol_idx, d.vol_total, c.chunk_id, c.text,
+             c.doc_id, c.start_char, c.end_char
       FROM chunks c
       JOIN docs d ON d.doc_id = c.doc_id
       WHERE c.chunk_id = ?
     """, (chunk_id,)).fetchone()
 
     if not row:
-        return ("?", "?", None, None, None, None, chunk_id, "")
+        return Source("?", "?", None, None, None, None, chunk_id, "", None, 0, 0, score)
 
-    return (
+    return Source(
         row["rel_path"], row["ext"],
         row["work_title"], row["work_id"], row["vol_idx"], row["vol_total"],
-        row["chunk_id"], row["text"]
+        row["chunk_id"], row["text"],
+        row["doc_id"], row["start_char"], row["end_char"], score
     )
 
-def build_prompt(question, sources):
-    # HARD constraints to prevent drift
-    system = """You are a careful scholarly assistant.
+# ---------- context packing ----------
+
+CHARS_PER_TOKEN = 4          # rough; errs on the long side for English prose
+ANSWER_TOKENS = 1024         # kept free in num_ctx for the answer itself
+SOURCE_HEADER_TOKENS = 40    # "[SOURCE i] rel_path (ext) chunk=... work=..." line
+MIN_PASSAGE_TOKENS = 60      # don't bother adding a passage smaller than this
+PASSAGE_MAX_TOKENS = 1200    # one (merged) passage never takes more than this
+ADJACENT_GAP = 2             # chunks this close (the blank line between paragraphs) are merged
+
+_SENT_SPLIT = re.compile(r"(?<=[.!?;:])\s+|\n{2,}")
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _join(a, b):
+    """a and b from the same doc, b.start <= a.end + ADJACENT_GAP: one passage, text once."""
+    ids = a.chunk_id + "," + b.chunk_id
+    score = max(a.score, b.score)
+    if b.end <= a.end:
+        return a._replace(chunk_id=ids, score=score)
+    ov = a.end - b.start
+    if ov > 0:
+        # positions come from the chunker and can be off by the whitespace it stripped:
+        # look for the real overlap near the expected length
+        cut = ov
+        for n in range(min(len(b.text), ov + 8), max(0, ov - 8), -1):
+            if a.text.endswith(b.text[:n]):
+                cut = n
+                break
+        text = a.text + b.text[cut:]
+    else:
+        text = a.text.rstrip() + "\n\n" + b.text.lstrip()
+    return a._replace(chunk_id=ids, text=text, end=b.end, score=score)
+
+def merge_sources(sources):
+    """Fold overlapping / adjacent chunks of the same doc into one passage; best score first."""
+    by_doc = {}
+    out = []
+    for src in sources:
+        if src.doc_id is None:
+            out.append(src)
+        else:
+            by_doc.setdefault(src.doc_id, []).append(src)
+    for group in by_doc.values():
+        group.sort(key=lambda s: s.start)
+        cur = group[0]
+        for nxt in group[1:]:
+            if nxt.start <= cur.end + ADJACENT_GAP:
+                cur = _join(cur, nxt)
+            else:
+                out.append(cur)
+                cur = nxt
+        out.append(cur)
+    out.sort(key=lambda s: -s.score)
+    return out
+
+def trim_to_tokens(text, terms, max_tokens):
+    """Keep the sentences that mention the most query terms, in text order, within max_tokens."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sents = [x.strip() for x in _SENT_SPLIT.split(text) if x and x.strip()]
+
+    def relevance(sent):
+        return len(terms.intersection(tokenize_for_fts(sent)))
+
+    order = sorted(range(len(sents)), key=lambda i: (-relevance(sents[i]), i))
+    keep = set()
+    used = 0
+    for i in order:
+        t = estimate_tokens(sents[i]) + 1
+        if used + t <= max_tokens:
+            keep.add(i)
+            used += t
+    if not keep:
+        # no sentence fits (OCR text without punctuation): hard cut the best one
+        return sents[order[0]][: max_tokens * CHARS_PER_TOKEN].rstrip() + " …"
+
+    pieces = []
+    prev = None
+    for i in sorted(keep):
+        if prev is not None and i != prev + 1:
+            pieces.append("…")
+        pieces.append(sents[i])
+        prev = i
+    return " ".join(pieces)
+
+def prompt_budget(question, num_ctx, answer_tokens=ANSWER_TOKENS):
+    """Tokens left for SOURCES once the system prompt, question and answer are reserved."""
+    fixed = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(question) + 32
+    return max(num_ctx - answer_tokens - fixed, 2 * MIN_PASSAGE_TOKENS)
+
+def pack_sources(question, sources, budget_tokens):
+    """
+    Merge overlapping chunks, then fill budget_tokens greedily by score; passages that
+    don't fit whole are trimmed to their most query-relevant sentences.
+    """
+    terms = set(tokenize_for_fts(question))
+    packed = []
+    used = 0
+    for src in merge_sources(sources):
+        room = budget_tokens - used - SOURCE_HEADER_TOKENS
+        if room < MIN_PASSAGE_TOKENS:
+            break
+        text = trim_to_tokens(src.text.strip(), terms, min(room, PASSAGE_MAX_TOKENS))
+        packed.append(src._replace(text=text))
+        used += estimate_tokens(text) + SOURCE_HEADER_TOKENS
+    return packed
+
+# HARD constraints to prevent drift
+SYSTEM_PROMPT = """You are a careful scholarly assistant.
 You MUST answer the QUESTION exactly as asked.
 Use ONLY the provided SOURCES.
 Do NOT ask the user for more context.
@@ -187,88 +332,276 @@ Output format:
 - then a short bullet list of 3–6 key citations, each bullet = what it supports + citation.
 """
 
+def build_prompt(question, sources):
     src_blocks = []
-    for i, (rel, ext, work_title, work_id, vol_idx, vol_total, cid, txt) in enumerate(sources, 1):
-        head = f"[SOURCE {i}] {rel} ({ext}) chunk={cid}"
-        if work_id and work_title:
+    for i, src in enumerate(sources, 1):
+        head = f"[SOURCE {i}] {src.rel_path} ({src.ext}) chunk={src.chunk_id}"
+        if src.work_id and src.work_title:
             v = ""
-            if vol_idx is not None:
-                v = f" vol={vol_idx}" + (f"/{vol_total}" if vol_total else "")
-            head += f"  work='{work_title}' work_id={work_id}{v}"
-        src_blocks.append(head + "\n" + txt.strip() + "\n")
+            if src.vol_idx is not None:
+                v = f" vol={src.vol_idx}" + (f"/{src.vol_total}" if src.vol_total else "")
+            head += f"  work='{src.work_title}' work_id={src.work_id}{v}"
+        src_blocks.append(head + "\n" + src.text.strip() + "\n")
 
     user = "QUESTION:\n" + question + "\n\nSOURCES:\n\n" + "\n".join(src_blocks)
     return [
-        {"role": "system", "content": system},
+        {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user},
     ]
 
-def ollama_chat(model, messages, temperature, top_p, num_ctx):
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": False,
-        "options": {
-            "temperature": temperature,
-            "top_p": top_p,
-            "num_ctx": num_ctx
+class OllamaClient:
+    """
+    /api/chat over one persistent HTTP/1.1 connection (reused across calls, reopened
+    once if the server dropped it). With stream=True tokens go to on_token as they
+    arrive and the returned stats include time-to-first-token and tokens/sec.
+    """
+
+    def __init__(self, url=OLLAMA_URL, timeout=600):
+        u = urllib.parse.urlsplit(url)
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or 80
+        self.path = u.path or "/api/chat"
+        self.timeout = timeout
+        self.conn = None
+
+    def _request(self, body):
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request("POST", self.path, body=body,
+                                  headers={"Content-Type": "application/json", "Connection": "keep-alive"})
+                resp = self.conn.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                # idle keep-alive connection closed by the server: reconnect once
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            if resp.status != 200:
+                detail = resp.read().decode("utf-8", "replace").strip()
+                raise RuntimeError(f"Ollama HTTP {resp.status}: {detail}")
+            return resp
+
+    def chat(self, model, messages, temperature, top_p, num_ctx, stream=True, on_token=None):
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            "options": {
+                "temperature": temperature,
+                "top_p": top_p,
+                "num_ctx": num_ctx
+            }
         }
-    }
 
-    req = urllib.request.Request(
-        OLLAMA_URL,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type": "application/json"},
-        method="POST"
-    )
+        t0 = time.perf_counter()
+        resp = self._request(json.dumps(payload).encode("utf-8"))
+        parts = []
+        ttft = None
+        n_msgs = 0
+        final = {}
+
+        if not stream:
+            final = json.loads(resp.read().decode("utf-8"))
+            parts.append(final["message"]["content"])
+        else:
+            # NDJSON: one {"message": {"content": ...}, "done": false} per token batch,
+            # then a done=true record carrying eval_count / eval_duration
+            while True:
+                line = resp.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                msg = json.loads(line)
+                if msg.get("error"):
+                    raise RuntimeError(f"Ollama error: {msg['error']}")
+                tok = (msg.get("message") or {}).get("content", "")
+                if tok:
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                    n_msgs += 1
+                    parts.append(tok)
+                    if on_token:
+                        on_token(tok)
+                if msg.get("done"):
+                    final = msg
+                    break
+            resp.read()  # drain the chunked terminator so the connection can be reused
+
+        total = time.perf_counter() - t0
+        n_tok = final.get("eval_count") or n_msgs
+        gen_s = (final.get("eval_duration") or 0) / 1e9 or (total - (ttft or 0))
+        stats = {
+            "ttft_s": round(ttft, 3) if ttft is not None else None,
+            "total_s": round(total, 3),
+            "tokens": n_tok,
+            "tok_per_s": round(n_tok / gen_s, 1) if gen_s > 0 else None,
+        }
+        return "".join(parts).strip(), stats
 
-    with urllib.request.urlopen(req, timeout=600) as r:
-        data = json.loads(r.read().decode("utf-8"))
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
-    return data["message"]["content"].strip()
+def ollama_chat(model, messages, temperature, top_p, num_ctx):
+    client = OllamaClient()
+    try:
+        answer, _ = client.chat(model, messages, temperature, top_p, num_ctx, stream=False)
+    finally:
+        client.close()
+    return answer
+
+def stream_printer(out=sys.stdout):
+    started = False
+
+    def on_token(tok):
+        nonlocal started
+        # drop the leading whitespace models like to open with; print the rest as it comes
+        if not started:
+            tok = tok.lstrip()
+            if not tok:
+                return
+            started = True
+        out.write(tok)
+        out.flush()
+
+    return on_token
+
+_FTS_OR_TERM = re.compile(r'[\w]+|"[^"]*"')
+
+def normalize_fts(fts_q):
+    """
+    Cache-key form of an FTS query. A flat "a OR b OR c" ranks the same whatever the
+    term order, so its terms are sorted: questions that only differ in which anchor
+    term comes first share an entry.
+    """
+    q = " ".join(fts_q.split())
+    terms = re.split(r" OR ", q)
+    if len(terms) > 1 and all(_FTS_OR_TERM.fullmatch(t) for t in terms):
+        return " OR ".join(sorted(t.lower() for t in terms))
+    return q
 
-def main():
-    ap = argparse.ArgumentParser("Ask questions grounded in your local corpus")
-    ap.add_argument("question", nargs="+")
-    ap.add_argument("--k", type=int, default=8)
-    ap.add_argument("--ext", default="")
-    ap.add_argument("--like", default="")
-    ap.add_argument("--path-eq", default="")
-    ap.add_argument("--work-id", default="")
-    ap.add_argument("--work-like", default="")
-    ap.add_argument("--model", default="command-r:latest")
-    ap.add_argument("--temperature", type=float, default=0.2)
-    ap.add_argument("--top-p", type=float, default=0.9)
-    ap.add_argument("--num-ctx", type=int, default=8192)
-    ap.add_argument("--show-sources", action="store_true")
-    ap.add_argument("--fts", default="", help="Override the FTS query directly (advanced). Example: 'predestination OR grace'")
-    ap.add_argument("--debug-fts", action="store_true", help="Print the FTS queries tried.")
-    args = ap.parse_args()
+class RetrievalCache:
+    """
+    On-disk LRU of search_chunks() results keyed by (normalized FTS query, filters, k,
+    manifest generation). Ingest runs bump meta.generation, so stale entries are never
+    hit; they are dropped the first time a newer generation is seen.
+    """
 
-    question = " ".join(args.question).strip()
-    con = connect_db()
+    def __init__(self, path=RETRIEVAL_CACHE, max_entries=20000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._gen = None
+        self.con = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("""
+          CREATE TABLE IF NOT EXISTS retrieval (
+            key        TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL,
+            chunk_ids  TEXT NOT NULL,      -- JSON list
+            used_at    REAL NOT NULL
+          )
+        """)
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_retrieval_used ON retrieval(used_at)")
+        self.con.commit()
+
+    @staticmethod
+    def make_key(fts_q, k, filters):
+        raw = json.dumps([normalize_fts(fts_q), k, sorted(filters.items())], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _sync_generation(self, gen):
+        if gen != self._gen:
+            self.con.execute("DELETE FROM retrieval WHERE generation <> ?", (gen,))
+            self.con.commit()
+            self._gen = gen
+
+    def get(self, key, gen):
+        with self._lock:
+            self._sync_generation(gen)
+            row = self.con.execute(
+                "SELECT chunk_ids FROM retrieval WHERE key=? AND generation=?", (key, gen)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.con.execute("UPDATE retrieval SET used_at=? WHERE key=?", (time.time(), key))
+            self.con.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, gen, chunk_ids):
+        with self._lock:
+            self.con.execute(
+                "INSERT OR REPLACE INTO retrieval(key, generation, chunk_ids, used_at) VALUES(?,?,?,?)",
+                (key, gen, json.dumps(chunk_ids), time.time())
+            )
+            n = self.con.execute("SELECT count(*) FROM retrieval").fetchone()[0]
+            if n > self.max_entries:
+                # evict least recently used down to 90% so this doesn't run on every put
+                self.con.execute("""
+                  DELETE FROM retrieval WHERE key IN (
+                    SELECT key FROM retrieval ORDER BY used_at LIMIT ?
+                  )
+                """, (n - int(self.max_entries * 0.9),))
+            self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+def cached_search(con, cache, fts_q, k, **filters):
+    if cache is None:
+        return search_chunks(con, fts_q, k, **filters)
+    gen = db_generation(con)
+    key = cache.make_key(fts_q, k, filters)
+    chunk_ids = cache.get(key, gen)
+    if chunk_ids is None:
+        chunk_ids = search_chunks(con, fts_q, k, **filters)
+        cache.put(key, gen, chunk_ids)
+    return chunk_ids
+
+def retrieve(con, question, k, fts="", cache=None, vectors=None, **filters):
+    """
+    Chunk ids for a question: --fts if given, else anchor terms, then an OR of the
+    question's words, then its longest word. Returns (chunk_ids, [(tag, fts_query), ...]).
+    With a RetrievalCache each of those searches is looked up there first.
+
+    With vectors (a corpus_embed.EmbeddingStore) the BM25 ranking is taken deeper and
+    fused (RRF) with the nearest chunks to the question's embedding.
+    """
+    if vectors is not None:
+        depth = max(k * HYBRID_DEPTH, 40)
+        bm25_ids, tried = retrieve(con, question, depth, fts=fts, cache=cache, **filters)
+        near = [cid for cid, _ in vectors.search(question, depth * 2)]
+        vec_ids = filter_chunk_ids(con, near, **filters)[:depth]
+        tried.append(("VECTOR", f"{len(vec_ids)} of {len(near)} nearest chunks pass the filters"))
+        return rrf_fuse([bm25_ids, vec_ids])[:k], tried
 
     tried = []
     chunk_ids = []
 
-    if args.fts.strip():
-        fts_q = args.fts.strip()
+    if fts.strip():
+        fts_q = fts.strip()
         tried.append(("--fts", fts_q))
-        chunk_ids = search_chunks(con, fts_q, args.k, ext=args.ext, like=args.like,
-                                  path_eq=args.path_eq, work_id=args.work_id, work_like=args.work_like)
+        chunk_ids = cached_search(con, cache, fts_q, k, **filters)
     else:
         fts_anchor = make_anchor_first_query(question)
         tried.append(("ANCHOR", fts_anchor))
         if fts_anchor:
-            chunk_ids = search_chunks(con, fts_anchor, args.k, ext=args.ext, like=args.like,
-                                      path_eq=args.path_eq, work_id=args.work_id, work_like=args.work_like)
+            chunk_ids = cached_search(con, cache, fts_anchor, k, **filters)
 
         if not chunk_ids:
             fts_or = make_or_fts_query(question)
             tried.append(("OR", fts_or))
             if fts_or:
-                chunk_ids = search_chunks(con, fts_or, args.k, ext=args.ext, like=args.like,
-                                          path_eq=args.path_eq, work_id=args.work_id, work_like=args.work_like)
+                chunk_ids = cached_search(con, cache, fts_or, k, **filters)
 
         if not chunk_ids:
             words = tokenize_for_fts(question)
@@ -276,11 +609,317 @@ def main():
                 one = sorted(set(words), key=lambda w: (-len(w), w))[0]
                 one = fts_term(one)
                 tried.append(("SINGLE", one))
-                chunk_ids = search_chunks(con, one, args.k, ext=args.ext, like=args.like,
-                                          path_eq=args.path_eq, work_id=args.work_id, work_like=args.work_like)
+                chunk_ids = cached_search(con, cache, one, k, **filters)
+
+    return chunk_ids, tried
+
+def load_sources(con, chunk_ids, with_copies=False):
+    # retrieval order is the ranking; score it so pack_sources can keep it after merging
+    sources = [fetch_chunk(con, cid, score=1.0 / rank) for rank, cid in enumerate(chunk_ids, 1)]
+    copies = [copies_of(con, src.doc_id) if src.doc_id else [] for src in sources] if with_copies else []
+    return sources, copies
+
+# per-question keys a --batch line may set; anything missing falls back to the CLI flags
+BATCH_FILTERS = ("ext", "like", "path_eq", "work_id", "work_like", "max_garbage", "min_chars", "lang")
+
+def read_batch(path):
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise SystemExit(f"{path}:{n}: bad JSON ({e})")
+            if isinstance(item, str):
+                item = {"question": item}
+            if not isinstance(item, dict) or not str(item.get("question", "")).strip():
+                raise SystemExit(f"{path}:{n}: expected an object with a \"question\"")
+            item.setdefault("id", n)
+            items.append(item)
+    return items
+
+async def run_batch(items, args, base_filters, out, cache=None, vectors=None):
+    """
+    Retrieval for every question runs on a thread pool (one read-only connection per
+    thread, or the search daemon with --server); finished retrievals feed a bounded
+    queue drained by --concurrency generation workers, each with its own keep-alive
+    Ollama connection. One JSONL record per question, in completion order.
+    """
+    loop = asyncio.get_running_loop()
+    local = threading.local()
+    cons = []
+    cons_lock = threading.Lock()
+
+    def retrieve_one(item):
+        t0 = time.perf_counter()
+        filters = {**base_filters, **{f: item[f] for f in BATCH_FILTERS if f in item}}
+        k = int(item.get("k", args.k))
+        fts = item.get("fts", args.fts)
+        if args.server:
+            from corpus_searchd import query_server
+            res = query_server(args.server_url, "/retrieve",
+                               {"question": item["question"], "k": k, "fts": fts, **filters})
+            chunk_ids, tried, sources = res["chunk_ids"], res["tried"], [Source(*s) for s in res["sources"]]
+        else:
+            con = getattr(local, "con", None)
+            if con is None:
+                con = local.con = connect_db(readonly=True)
+                with cons_lock:
+                    cons.append(con)
+            chunk_ids, tried = retrieve(con, item["question"], k, fts=fts, cache=cache,
+                                     vectors=vectors, **filters)
+            sources, _ = load_sources(con, chunk_ids)
+        return chunk_ids, tried, sources, time.perf_counter() - t0
+
+    pool = ThreadPoolExecutor(max_workers=args.retrieve_workers)
+    q = asyncio.Queue(maxsize=max(1, args.concurrency * 2))
+    done = {"ok": 0, "failed": 0}
+
+    def emit(rec):
+        out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        out.flush()
+
+    async def retrieve_item(item):
+        try:
+            return item, await loop.run_in_executor(pool, retrieve_one, item), None
+        except (sqlite3.Error, SystemExit, ValueError) as e:
+            return item, None, str(e)
+
+    async def producer():
+        # one retrieval per pool thread in flight; the next item is only started once a
+        # finished one has been handed to the (bounded) queue, so a slow generation side
+        # holds back retrieval instead of piling finished results up in memory
+        pending_items = iter(items)
+
+        def start_next(running):
+            item = next(pending_items, None)
+            if item is not None:
+                running.add(asyncio.ensure_future(retrieve_item(item)))
+
+        running = set()
+        for _ in range(max(1, args.retrieve_workers)):
+            start_next(running)
+        try:
+            while running:
+                finished, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for fut in finished:
+                    item, res, err = fut.result()
+                    await q.put((item, res, err, time.perf_counter()))
+                    start_next(running)
+        finally:
+            for fut in running:
+                fut.cancel()
+        for _ in range(args.concurrency):
+            await q.put(None)
+
+    async def worker():
+        client = OllamaClient(args.ollama_url)
+        try:
+            while True:
+                job = await q.get()
+                if job is None:
+                    return
+                item, res, err, ready = job
+                rec = {"id": item["id"], "question": item["question"], "model": args.model}
+                if err or not res[0]:
+                    rec.update(answer=None, error=err or "No relevant chunks found.",
+                               tried=res[1] if res else [], sources=[])
+                    done["failed"] += 1
+                    emit(rec)
+                    continue
+
+                chunk_ids, tried, sources, retrieve_s = res
+                if not args.no_pack:
+                    sources = pack_sources(item["question"], sources,
+                                           prompt_budget(item["question"], args.num_ctx, args.answer_tokens))
+                messages = build_prompt(item["question"], sources)
+                t_gen = time.perf_counter()
+                try:
+                    answer, stats = await asyncio.to_thread(
+                        client.chat, args.model, messages, args.temperature, args.top_p, args.num_ctx, True
+                    )
+                except (OSError, http.client.HTTPException, RuntimeError, ValueError) as e:
+                    answer, stats = None, {}
+                    rec["error"] = f"generation failed: {e}"
+                    client.close()
+                rec.update(
+                    answer=answer,
+                    tried=tried,
+                    sources=[
+                        {"rel_path": src.rel_path, "ext": src.ext, "chunk_id": src.chunk_id,
+                         "work_id": src.work_id, "work_title": src.work_title}
+                        for src in sources
+                    ],
+                    timings={"retrieve_s": round(retrieve_s, 3), "queued_s": round(t_gen - ready, 3), **stats},
+                )
+                done["ok" if answer is not None else "failed"] += 1
+                emit(rec)
+        finally:
+            client.close()
 
-    if not chunk_ids:
+    try:
+        await asyncio.gather(producer(), *(worker() for _ in range(args.concurrency)))
+    finally:
+        pool.shutdown(wait=True)
+        for con in cons:
+            con.close()
+    return done
+
+def safe_model_name(model):
+    # tri_ollama's SAFE_NAME: tr '/:.' '___'
+    return re.sub(r"[/:.]", "_", model)
+
+def fan_out(models, messages, args, run_dir):
+    """
+    Send one prompt to several models at once, a thread and keep-alive connection per
+    model. Each answer streams into run_dir/<model>.txt as it arrives (the files
+    tri_html_report reads); returns one result dict per model, in the order given.
+    """
+    run_dir.mkdir(parents=True, exist_ok=True)
+    print_lock = threading.Lock()
+
+    def run_one(model):
+        path = run_dir / (safe_model_name(model) + ".txt")
+        client = OllamaClient(args.ollama_url)
+        rec = {"model": model, "file": str(path), "answer": None, "error": None}
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                on_token = None if args.no_stream else stream_printer(f)
+                answer, stats = client.chat(model, messages, args.temperature, args.top_p, args.num_ctx,
+                                            stream=not args.no_stream, on_token=on_token)
+                if args.no_stream:
+                    f.write(answer)
+                f.write("\n")
+            rec.update(answer=answer, **stats)
+        except (OSError, http.client.HTTPException, RuntimeError, ValueError) as e:
+            rec["error"] = str(e)
+        finally:
+            client.close()
+        with print_lock:
+            state = f"failed: {rec['error']}" if rec["error"] else f"{rec['tokens']} tokens in {rec['total_s']:.1f}s"
+            print(f"  {model}: {state}", file=sys.stderr)
+        return rec
+
+    with ThreadPoolExecutor(max_workers=len(models)) as pool:
+        return list(pool.map(run_one, models))
+
+def print_fan_out_table(results, out=sys.stderr):
+    width = max(len("model"), *(len(r["model"]) for r in results))
+    print(f"{'model':<{width}}  {'ttft':>7}  {'tokens':>6}  {'tok/s':>6}  {'total':>7}", file=out)
+    for r in results:
+        if r["error"]:
+            print(f"{r['model']:<{width}}  failed: {r['error']}", file=out)
+            continue
+        ttft = f"{r['ttft_s']:.2f}s" if r["ttft_s"] is not None else "n/a"
+        tps = f"{r['tok_per_s']:.1f}" if r["tok_per_s"] else "n/a"
+        print(f"{r['model']:<{width}}  {ttft:>7}  {r['tokens']:>6}  {tps:>6}  {r['total_s']:>6.1f}s", file=out)
+
+def main():
+    ap = argparse.ArgumentParser("Ask questions grounded in your local corpus")
+    ap.add_argument("question", nargs="*")
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--ext", default="")
+    ap.add_argument("--like", default="")
+    ap.add_argument("--path-eq", default="")
+    ap.add_argument("--work-id", default="")
+    ap.add_argument("--work-like", default="")
+    ap.add_argument("--max-garbage", type=float, default=MAX_GARBAGE,
+                    help=f"Skip chunks whose OCR-garbage ratio exceeds this (default {MAX_GARBAGE}; 1 = keep all).")
+    ap.add_argument("--min-chars", type=int, default=0, help="Skip chunks shorter than this many characters.")
+    ap.add_argument("--lang", default="", help="Restrict to chunks detected as this language (en, la, de, ...).")
+    ap.add_argument("--model", default="command-r:latest")
+    ap.add_argument("--models", default="",
+                    help="Comma-separated models to answer in parallel from one retrieval (e.g. enoch-md,qwen-md,gemma-md).")
+    ap.add_argument("--runs-dir", default=str(TRI_RUNS),
+                    help="With --models: answers go to <runs-dir>/<timestamp>/<model>.txt plus timings.json.")
+    ap.add_argument("--temperature", type=float, default=0.2)
+    ap.add_argument("--top-p", type=float, default=0.9)
+    ap.add_argument("--num-ctx", type=int, default=8192)
+    ap.add_argument("--answer-tokens", type=int, default=ANSWER_TOKENS,
+                    help="Part of --num-ctx kept free for the answer when packing sources.")
+    ap.add_argument("--no-pack", action="store_true",
+                    help="Send every retrieved chunk whole (no merging, trimming or token budget).")
+    ap.add_argument("--show-sources", action="store_true")
+    ap.add_argument("--ollama-url", default=OLLAMA_URL)
+    ap.add_argument("--no-stream", action="store_true", help="Wait for the whole answer instead of printing tokens as they arrive.")
+    ap.add_argument("--fts", default="", help="Override the FTS query directly (advanced). Example: 'predestination OR grace'")
+    ap.add_argument("--debug-fts", action="store_true", help="Print the FTS queries tried.")
+    ap.add_argument("--server", action="store_true", help="Retrieve through a running corpus_searchd.py.")
+    ap.add_argument("--server-url", default=SEARCHD_URL, help=f"corpus_searchd.py address (default {SEARCHD_URL}).")
+    ap.add_argument("--hybrid", action="store_true",
+                    help="Fuse BM25 with vector search over corpus_embed.py embeddings (needs numpy).")
+    ap.add_argument("--no-cache", action="store_true", help="Skip the on-disk retrieval cache.")
+    ap.add_argument("--cache-size", type=int, default=20000, help="Retrieval cache entries kept (LRU).")
+    ap.add_argument("--batch", default="",
+                    help="JSONL file of questions: {\"question\": ..., \"id\"?, \"k\"?, \"fts\"?, \"work_id\"?, \"like\"?, \"ext\"?, ...}")
+    ap.add_argument("--out", default="", help="With --batch: write JSONL results here (default stdout).")
+    ap.add_argument("--retrieve-workers", type=int, default=8, help="With --batch: concurrent FTS retrievals.")
+    ap.add_argument("--concurrency", type=int, default=2, help="With --batch: concurrent Ollama generations.")
+    args = ap.parse_args()
+
+    question = " ".join(args.question).strip()
+    if bool(question) == bool(args.batch):
+        ap.error("give either a question or --batch FILE")
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    if models and args.batch:
+        ap.error("--models answers one question; use --model with --batch")
+    filters = dict(ext=args.ext, like=args.like, path_eq=args.path_eq, work_id=args.work_id,
+                   work_like=args.work_like, max_garbage=args.max_garbage,
+                   min_chars=args.min_chars, lang=args.lang)
+
+    vectors = None
+    if args.hybrid:
+        if args.server:
+            ap.error("--hybrid retrieves locally; drop --server")
+        from corpus_embed import EmbeddingStore
+        vectors = EmbeddingStore()
+        if vectors.model is None:
+            raise SystemExit("No embeddings yet; run corpus_embed.py first.")
+
+    cache = None
+    if not args.no_cache and not args.server:
+        try:
+            cache = RetrievalCache(max_entries=args.cache_size)
+        except sqlite3.Error as e:
+            print(f"WARN: retrieval cache disabled ({RETRIEVAL_CACHE}: {e})", file=sys.stderr)
+
+    if args.batch:
+        items = read_batch(args.batch)
+        t0 = time.perf_counter()
+        out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+        try:
+            done = asyncio.run(run_batch(items, args, filters, out, cache, vectors))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+            if cache is not None:
+                cache.close()
+        print(f"Batch: {len(items)} questions  answered={done['ok']} failed={done['failed']}  "
+              f"in {time.perf_counter() - t0:,.1f}s", file=sys.stderr)
+        return
+
+    if args.server:
+        from corpus_searchd import query_server
+        res = query_server(args.server_url, "/retrieve", {
+            "question": question, "k": args.k, "fts": args.fts, "with_copies": args.show_sources, **filters,
+        })
+        chunk_ids, tried = res["chunk_ids"], [tuple(t) for t in res["tried"]]
+        sources, copies = [Source(*src) for src in res["sources"]], res["copies"]
+    else:
+        con = connect_db()
+        chunk_ids, tried = retrieve(con, question, args.k, fts=args.fts, cache=cache,
+                                 vectors=vectors, **filters)
+        sources, copies = load_sources(con, chunk_ids, with_copies=args.show_sources)
         con.close()
+        if cache is not None:
+            if args.debug_fts:
+                print(f"Retrieval cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+            cache.close()
+
+    if not chunk_ids:
         print("No relevant chunks found.")
         if tried:
             print("Tried FTS queries:")
@@ -288,29 +927,73 @@ def main():
                 print(f"  - {tag}: {tq!r}")
         sys.exit(1)
 
-    sources = [fetch_chunk(con, cid) for cid in chunk_ids]
-    con.close()
-
     if args.debug_fts:
         print("Tried FTS queries:")
         for tag, tq in tried:
             print(f"  - {tag}: {tq!r}")
         print("=" * 80)
 
-    messages = build_prompt(question, sources)
-    answer = ollama_chat(args.model, messages, args.temperature, args.top_p, args.num_ctx)
-    print(answer)
+    packed = sources
+    if not args.no_pack:
+        budget = prompt_budget(question, args.num_ctx, args.answer_tokens)
+        packed = pack_sources(question, sources, budget)
+        if args.debug_fts:
+            raw = sum(estimate_tokens(src.text) for src in sources)
+            print(f"Context: {len(sources)} chunks (~{raw:,} tokens) -> {len(packed)} passages "
+                  f"(~{sum(estimate_tokens(src.text) for src in packed):,} tokens, budget {budget:,})")
+    messages = build_prompt(question, packed)
+
+    if models:
+        run_dir = Path(args.runs_dir).expanduser() / time.strftime("%Y%m%d_%H%M%S")
+        print(f"Asking {len(models)} models ({len(packed)} passages) -> {run_dir}", file=sys.stderr)
+        t0 = time.perf_counter()
+        results = fan_out(models, messages, args, run_dir)
+        wall = time.perf_counter() - t0
+        with open(run_dir / "timings.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "question": question,
+                "sources": [src.chunk_id for src in packed],
+                "wall_s": round(wall, 3),
+                "models": [{k: v for k, v in r.items() if k != "answer"} for r in results],
+            }, f, indent=2)
+        for r in results:
+            print("\n" + "=" * 80)
+            print(f"## {r['model']}\n")
+            print(r["answer"] if r["answer"] is not None else f"(failed: {r['error']})")
+        print(file=sys.stderr)
+        print_fan_out_table(results)
+        print(f"wall {wall:.1f}s  (HTML: tri_html_report {run_dir})", file=sys.stderr)
+        if all(r["error"] for r in results):
+            sys.exit(1)
+    else:
+        client = OllamaClient(args.ollama_url)
+        try:
+            if args.no_stream:
+                answer, stats = client.chat(args.model, messages, args.temperature, args.top_p, args.num_ctx,
+                                            stream=False)
+                print(answer)
+            else:
+                answer, stats = client.chat(args.model, messages, args.temperature, args.top_p, args.num_ctx,
+                                            stream=True, on_token=stream_printer())
+                print()
+        finally:
+            client.close()
+        ttft = f"{stats['ttft_s']:.2f}s" if stats["ttft_s"] is not None else "n/a"
+        print(f"[ttft {ttft}  {stats['tokens']} tokens  {stats['tok_per_s'] or 0:.1f} tok/s  total {stats['total_s']:.1f}s]",
+              file=sys.stderr)
 
     if args.show_sources:
         print("\n" + "=" * 80)
-        for rel, ext, work_title, work_id, vol_idx, vol_total, cid, txt in sources:
-            head = f"\n[{rel}] ({ext}) chunk={cid}"
-            if work_id and work_title:
+        for src, others in zip(sources, copies):
+            head = f"\n[{src.rel_path}] ({src.ext}) chunk={src.chunk_id}"
+            if src.work_id and src.work_title:
                 v = ""
-                if vol_idx is not None:
-                    v = f" vol={vol_idx}" + (f"/{vol_total}" if vol_total else "")
-                head += f"  work='{work_title}' work_id={work_id}{v}"
-            print(head + "\n" + txt.strip())
+                if src.vol_idx is not None:
+                    v = f" vol={src.vol_idx}" + (f"/{src.vol_total}" if src.vol_total else "")
+                head += f"  work='{src.work_title}' work_id={src.work_id}{v}"
+            for other in others:
+                head += f"\n  also: {other}"
+            print(head + "\n" + src.text.strip())
 
 if __name__ == "__main__":
     main()
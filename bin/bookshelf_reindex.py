@@ -2,6 +2,8 @@
 import os, sys, json, sqlite3, hashlib, time
 from pathlib import Path
 
+from corpus_walk import walk
+
 APP_DIR = Path("/home/mario/FineTuningAI/bookshelf_app")
 DB_PATH = APP_DIR / "catalog.sqlite"
 OVERRIDES_PATH = APP_DIR / "overrides.json"
@@ -116,14 +118,15 @@ def upsert(conn, row):
 
 
 def scan_pdfs():
+    # os.DirEntry per PDF, streamed; entry.stat() reuses the directory scan
     for root in PDF_ROOTS:
         if not root.exists():
             continue
-        for p in root.rglob("*.pdf"):
+        for e in walk(root, lambda name: name.endswith(".pdf")):
             # ignore hidden/systemy dirs if desired
-            if "/.trash" in str(p).lower():
+            if "/.trash" in e.path.lower():
                 continue
-            yield p
+            yield e
 
 
 def main():
@@ -145,11 +148,12 @@ def main():
     added = updated = 0
     t0 = time.time()
 
-    for p in scan_pdfs():
+    for e in scan_pdfs():
         try:
-            st = p.stat()
+            st = e.stat()
         except OSError:
             continue
+        p = Path(e.path)
 
         fid = file_id(p, st)
         title, author, spine = guess_title_author_spine(p)
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
-import argparse, json, sqlite3
+import argparse, sqlite3
 from pathlib import Path
 from typing import Any
 
+from corpus_json_stream import iter_events, peek_object
+
 def looks_like_text_json(obj: Any) -> bool:
     # Sefaria-style text JSON often has keys: text/he/en, versions, etc.
     if isinstance(obj, dict):
@@ -74,9 +76,13 @@ def main() -> int:
         rel = r["rel_path"]
         p = root / rel
         try:
-            # Read whole file (most are small). If you ever hit a monster file, we can stream later.
-            raw = p.read_text(encoding="utf-8", errors="replace")
-            obj = json.loads(raw)
+            # Only the first few KB are parsed (streamed), so monster files cost the same as
+            # small ones; a file that is broken further in is caught by corpus_digest_json_run.
+            events = iter_events(p)
+            try:
+                obj, _ = peek_object(events)
+            finally:
+                events.close()
             if looks_like_text_json(obj):
                 to_text.append(r)
             else:
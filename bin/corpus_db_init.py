@@ -1,15 +1,14 @@
 #!/usr/bin/env python3
+import argparse
 import sqlite3
+import time
 from pathlib import Path
 
-DB = Path("/ai_data/ai_corpus/manifest.sqlite")
-DB.parent.mkdir(parents=True, exist_ok=True)
+from corpus_manifest import ensure_schema, fts_is_external
 
-con = sqlite3.connect(DB)
-con.execute("PRAGMA journal_mode=WAL;")
-con.execute("PRAGMA synchronous=NORMAL;")
+DB = Path("/ai_data/ai_corpus/manifest.sqlite")
 
-con.executescript("""
+DOCS_SQL = """
 CREATE TABLE IF NOT EXISTS docs (
   doc_id       TEXT PRIMARY KEY,
   rel_path     TEXT NOT NULL,
@@ -26,47 +25,159 @@ CREATE TABLE IF NOT EXISTS docs (
   source       TEXT,
   language     TEXT,
   status       TEXT,
+  dup_of       TEXT,          -- doc_id owning the chunk set when norm_hash is shared
   updated_at   TEXT NOT NULL DEFAULT (datetime('now'))
 );
 
 CREATE INDEX IF NOT EXISTS idx_docs_rel_path ON docs(rel_path);
 CREATE INDEX IF NOT EXISTS idx_docs_ext      ON docs(ext);
+CREATE INDEX IF NOT EXISTS idx_docs_norm_hash ON docs(norm_hash);
+"""
 
+CHUNKS_SQL = """
 CREATE TABLE IF NOT EXISTS chunks (
-  chunk_id     TEXT PRIMARY KEY,
+  id           INTEGER PRIMARY KEY,   -- stable rowid; chunks_fts points here
+  chunk_id     TEXT NOT NULL UNIQUE,
   doc_id       TEXT NOT NULL,
   chunk_idx    INTEGER NOT NULL,
   start_char   INTEGER NOT NULL,
   end_char     INTEGER NOT NULL,
   text         TEXT NOT NULL,
+  boilerplate  INTEGER NOT NULL DEFAULT 0,   -- 1 = licence/transcriber text, skipped by search
+  garbage_ratio REAL NOT NULL DEFAULT 0,     -- share of odd (OCR noise) characters
+  char_len     INTEGER NOT NULL DEFAULT 0,
+  lang         TEXT NOT NULL DEFAULT '',     -- function-word guess: en, la, de, ... or ''
   created_at   TEXT NOT NULL DEFAULT (datetime('now')),
   FOREIGN KEY(doc_id) REFERENCES docs(doc_id) ON DELETE CASCADE
 );
 
 CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_id);
+"""
 
--- Full-text search over chunk text
+# Full-text search over chunk text.
+# External content: the index reads chunk_id/doc_id/text from chunks by rowid, so the
+# text is stored once (in chunks) instead of twice.
+FTS_SQL = """
 CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
   chunk_id UNINDEXED,
   doc_id   UNINDEXED,
   text,
+  content = 'chunks',
+  content_rowid = 'id',
   tokenize = 'unicode61'
 );
+"""
 
--- Keep FTS in sync (simple triggers)
+# Keep FTS in sync. External-content tables are maintained by hand: a delete must
+# hand FTS5 the old values so it can remove the right tokens.
+FTS_TRIGGERS_SQL = """
 CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
-  INSERT INTO chunks_fts(chunk_id, doc_id, text) VALUES (new.chunk_id, new.doc_id, new.text);
+  INSERT INTO chunks_fts(rowid, chunk_id, doc_id, text) VALUES (new.id, new.chunk_id, new.doc_id, new.text);
 END;
 
 CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
-  DELETE FROM chunks_fts WHERE chunk_id = old.chunk_id;
+  INSERT INTO chunks_fts(chunks_fts, rowid, chunk_id, doc_id, text) VALUES ('delete', old.id, old.chunk_id, old.doc_id, old.text);
 END;
 
-CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE ON chunks BEGIN
-  UPDATE chunks_fts SET text=new.text WHERE chunk_id=new.chunk_id;
+CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE OF text ON chunks BEGIN
+  INSERT INTO chunks_fts(chunks_fts, rowid, chunk_id, doc_id, text) VALUES ('delete', old.id, old.chunk_id, old.doc_id, old.text);
+  INSERT INTO chunks_fts(rowid, chunk_id, doc_id, text) VALUES (new.id, new.chunk_id, new.doc_id, new.text);
 END;
-""")
+"""
+
+FTS_TRIGGERS = ("chunks_ai", "chunks_ad", "chunks_au")
+
+
+def init_db(con) -> None:
+  con.executescript(DOCS_SQL + CHUNKS_SQL + FTS_SQL + FTS_TRIGGERS_SQL)
+  con.commit()
+
+
+def migrate_fts(con, vacuum: bool = True) -> None:
+  """
+  Convert a manifest.sqlite with a self-contained chunks_fts (its own copy of text)
+  to the external-content layout, in place:
+    1. drop the old FTS table + triggers (frees the duplicate text for reuse)
+    2. copy chunks into a table with an INTEGER PRIMARY KEY the index can point at
+    3. rebuild chunks_fts from chunks in one pass, optimize, re-create triggers
+  """
+  if fts_is_external(con):
+    print("chunks_fts already uses external content; nothing to migrate.")
+    return
+
+  t0 = time.time()
+  n = con.execute("SELECT count(*) FROM chunks").fetchone()[0]
+  print(f"Migrating {n:,} chunks to external-content FTS5 ...")
+
+  # One script, one transaction: on error nothing is half-migrated.
+  drops = "".join(f"DROP TRIGGER IF EXISTS {t};\n" for t in FTS_TRIGGERS)
+  script = (
+    "BEGIN;\n"
+    + drops
+    + "DROP TABLE IF EXISTS chunks_fts;\n"
+    + "ALTER TABLE chunks RENAME TO chunks_old;\n"
+    + "DROP INDEX IF EXISTS idx_chunks_doc;\n"
+    + "DROP INDEX IF EXISTS idx_chunks_quality;\n"
+    + CHUNKS_SQL
+    + """
+      INSERT INTO chunks(chunk_id, doc_id, chunk_idx, start_char, end_char, text, created_at)
+      SELECT chunk_id, doc_id, chunk_idx, start_char, end_char, text, created_at
+      FROM chunks_old ORDER BY doc_id, chunk_idx;
+      DROP TABLE chunks_old;
+    """
+    + FTS_SQL
+    + """
+      INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild');
+      INSERT INTO chunks_fts(chunks_fts) VALUES ('optimize');
+    """
+    + FTS_TRIGGERS_SQL
+    + "COMMIT;\n"
+  )
+  try:
+    con.executescript(script)
+  except Exception:
+    if con.in_transaction:
+      con.rollback()
+    raise
+  print(f"  index rebuilt in {time.time() - t0:,.1f}s")
+
+  if vacuum:
+    # hand the freed pages (old FTS copy of the text) back to the filesystem
+    t1 = time.time()
+    con.execute("VACUUM")
+    print(f"  vacuumed in {time.time() - t1:,.1f}s")
+
+
+def main():
+  ap = argparse.ArgumentParser(description="Create (or migrate) /ai_data/ai_corpus/manifest.sqlite.")
+  ap.add_argument("--db", default=str(DB))
+  ap.add_argument("--migrate-fts", action="store_true",
+                  help="Convert an existing chunks_fts to external-content FTS5 and rebuild it in place")
+  ap.add_argument("--no-vacuum", action="store_true", help="With --migrate-fts: skip the final VACUUM")
+  args = ap.parse_args()
+
+  db = Path(args.db)
+  db.parent.mkdir(parents=True, exist_ok=True)
+
+  con = sqlite3.connect(db)
+  con.execute("PRAGMA journal_mode=WAL;")
+  con.execute("PRAGMA synchronous=NORMAL;")
+
+  if args.migrate_fts:
+    migrate_fts(con, vacuum=not args.no_vacuum)
+
+  if con.execute("SELECT 1 FROM sqlite_master WHERE name='chunks_fts'").fetchone() and not fts_is_external(con):
+    print("NOTE: chunks_fts stores its own copy of the text; run with --migrate-fts to convert it.")
+    con.close()
+    return
+
+  init_db(con)
+  # column/index upgrades for databases created by older versions of this script
+  ensure_schema(con)
+
+  con.close()
+  print(f"Initialized: {db}")
+
 
-con.commit()
-con.close()
-print(f"Initialized: {DB}")
+if __name__ == "__main__":
+  main()
@@ -1,13 +1,25 @@
 #!/usr/bin/env python3
-import argparse, json, re, sqlite3
+"""
+Digest Sefaria-style JSON items into _digested_json/<rel_path>.txt in one streaming pass.
+
+  - RAW .json items are classified from their first few KB (looks_like_text_json on a
+    truncated object); META ones stop there, text ones keep the same parse going and
+    are flattened straight to disk. RAW_TEXTJSON items (already classified) are
+    flattened directly. Files are never loaded whole (corpus_json_stream).
+  - files are processed in a bounded process pool (--workers); status updates are
+    batched (--commit-every); outputs are written atomically
+"""
+import argparse, os, re, sqlite3, sys, time
 from pathlib import Path
-from typing import Any, Iterable, List, Union
+from typing import Any, Iterable, List
 
-def normalize_text(s: str) -> str:
-    s = s.replace("\r\n", "\n").replace("\r", "\n")
-    # collapse excessive blank lines
-    s = re.sub(r"\n{4,}", "\n\n\n", s)
-    return s.strip() + "\n"
+from corpus_classify_json_raw import looks_like_text_json
+from corpus_json_stream import classify_and_flatten, flatten_events, iter_events
+from corpus_manifest import pool_map
+
+PAGE_SIZE = 500
+
+_GAPS = re.compile(r"\n{4,}")
 
 def flatten_text(obj: Any) -> List[str]:
     """
@@ -15,6 +27,9 @@ def flatten_text(obj: Any) -> List[str]:
       - dict with 'text' or 'he'/'en' or nested structures
       - lists of strings or lists of lists
     Returns list of paragraph-ish strings.
+
+    Not used by the streaming path: this is the reference for what
+    corpus_json_stream.flatten_events() must produce on a parsed object.
     """
     out: List[str] = []
 
@@ -47,6 +62,71 @@ def flatten_text(obj: Any) -> List[str]:
     add(obj)
     return out
 
+def write_parts(out_path: Path, parts: Iterable[str]) -> int:
+    """
+    "\n\n".join(parts) written as the parts arrive, with CRLF/CR turned into LF, runs of
+    4+ newlines cut to 3 and a final newline; returns chars written.
+    """
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + f".part{os.getpid()}")
+    n = 0
+    try:
+        with tmp.open("w", encoding="utf-8") as f:
+            sep = ""
+            for t in parts:
+                t = _GAPS.sub("\n\n\n", t.replace("\r\n", "\n").replace("\r", "\n"))
+                f.write(sep + t)
+                n += len(sep) + len(t)
+                sep = "\n\n"
+            f.write("\n")
+        os.replace(tmp, out_path)
+    except BaseException:
+        # a parse error halfway through: leave no partial output behind
+        tmp.unlink(missing_ok=True)
+        raise
+    return n + 1
+
+def digest_json(task: tuple) -> tuple:
+    """Classify (RAW) and/or flatten one file; returns (item_id, rel_path, new_status, note). Runs in a worker."""
+    item_id, rel_path, status, src, out_path = task
+    try:
+        if not os.path.exists(src):
+            raise FileNotFoundError(f"missing source: {src}")
+        if status == "RAW":
+            try:
+                is_text, parts = classify_and_flatten(src, looks_like_text_json)
+            except (ValueError, StopIteration):
+                # not parseable even at the start: metadata/junk, as the classifier did
+                return item_id, rel_path, "META", "JSON_PARSE_FAIL"
+            if not is_text:
+                return item_id, rel_path, "META", None
+        else:
+            parts = flatten_events(iter_events(src))
+        write_parts(Path(out_path), parts)
+        return item_id, rel_path, "DIGESTED", None
+    except Exception as e:
+        return item_id, rel_path, "FAILED", str(e) or type(e).__name__
+
+def iter_items(db: sqlite3.Connection, statuses: tuple, page_size: int = PAGE_SIZE):
+    """.json items with one of statuses in rel_path order, one keyset page at a time."""
+    marks = ",".join("?" * len(statuses))
+    # items corpus_index_build.py knows are gone from disk are skipped, not FAILED
+    cols = {r[1] for r in db.execute("pragma table_info(corpus_items)")}
+    present = "and missing_utc is null" if "missing_utc" in cols else ""
+    last = ""
+    while True:
+        page = db.execute(f"""
+          select sha256, rel_path, status
+          from corpus_items
+          where status in ({marks}) and ext='.json' {present} and rel_path > ?
+          order by rel_path
+          limit ?
+        """, (*statuses, last, page_size)).fetchall()
+        if not page:
+            return
+        yield from page
+        last = page[-1]["rel_path"]
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--db", default="/ai_data/ebooks/_corpus_index/corpus_index.sqlite")
@@ -54,64 +134,76 @@ def main() -> int:
     ap.add_argument("--out", default="/ai_data/ebooks/_digested_json")
     ap.add_argument("--log", default="/ai_data/ebooks/_corpus_index/digest_json_errors.log")
     ap.add_argument("--limit", type=int, default=250)
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                    help="Parser processes (default: half the CPUs)")
+    ap.add_argument("--commit-every", type=int, default=200, help="Batch this many status updates per commit")
+    ap.add_argument("--skip-raw", action="store_true",
+                    help="Only digest items already classified RAW_TEXTJSON (leave RAW .json alone)")
     args = ap.parse_args()
 
     db = sqlite3.connect(args.db)
     db.row_factory = sqlite3.Row
+    db.execute("PRAGMA busy_timeout=30000")
 
     out_root = Path(args.out)
     src_root = Path(args.root)
     log_path = Path(args.log)
     log_path.parent.mkdir(parents=True, exist_ok=True)
 
-    q = """
-    select sha256, rel_path, ext
-    from corpus_items
-    where status='RAW_TEXTJSON' and ext='.json'
-    order by rel_path
-    """
-    rows = list(db.execute(q))
-    if args.limit and args.limit > 0:
-        rows = rows[:args.limit]
-
-    ok = 0
-    fail = 0
-
-    for r in rows:
-        item_id = r["sha256"]
-        rel_path = r["rel_path"]
-        src = src_root / rel_path
-        out_path = out_root / (rel_path + ".txt")
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-
-        try:
-            if not src.exists():
-                raise FileNotFoundError(f"missing source: {src}")
-
-            data = json.loads(src.read_text(encoding="utf-8", errors="replace"))
-            parts = flatten_text(data)
-
-            # Join with paragraph breaks; keep some structure
-            text = "\n\n".join(parts)
-            text = normalize_text(text)
-
-            out_path.write_text(text, encoding="utf-8")
-
-            db.execute("update corpus_items set status='DIGESTED' where sha256=?", (item_id,))
-            db.commit()
-            ok += 1
-
-        except Exception as e:
-            fail += 1
-            db.execute(
-                "update corpus_items set status='FAILED', notes=coalesce(notes,'') || '\nDIGEST_JSON_FAIL: ' || ? where sha256=?",
-                (str(e), item_id),
-            )
-            db.commit()
+    counts = {"DIGESTED": 0, "META": 0, "FAILED": 0}
+    pending: list[tuple] = []
+    t0 = time.time()
+
+    def flush() -> None:
+        for item_id, rel_path, status, note in pending:
+            if status == "DIGESTED":
+                db.execute("update corpus_items set status='DIGESTED' where sha256=?", (item_id,))
+            elif status == "META":
+                db.execute(
+                    "update corpus_items set status='META', notes=coalesce(notes,'') || ? where sha256=?",
+                    ("\n" + note if note else "", item_id),
+                )
+            else:
+                db.execute(
+                    "update corpus_items set status='FAILED', notes=coalesce(notes,'') || '\nDIGEST_JSON_FAIL: ' || ? where sha256=?",
+                    (note, item_id),
+                )
+        db.commit()
+        failed = [p for p in pending if p[2] == "FAILED"]
+        if failed:
             with log_path.open("a", encoding="utf-8") as f:
-                f.write(f"FAIL\t{rel_path}\t.json\t{e}\n")
-
-    print(f"DIGEST_JSON DONE ok={ok} fail={fail} out={out_root} log={log_path}")
+                for _, rel_path, _, note in failed:
+                    f.write(f"FAIL\t{rel_path}\t.json\t{note}\n")
+        pending.clear()
+
+    statuses = ("RAW_TEXTJSON",) if args.skip_raw else ("RAW", "RAW_TEXTJSON")
+
+    def tasks():
+        for n, r in enumerate(iter_items(db, statuses)):
+            if args.limit and n >= args.limit:
+                return
+            rel_path = r["rel_path"]
+            yield (r["sha256"], rel_path, r["status"], str(src_root / rel_path),
+                   str(out_root / (rel_path + ".txt")))
+
+    results = pool_map(digest_json, tasks(), args.workers) if args.workers > 1 else map(digest_json, tasks())
+    try:
+        for res in results:
+            counts[res[2]] += 1
+            pending.append(res)
+            if len(pending) >= args.commit_every:
+                flush()
+                done = sum(counts.values())
+                print(f"  digested={counts['DIGESTED']} meta={counts['META']} failed={counts['FAILED']}  "
+                      f"({done / (time.time() - t0):,.1f} files/s)", file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Interrupted; saving progress.", file=sys.stderr)
+    finally:
+        flush()
+        db.close()
+
+    print(f"DIGEST_JSON DONE ok={counts['DIGESTED']} meta={counts['META']} fail={counts['FAILED']} "
+          f"in {time.time() - t0:,.1f}s out={out_root} log={log_path}")
     return 0
 
 if __name__ == "__main__":
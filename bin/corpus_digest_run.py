@@ -1,23 +1,100 @@
 #!/usr/bin/env python3
+"""
+Digest RAW corpus_items (PDF/EPUB/XML/HTML) into plain text under _digested/.
+
+  - EPUB and HTML are converted in-process (corpus_html_text: zip members in spine
+    order, html.parser) unless --extractor lynx asks for the unzip+lynx path
+  - converters run in a bounded process pool (--workers); every converter call has a
+    timeout (--timeout): subprocess timeouts for pdftotext/unzip/lynx, a SIGALRM timer
+    for the in-process EPUB/HTML extractor. The workers' address space is capped
+    (--mem-mb), which the children inherit
+  - RAW rows are paged by (ext, rel_path) keyset instead of loaded at once
+  - status updates are batched (--commit-every); outputs are written atomically, so
+    after a crash a RAW row whose .txt is already there (and newer than the source)
+    is marked DIGESTED without converting it again
+
+With --to-manifest the _digested/*.txt stage (and the later corpus_ingest_txt.py
+re-read) is skipped: each worker normalizes and chunks the text in memory exactly as
+the ingest scripts do and compresses it for the docstore; this process writes the
+text once into docstore.sqlite (corpus_docstore) and the doc + chunks into
+manifest.sqlite (corpus_manifest.store_doc, so identical texts share one chunk set).
+PDFs get corpus_ingest_pdf.py's text (same pdftotext flags, --min-text), so either
+script stores the same doc. Docs of the DIGEST_EXTS types whose source file is gone
+are tombstoned at the end of the run; DIGESTED items that may be such a file under a
+new name (same type and size), or a tombstoned file that is back, are re-queued
+first, and a re-queued file whose text matches a gone doc takes over its chunks.
+"""
 import argparse
 import os
+import resource
+import signal
 import sqlite3
 import subprocess
+import sys
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+from corpus_docstore import DOCSTORE, DocStore, encode, norm_ref
+from corpus_html_text import epub_to_text, html_to_text
+from corpus_ingest_pdf import MIN_TEXT, pdf_text
+from corpus_ingest_txt import chunk_paragraph_aware, sha256_text
+from corpus_ingest_txt import normalize_text as ingest_normalize
+from corpus_manifest import (bump_generation, doc_id_for, ensure_schema, gone_hashes, pool_map, repoint_doc,
+                             store_doc, tombstone_docs)
+
 DB_DEFAULT = "/ai_data/ebooks/_corpus_index/corpus_index.sqlite"
 DIGEST_DEFAULT = "/ai_data/ebooks/_digested"
 LOG_DEFAULT = "/ai_data/ebooks/_corpus_index/digest_errors.log"
+MANIFEST_DEFAULT = "/ai_data/ai_corpus/manifest.sqlite"
+
+DIGEST_EXTS = (".pdf", ".epub", ".xml", ".html", ".htm", ".xhtml")
+PAGE_SIZE = 500
+
+# per-converter-call limit in seconds, EPUB/HTML extractor and the --to-manifest PDF
+# text minimum; set in each worker by init_worker()
+TIMEOUT = None
+EXTRACTOR = "builtin"
+PDF_MIN_TEXT = MIN_TEXT
 
 def run(cmd: list[str]) -> subprocess.CompletedProcess:
-    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"{cmd[0]} timed out after {TIMEOUT}s")
+
+@contextmanager
+def time_limit(what: str):
+    """Wall-clock TIMEOUT for in-process work (the subprocess calls have their own)."""
+    if not TIMEOUT:
+        yield
+        return
+
+    def expired(signum, frame):
+        raise RuntimeError(f"{what} timed out after {TIMEOUT}s")
+
+    try:
+        prev = signal.signal(signal.SIGALRM, expired)
+    except ValueError:
+        # not the main thread: signals can't be used here, run without the limit
+        yield
+        return
+    signal.setitimer(signal.ITIMER_REAL, TIMEOUT)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, prev)
 
 def ensure_parent(p: Path) -> None:
     p.parent.mkdir(parents=True, exist_ok=True)
 
 def write_text(out_path: Path, text: str) -> None:
+    # write-then-rename: a crash never leaves a half-written .txt behind
     ensure_parent(out_path)
-    out_path.write_text(text, encoding="utf-8", errors="replace")
+    tmp = out_path.with_name(out_path.name + f".part{os.getpid()}")
+    tmp.write_text(text, encoding="utf-8", errors="replace")
+    os.replace(tmp, out_path)
 
 def digest_pdf(src: Path) -> str:
     # pdftotext must be installed (poppler-utils)
@@ -27,6 +104,12 @@ def digest_pdf(src: Path) -> str:
     return cp.stdout
 
 def digest_epub(src: Path) -> str:
+    if EXTRACTOR == "builtin":
+        with time_limit("EPUB extraction"):
+            return epub_to_text(src)
+    return digest_epub_lynx(src)
+
+def digest_epub_lynx(src: Path) -> str:
     # Requires: unzip + lynx installed
     tmp = Path("/tmp") / f"epub_{os.getpid()}_{src.stem}"
     if tmp.exists():
@@ -69,6 +152,12 @@ def digest_xml(src: Path) -> str:
     return data
 
 def digest_html(src: Path) -> str:
+    if EXTRACTOR == "builtin":
+        with time_limit("HTML extraction"):
+            return html_to_text(src.read_bytes())
+    return digest_html_lynx(src)
+
+def digest_html_lynx(src: Path) -> str:
     cp = run(["lynx", "-dump", "-nolist", str(src)])
     if cp.returncode != 0:
         raise RuntimeError(cp.stderr.strip() or "lynx failed")
@@ -80,6 +169,133 @@ def normalize_text(t: str) -> str:
     t = "\n".join(line.rstrip() for line in t.splitlines())
     return t.strip() + "\n"
 
+def init_worker(timeout: float, mem_mb: int, extractor: str = "builtin", min_text: int = MIN_TEXT) -> None:
+    global TIMEOUT, EXTRACTOR, PDF_MIN_TEXT
+    TIMEOUT = timeout or None
+    EXTRACTOR = extractor
+    PDF_MIN_TEXT = min_text
+    if mem_mb > 0:
+        limit = mem_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def extract(src: Path, ext: str) -> str:
+    if not src.exists():
+        raise FileNotFoundError(f"missing source: {src}")
+    if ext == ".pdf":
+        return digest_pdf(src)
+    if ext == ".epub":
+        return digest_epub(src)
+    if ext == ".xml":
+        return digest_xml(src)
+    if ext in (".html", ".htm", ".xhtml"):
+        return digest_html(src)
+    raise RuntimeError(f"unsupported ext: {ext}")
+
+def digest_one(task: tuple) -> tuple:
+    """Convert one item; returns (item_id, rel_path, ext, error or None, None). Runs in a worker."""
+    item_id, rel_path, ext, src, out_path = task
+    try:
+        write_text(Path(out_path), normalize_text(extract(Path(src), ext)))
+        return item_id, rel_path, ext, None, None
+    except MemoryError:
+        return item_id, rel_path, ext, "out of memory (--mem-mb)", None
+    except Exception as e:
+        return item_id, rel_path, ext, str(e) or type(e).__name__, None
+
+def digest_to_chunks(task: tuple) -> tuple:
+    """
+    --to-manifest: convert, normalize, chunk and compress one item; returns
+    (item_id, rel_path, ext, error or None, (doc, chunks, encoded text)). Runs in a worker.
+    """
+    item_id, rel_path, ext, src = task
+    src = Path(src)
+    try:
+        if ext == ".pdf":
+            # corpus_ingest_pdf.py's extraction: same text (and norm_hash) whichever script stores it
+            if not src.exists():
+                raise FileNotFoundError(f"missing source: {src}")
+            norm = pdf_text(src, PDF_MIN_TEXT, TIMEOUT)
+        else:
+            norm = ingest_normalize(extract(src, ext))
+        st = src.stat()
+        doc_id = doc_id_for(rel_path)
+        doc = (doc_id, rel_path, os.path.realpath(src), ext.lstrip("."),
+               st.st_size, st.st_mtime_ns, sha256_text(norm), norm_ref(doc_id))
+        return item_id, rel_path, ext, None, (doc, chunk_paragraph_aware(norm), encode(norm))
+    except MemoryError:
+        return item_id, rel_path, ext, "out of memory (--mem-mb)", None
+    except Exception as e:
+        return item_id, rel_path, ext, str(e) or type(e).__name__, None
+
+def present_clause(db: sqlite3.Connection) -> str:
+    # corpus_index_build.py --incremental stamps missing_utc on items whose file is gone;
+    # those are skipped (not FAILED) and come back as RAW once the file reappears
+    cols = {r[1] for r in db.execute("pragma table_info(corpus_items)")}
+    return "and missing_utc is null" if "missing_utc" in cols else ""
+
+def iter_raw(db: sqlite3.Connection, page_size: int = PAGE_SIZE):
+    """RAW rows still on disk, in (ext, rel_path) order, one keyset page at a time."""
+    marks = ",".join("?" * len(DIGEST_EXTS))
+    present = present_clause(db)
+    last = ("", "")
+    while True:
+        page = db.execute(f"""
+          select sha256, rel_path, ext
+          from corpus_items
+          where status='RAW'
+            and ext in ({marks})
+            {present}
+            and (ext, rel_path) > (?, ?)
+          order by ext, rel_path
+          limit ?
+        """, (*DIGEST_EXTS, *last, page_size)).fetchall()
+        if not page:
+            return
+        yield from page
+        last = (page[-1]["ext"], page[-1]["rel_path"])
+
+def already_digested(src: Path, out_path: Path) -> bool:
+    try:
+        return out_path.stat().st_mtime >= src.stat().st_mtime
+    except OSError:
+        return False
+
+def manifest_docs(man: sqlite3.Connection) -> tuple[dict, set]:
+    """
+    (rel_path -> (doc_id, ext, size_bytes) for the live DIGEST_EXTS docs in manifest.sqlite,
+    rel_paths of the tombstoned ones).
+    """
+    exts = [e.lstrip(".") for e in DIGEST_EXTS]
+    live, tombstoned = {}, set()
+    for doc_id, rel_path, ext, size, nh in man.execute(
+        f"select doc_id, rel_path, ext, size_bytes, norm_hash from docs where ext in ({','.join('?' * len(exts))})",
+        exts,
+    ):
+        if nh is None:
+            tombstoned.add(rel_path)
+        else:
+            live[rel_path] = (doc_id, ext, size)
+    return live, tombstoned
+
+def requeue_digested(db: sqlite3.Connection, live: dict, tombstoned: set, gone_sizes: set) -> int:
+    """
+    Set DIGESTED items back to RAW when the manifest lacks their doc and they are either
+    a tombstoned file that is back, or possibly a vanished doc's file under a new name
+    ((ext, size) of a doc that just went missing). Returns the number re-queued.
+    """
+    marks = ",".join("?" * len(DIGEST_EXTS))
+    todo = [
+        (sha,)
+        for sha, rel_path, ext, size in db.execute(f"""
+          select sha256, rel_path, ext, size_bytes from corpus_items
+          where status='DIGESTED' and ext in ({marks}) {present_clause(db)}
+        """, DIGEST_EXTS).fetchall()
+        if rel_path not in live and (rel_path in tombstoned or ((ext or "").lower().lstrip("."), size) in gone_sizes)
+    ]
+    db.executemany("update corpus_items set status='RAW' where sha256=? and status='DIGESTED'", todo)
+    db.commit()
+    return len(todo)
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--db", default=DB_DEFAULT)
@@ -87,75 +303,166 @@ def main() -> int:
     ap.add_argument("--out", default=DIGEST_DEFAULT)
     ap.add_argument("--log", default=LOG_DEFAULT)
     ap.add_argument("--limit", type=int, default=0, help="0 = no limit (use for testing)")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                    help="Converter processes (default: half the CPUs)")
+    ap.add_argument("--timeout", type=float, default=600, help="Seconds per converter call (0 = none)")
+    ap.add_argument("--mem-mb", type=int, default=4096,
+                    help="Address-space limit per worker and its converters, MB (0 = none)")
+    ap.add_argument("--commit-every", type=int, default=100, help="Batch this many status updates per commit")
+    ap.add_argument("--extractor", choices=("builtin", "lynx"), default="builtin",
+                    help="EPUB/HTML to text in-process (default) or with unzip + lynx -dump")
+    ap.add_argument("--redo", action="store_true",
+                    help="Convert again even when an up-to-date .txt already exists for a RAW item")
+    ap.add_argument("--to-manifest", nargs="?", const=MANIFEST_DEFAULT, default="", metavar="DB",
+                    help=f"Skip _digested/: normalize + chunk straight into manifest.sqlite (default {MANIFEST_DEFAULT})")
+    ap.add_argument("--store", default=str(DOCSTORE),
+                    help="With --to-manifest: docstore.sqlite for the normalized texts")
+    ap.add_argument("--min-text", type=int, default=MIN_TEXT,
+                    help="With --to-manifest: minimum extracted PDF chars to accept (scan-only below this)")
     args = ap.parse_args()
 
     db = sqlite3.connect(args.db)
     db.row_factory = sqlite3.Row
+    db.execute("PRAGMA busy_timeout=30000")
 
     out_root = Path(args.out)
     src_root = Path(args.root)
     log_path = Path(args.log)
     log_path.parent.mkdir(parents=True, exist_ok=True)
 
-    q = """
-    select sha256, rel_path, ext
-    from corpus_items
-    where status='RAW'
-      and ext in ('.pdf','.epub','.xml','.html','.htm','.xhtml')
-    order by ext, rel_path
-    """
-    rows = list(db.execute(q))
-    if args.limit and args.limit > 0:
-        rows = rows[:args.limit]
+    man = store = None
+    if args.to_manifest:
+        man = sqlite3.connect(args.to_manifest)
+        man.execute("PRAGMA journal_mode=WAL;")
+        man.execute("PRAGMA synchronous=NORMAL;")
+        ensure_schema(man)
+        store = DocStore(Path(args.store))
+
+    # --to-manifest reconciliation: docs of our types whose source file is gone
+    live: dict = {}
+    gone: list[str] = []
+    gone_by_hash: dict[str, str] = {}
+    repointed: set[str] = set()
+    requeued = 0
+    if man is not None:
+        if src_root.is_dir():
+            live, tombstoned = manifest_docs(man)
+            vanished = [(rel_path, d) for rel_path, d in live.items() if not (src_root / rel_path).exists()]
+            gone = [doc_id for _, (doc_id, _, _) in vanished]
+            gone_by_hash = gone_hashes(man, gone)
+            requeued = requeue_digested(db, live, tombstoned, {(ext, size) for _, (_, ext, size) in vanished})
+        else:
+            print(f"WARN: {src_root} is not a directory; skipping the vanished-doc check", file=sys.stderr)
+    live_ids = {doc_id for doc_id, _, _ in live.values()}
 
     ok = 0
     fail = 0
+    resumed = 0
+    n_chunks = 0
+    done_ids: list[tuple] = []
+    failed: list[tuple] = []
+    t0 = time.time()
 
-    for r in rows:
-        item_id = r["sha256"]
-        rel_path = r["rel_path"]
-        ext = (r["ext"] or "").lower()
+    def flush() -> None:
+        if man is not None:
+            # texts, then the docs rows pointing at them, then the status: a crash in
+            # between only means re-storing an unchanged doc, which store_doc() makes a no-op
+            store.commit()
+            man.commit()
+        db.executemany("update corpus_items set status='DIGESTED' where sha256=? and status='RAW'", done_ids)
+        db.executemany(
+            "update corpus_items set status='FAILED', notes=coalesce(notes,'') || '\nDIGEST_FAIL: ' || ? "
+            "where sha256=? and status='RAW'",
+            [(err, item_id) for item_id, _, _, err in failed],
+        )
+        db.commit()
+        if failed:
+            with log_path.open("a", encoding="utf-8") as f:
+                for _, rel_path, ext, err in failed:
+                    f.write(f"FAIL\t{rel_path}\t{ext}\t{err}\n")
+        done_ids.clear()
+        failed.clear()
 
-        src = src_root / rel_path
-        out_path = out_root / (rel_path + ".txt")
+    def tasks():
+        nonlocal resumed
+        n = 0
+        for r in iter_raw(db):
+            if args.limit and n >= args.limit:
+                return
+            n += 1
+            rel_path = r["rel_path"]
+            src = src_root / rel_path
+            ext = (r["ext"] or "").lower()
+            if man is not None:
+                yield r["sha256"], rel_path, ext, str(src)
+                continue
+            out_path = out_root / (rel_path + ".txt")
+            if not args.redo and already_digested(src, out_path):
+                # finished before a crash, status update never committed
+                resumed += 1
+                done_ids.append((r["sha256"],))
+                continue
+            yield r["sha256"], rel_path, ext, str(src), str(out_path)
 
-        try:
-            if not src.exists():
-                raise FileNotFoundError(f"missing source: {src}")
+    fn = digest_to_chunks if man is not None else digest_one
+    initargs = (args.timeout, args.mem_mb, args.extractor, args.min_text)
+    if args.workers > 1:
+        results = pool_map(fn, tasks(), args.workers, init_worker, initargs)
+    else:
+        init_worker(args.timeout, 0, args.extractor, args.min_text)  # no address-space cap on our own process
+        results = map(fn, tasks())
 
-            if ext == ".pdf":
-                text = digest_pdf(src)
-            elif ext == ".epub":
-                text = digest_epub(src)
-            elif ext == ".xml":
-                text = digest_xml(src)
-            elif ext in (".html", ".htm", ".xhtml"):
-                text = digest_html(src)
+    try:
+        for item_id, rel_path, ext, err, stored in results:
+            if err is None and stored is not None:
+                # single writer: only this loop touches manifest.sqlite
+                doc, chunks, enc = stored
+                old_id = gone_by_hash.get(doc[6])
+                try:
+                    store.put_encoded(doc[0], enc)
+                    if old_id is not None and doc[0] not in live_ids:
+                        # rename: the vanished doc's chunks move to the new doc_id
+                        repoint_doc(man, old_id, doc)
+                        del gone_by_hash[doc[6]]
+                        repointed.add(old_id)
+                    else:
+                        n_chunks += store_doc(man, doc, chunks, rechunk=args.redo)
+                except Exception as e:
+                    err = str(e) or type(e).__name__
+            if err is None:
+                ok += 1
+                done_ids.append((item_id,))
             else:
-                raise RuntimeError(f"unsupported ext: {ext}")
-
-            text = normalize_text(text)
-            write_text(out_path, text)
-
-            db.execute(
-                "update corpus_items set status='DIGESTED' where sha256=?",
-                (item_id,)
-            )
-            db.commit()
-            ok += 1
-
-        except Exception as e:
-            db.execute(
-                "update corpus_items set status='FAILED', notes=coalesce(notes,'') || '\nDIGEST_FAIL: ' || ? where sha256=?",
-                (str(e), item_id)
-            )
-            db.commit()
-            fail += 1
-
-            with log_path.open("a", encoding="utf-8") as f:
-                f.write(f"FAIL\t{rel_path}\t{ext}\t{e}\n")
+                fail += 1
+                failed.append((item_id, rel_path, ext, err))
+            if len(done_ids) + len(failed) >= args.commit_every:
+                flush()
+                dt = time.time() - t0
+                print(f"  digested={ok} failed={fail} resumed={resumed}  ({(ok + fail) / dt:,.1f} items/s)",
+                      file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Interrupted; saving progress.", file=sys.stderr)
+    finally:
+        flush()
+        db.close()
+        n_gone = 0
+        if man is not None:
+            # whatever vanished and wasn't claimed by a rename is tombstoned
+            n_gone, _ = tombstone_docs(man, (d for d in gone if d not in repointed))
+            if ok or n_gone:
+                bump_generation(man)
+            man.commit()
+            man.close()
+            store.delete(gone)
+            store.close()
 
-    print(f"DIGEST DONE ok={ok} fail={fail} out={out_root} log={log_path}")
+    if man is not None:
+        print(f"Reconciled: requeued={requeued:,} renamed={len(repointed):,} tombstoned={n_gone:,}")
+        print(f"DIGEST DONE ok={ok} fail={fail} chunks={n_chunks} in {time.time() - t0:,.1f}s "
+              f"manifest={args.to_manifest} store={args.store} log={log_path}")
+        return 0
+    print(f"DIGEST DONE ok={ok} fail={fail} resumed={resumed} in {time.time() - t0:,.1f}s "
+          f"out={out_root} log={log_path}")
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Compressed store for the normalized document texts (replaces one plain
+/ai_data/ai_corpus/normalized/<doc_id>.txt per doc).
+
+  - one SQLite file, docstore.sqlite: a docs row per doc_id and the text split into
+    fixed BLOCK_CHARS-character blocks, each zlib-compressed on its own
+  - docs.norm_path in manifest.sqlite says "docstore:<doc_id>" for stored texts
+  - get_range(doc_id, start, end) inflates only the blocks a character range touches
+    (the get --start/--end CLI). chunks.start_char/end_char are not exact offsets into
+    the stored text (the chunker assumes one blank line between paragraphs), so
+    nothing cuts chunk context out of the store with them
+  - compression happens in the ingest workers (encode()); the writer process only
+    inserts the finished blocks (put_encoded())
+
+  corpus_docstore.py migrate [--delete]       # move normalized/*.txt(.gz) into the store
+  corpus_docstore.py get <doc_id> [--start N --end M]
+  corpus_docstore.py stats
+"""
+
+import argparse
+import gzip
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Tuple
+
+DOCSTORE = Path("/ai_data/ai_corpus/docstore.sqlite")
+MANIFEST = Path("/ai_data/ai_corpus/manifest.sqlite")
+NORM_DIR = Path("/ai_data/ai_corpus/normalized")
+
+NORM_PREFIX = "docstore:"
+BLOCK_CHARS = 64 * 1024   # characters per compressed block
+LEVEL = 6
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS docs (
+  doc_id       TEXT PRIMARY KEY,
+  n_chars      INTEGER NOT NULL,
+  block_chars  INTEGER NOT NULL,
+  raw_bytes    INTEGER NOT NULL,   -- utf-8 size of the text
+  stored_bytes INTEGER NOT NULL,   -- sum of the compressed blocks
+  updated_at   TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+CREATE TABLE IF NOT EXISTS blocks (
+  doc_id   TEXT NOT NULL,
+  idx      INTEGER NOT NULL,
+  data     BLOB NOT NULL,
+  PRIMARY KEY (doc_id, idx)
+);
+"""
+
+# (n_chars, block_chars, raw_bytes, [compressed blocks])
+Encoded = Tuple[int, int, int, List[bytes]]
+
+
+def norm_ref(doc_id: str) -> str:
+  """docs.norm_path value for a text held in the store."""
+  return NORM_PREFIX + doc_id
+
+
+def encode(text: str, block_chars: int = BLOCK_CHARS, level: int = LEVEL) -> Encoded:
+  """Split + compress text for put_encoded(). Pure function: safe to run in a pool process."""
+  blocks = [zlib.compress(text[i:i + block_chars].encode("utf-8"), level)
+            for i in range(0, len(text), block_chars)]
+  return len(text), block_chars, len(text.encode("utf-8")), blocks
+
+
+class DocStore:
+  def __init__(self, path: Path = DOCSTORE, readonly: bool = False):
+    self.path = Path(path)
+    if readonly:
+      self.con = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+      self.path.parent.mkdir(parents=True, exist_ok=True)
+      self.con = sqlite3.connect(self.path)
+      self.con.execute("PRAGMA journal_mode=WAL;")
+      self.con.execute("PRAGMA synchronous=NORMAL;")
+      self.con.executescript(SCHEMA_SQL)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  # -- writes --
+
+  def put(self, doc_id: str, text: str) -> None:
+    self.put_encoded(doc_id, encode(text))
+
+  def put_encoded(self, doc_id: str, enc: Encoded) -> None:
+    n_chars, block_chars, raw_bytes, blocks = enc
+    self.con.execute("DELETE FROM blocks WHERE doc_id=?", (doc_id,))
+    self.con.executemany(
+      "INSERT INTO blocks(doc_id, idx, data) VALUES(?,?,?)",
+      ((doc_id, i, b) for i, b in enumerate(blocks))
+    )
+    self.con.execute("""
+      INSERT INTO docs(doc_id, n_chars, block_chars, raw_bytes, stored_bytes, updated_at)
+      VALUES(?,?,?,?,?,datetime('now'))
+      ON CONFLICT(doc_id) DO UPDATE SET
+        n_chars=excluded.n_chars, block_chars=excluded.block_chars, raw_bytes=excluded.raw_bytes,
+        stored_bytes=excluded.stored_bytes, updated_at=datetime('now')
+    """, (doc_id, n_chars, block_chars, raw_bytes, sum(len(b) for b in blocks)))
+
+  def delete(self, doc_ids: Iterable[str]) -> int:
+    ids = [(d,) for d in doc_ids]
+    self.con.executemany("DELETE FROM blocks WHERE doc_id=?", ids)
+    n = 0
+    for d in ids:
+      n += self.con.execute("DELETE FROM docs WHERE doc_id=?", d).rowcount
+    return n
+
+  def commit(self) -> None:
+    self.con.commit()
+
+  def close(self) -> None:
+    self.con.commit()
+    self.con.close()
+
+  # -- reads --
+
+  def doc_ids(self) -> Set[str]:
+    return {r[0] for r in self.con.execute("SELECT doc_id FROM docs")}
+
+  def n_chars(self, doc_id: str) -> Optional[int]:
+    row = self.con.execute("SELECT n_chars FROM docs WHERE doc_id=?", (doc_id,)).fetchone()
+    return row[0] if row else None
+
+  def get(self, doc_id: str) -> Optional[str]:
+    """Whole text of doc_id, or None if it isn't stored."""
+    return self.get_range(doc_id, 0, None)
+
+  def get_range(self, doc_id: str, start: int, end: Optional[int]) -> Optional[str]:
+    """text[start:end] of doc_id, reading only the blocks it spans."""
+    row = self.con.execute("SELECT n_chars, block_chars FROM docs WHERE doc_id=?", (doc_id,)).fetchone()
+    if not row:
+      return None
+    n_chars, bc = row
+    start = max(0, start)
+    end = n_chars if end is None else min(end, n_chars)
+    if end <= start:
+      return ""
+    first, last = start // bc, (end - 1) // bc
+    parts = [zlib.decompress(data).decode("utf-8") for (data,) in self.con.execute(
+      "SELECT data FROM blocks WHERE doc_id=? AND idx BETWEEN ? AND ? ORDER BY idx", (doc_id, first, last)
+    )]
+    text = "".join(parts)
+    return text[start - first * bc:end - first * bc]
+
+
+def read_text(norm_path: str, store: Optional[DocStore] = None) -> Optional[str]:
+  """Normalized text behind a docs.norm_path value (docstore ref, .txt or .txt.gz file)."""
+  if norm_path.startswith(NORM_PREFIX):
+    doc_id = norm_path[len(NORM_PREFIX):]
+    if store is not None:
+      return store.get(doc_id)
+    with DocStore(readonly=True) as s:
+      return s.get(doc_id)
+  if norm_path.endswith(".gz"):
+    with gzip.open(norm_path, "rt", encoding="utf-8", errors="replace") as f:
+      return f.read()
+  return Path(norm_path).read_text(encoding="utf-8", errors="replace")
+
+
+# ---------- CLI ----------
+
+def migrate(store: DocStore, manifest: Path, norm_dir: Path, delete: bool, batch: int) -> None:
+  """
+  Move every normalized/<doc_id>.txt(.gz) that a docs row points at into the store and
+  repoint docs.norm_path. Files no docs row points at any more are only counted (and
+  removed with delete=True).
+  """
+  con = sqlite3.connect(manifest)
+  con.execute("PRAGMA busy_timeout=30000")
+  refs = {}
+  for doc_id, np_ in con.execute("SELECT doc_id, norm_path FROM docs WHERE norm_path IS NOT NULL"):
+    refs[np_] = doc_id
+
+  t0 = time.time()
+  moved = stale = raw = stored = 0
+  todo = []
+  for name in sorted(os.listdir(norm_dir)):
+    if not name.endswith((".txt", ".txt.gz")):
+      continue
+    path = (norm_dir / name).as_posix()
+    doc_id = refs.get(path)
+    if doc_id is None:
+      stale += 1
+      if delete:
+        os.unlink(path)
+      continue
+    enc = encode(read_text(path))
+    store.put_encoded(doc_id, enc)
+    raw += enc[2]
+    stored += sum(len(b) for b in enc[3])
+    todo.append((norm_ref(doc_id), doc_id, path))
+    if len(todo) >= batch:
+      moved += _commit_migrated(store, con, todo, delete)
+      print(f"  migrated {moved:,} docs ({raw / max(stored, 1):,.1f}x)", file=sys.stderr)
+  moved += _commit_migrated(store, con, todo, delete)
+  con.close()
+  print(f"Migrated {moved:,} docs in {time.time() - t0:,.1f}s: {raw:,} -> {stored:,} bytes "
+        f"({raw / max(stored, 1):,.1f}x); unreferenced files: {stale:,}{' (deleted)' if delete else ''}")
+
+
+def _commit_migrated(store: DocStore, con, todo: list, delete: bool) -> int:
+  # store first: a docs row never points at a text that isn't committed yet
+  store.commit()
+  con.executemany("UPDATE docs SET norm_path=? WHERE doc_id=?", ((ref, d) for ref, d, _ in todo))
+  con.commit()
+  if delete:
+    for _, _, path in todo:
+      os.unlink(path)
+  n = len(todo)
+  todo.clear()
+  return n
+
+
+def main() -> int:
+  ap = argparse.ArgumentParser(description="Compressed normalized-text store (docstore.sqlite).")
+  ap.add_argument("--store", default=str(DOCSTORE))
+  sub = ap.add_subparsers(dest="cmd", required=True)
+
+  m = sub.add_parser("migrate", help="Move normalized/<doc_id>.txt(.gz) files into the store")
+  m.add_argument("--db", default=str(MANIFEST))
+  m.add_argument("--norm-dir", default=str(NORM_DIR))
+  m.add_argument("--delete", action="store_true", help="Remove each file once its text is committed to the store")
+  m.add_argument("--batch", type=int, default=500, help="Docs per commit")
+
+  g = sub.add_parser("get", help="Print a stored text (or a start/end char range of it)")
+  g.add_argument("doc_id")
+  g.add_argument("--start", type=int, default=0)
+  g.add_argument("--end", type=int, default=None)
+
+  sub.add_parser("stats", help="Docs, raw vs stored size")
+  args = ap.parse_args()
+
+  if args.cmd == "migrate":
+    with DocStore(Path(args.store)) as store:
+      migrate(store, Path(args.db), Path(args.norm_dir), args.delete, args.batch)
+    return 0
+
+  with DocStore(Path(args.store), readonly=True) as store:
+    if args.cmd == "get":
+      text = store.get_range(args.doc_id, args.start, args.end)
+      if text is None:
+        print(f"not in store: {args.doc_id}", file=sys.stderr)
+        return 1
+      sys.stdout.write(text)
+      return 0
+    n, raw, stored = store.con.execute(
+      "SELECT count(*), coalesce(sum(raw_bytes), 0), coalesce(sum(stored_bytes), 0) FROM docs"
+    ).fetchone()
+  print(f"docs={n:,} raw={raw:,} bytes stored={stored:,} bytes ({raw / max(stored, 1):,.1f}x)")
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Offline embedding stage over manifest.sqlite chunks, for hybrid BM25 + vector retrieval
+(ask_corpus.py --hybrid).
+
+Model (CPU only, no downloads): hashed bag-of-words -> log-TF * IDF -> LSA projection.
+  - words are hashed (crc32) into --features buckets; IDF and a truncated SVD of the
+    bucket/chunk matrix are fitted once on a sample of chunks (--fit, or the first run)
+  - a chunk vector is the IDF-weighted sum of the projection rows of its buckets,
+    L2-normalized, so cosine similarity is a dot product. Words that co-occur across
+    the corpus land near each other, which is what lets paraphrases match.
+
+Storage (/ai_data/ai_corpus/embed/):
+  model.npz       idf + projection matrix
+  vectors.f16     float16 rows (dim each), append-only, read through np.memmap
+  centroids.npy   IVF coarse quantizer (spherical k-means over the vectors)
+  embed.sqlite    vec(row, chunk_id, list, text_hash): which chunk each row holds, its
+                  IVF list and a hash of the text it was embedded from
+
+Incremental: chunks are embedded by chunk_id; a run only embeds chunk_ids not in
+vec yet and drops rows whose chunk no longer exists. A chunk_id can survive an edit
+(same doc, same offsets), so chunks of docs updated since the last run (docs.updated_at,
+or all of them with --recheck) are compared by text_hash and re-embedded when it
+differs. Dead rows stay in vectors.f16 until --compact.
+
+numpy is required for this script (and for --hybrid); nothing else imports it.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from corpus_manifest import pool_map
+
+try:
+  import numpy as np
+except ImportError:  # optional dependency: only the vector side of retrieval needs it
+  np = None
+
+OUT_ROOT = Path("/ai_data/ai_corpus")
+DB = OUT_ROOT / "manifest.sqlite"
+EMBED_DIR = OUT_ROOT / "embed"
+
+DIM = 256
+N_FEATURES = 1 << 16
+FIT_SAMPLE = 20000
+NPROBE = 16
+
+_WORD_RE = re.compile(r"[^\W\d_]{2,}")
+
+
+def require_numpy():
+  if np is None:
+    raise SystemExit("corpus_embed: numpy is required for embeddings (pip install numpy)")
+
+
+# ---------- model ----------
+
+def hash_words(text: str, n_features: int):
+  """(bucket ids, counts) for the words of text."""
+  mask = n_features - 1
+  ids = [zlib.crc32(w.encode("utf-8")) & mask for w in _WORD_RE.findall(text.lower())]
+  if not ids:
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+  ids, counts = np.unique(np.asarray(ids, dtype=np.int64), return_counts=True)
+  return ids, counts.astype(np.float32)
+
+
+class Model:
+  def __init__(self, idf, proj):
+    self.idf = idf            # (n_features,) float32
+    self.proj = proj          # (n_features, dim) float32
+    self.n_features, self.dim = proj.shape
+
+  @classmethod
+  def load(cls, path: Path):
+    z = np.load(path)
+    return cls(z["idf"], z["proj"])
+
+  def save(self, path: Path):
+    tmp = path.with_suffix(".tmp.npz")
+    np.savez(tmp, idf=self.idf, proj=self.proj)
+    os.replace(tmp, path)
+
+  def weights(self, text: str):
+    ids, counts = hash_words(text, self.n_features)
+    return ids, (1.0 + np.log(counts)) * self.idf[ids]
+
+  def embed(self, texts):
+    out = np.zeros((len(texts), self.dim), dtype=np.float32)
+    for i, t in enumerate(texts):
+      ids, w = self.weights(t)
+      if len(ids):
+        out[i] = w @ self.proj[ids]
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    np.divide(out, norms, out=out, where=norms > 0)
+    return out
+
+
+def fit_model(texts, dim: int, n_features: int, oversample: int = 32, seed: int = 0) -> Model:
+  """IDF + randomized truncated SVD of the (sample chunks x buckets) log-TF*IDF matrix."""
+  rng = np.random.default_rng(seed)
+  rows = [hash_words(t, n_features) for t in texts]
+
+  df = np.zeros(n_features, dtype=np.float32)
+  for ids, _ in rows:
+    df[ids] += 1
+  idf = np.log((1.0 + len(rows)) / (1.0 + df)).astype(np.float32) + 1.0
+
+  # X is sparse (row = chunk): only ever touch the non-zero buckets of each row
+  X = [(ids, (1.0 + np.log(c)) * idf[ids]) for ids, c in rows if len(ids)]
+  r = min(dim + oversample, len(X))
+  omega = rng.standard_normal((n_features, r), dtype=np.float32)
+  Y = np.stack([w @ omega[ids] for ids, w in X])          # X @ omega
+  Q, _ = np.linalg.qr(Y)
+  BT = np.zeros((n_features, r), dtype=np.float32)        # (Q.T @ X).T
+  for (ids, w), q in zip(X, Q):
+    BT[ids] += np.outer(w, q)                             # ids are unique per row
+  _, _, Vt = np.linalg.svd(BT.T, full_matrices=False)
+  proj = np.zeros((n_features, dim), dtype=np.float32)
+  k = min(dim, Vt.shape[0])
+  proj[:, :k] = Vt[:k].T
+  return Model(idf, proj)
+
+
+# ---------- IVF ----------
+
+def kmeans(vectors, nlist: int, iters: int = 10, seed: int = 0):
+  """Spherical k-means: centroids are unit vectors, assignment by dot product."""
+  rng = np.random.default_rng(seed)
+  C = vectors[rng.choice(len(vectors), nlist, replace=False)].astype(np.float32)
+  for _ in range(iters):
+    assign = np.argmax(vectors @ C.T, axis=1)
+    for j in range(nlist):
+      members = vectors[assign == j]
+      if len(members):
+        c = members.sum(axis=0)
+        n = np.linalg.norm(c)
+        if n > 0:
+          C[j] = c / n
+      else:
+        C[j] = vectors[rng.integers(len(vectors))]
+  return C
+
+
+def assign_lists(C, vectors, block: int = 65536):
+  out = np.empty(len(vectors), dtype=np.int64)
+  for s in range(0, len(vectors), block):
+    out[s:s + block] = np.argmax(vectors[s:s + block].astype(np.float32) @ C.T, axis=1)
+  return out
+
+
+# ---------- store ----------
+
+class EmbeddingStore:
+  def __init__(self, root: Path = EMBED_DIR, create: bool = False):
+    require_numpy()
+    self.root = Path(root)
+    if create:
+      self.root.mkdir(parents=True, exist_ok=True)
+    self.model_path = self.root / "model.npz"
+    self.vec_path = self.root / "vectors.f16"
+    self.centroid_path = self.root / "centroids.npy"
+    self.con = sqlite3.connect(str(self.root / "embed.sqlite"), check_same_thread=False)
+    # WAL: the embedding run reads "chunks not in vec yet" while appending to vec
+    self.con.execute("PRAGMA journal_mode=WAL")
+    self.con.executescript("""
+      CREATE TABLE IF NOT EXISTS vec (
+        row      INTEGER PRIMARY KEY,   -- row in vectors.f16
+        chunk_id TEXT NOT NULL UNIQUE,
+        list     INTEGER                -- IVF list (NULL until centroids exist)
+      );
+      CREATE INDEX IF NOT EXISTS idx_vec_list ON vec(list);
+      CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    if "text_hash" not in {r[1] for r in self.con.execute("PRAGMA table_info(vec)")}:
+      # rows from before this column are re-embedded once (text_hash IS NULL = unknown)
+      self.con.execute("ALTER TABLE vec ADD COLUMN text_hash TEXT")
+      self.con.commit()
+    self.model = Model.load(self.model_path) if self.model_path.exists() else None
+    self.centroids = np.load(self.centroid_path) if self.centroid_path.exists() else None
+    self._mm = None
+    self._lock = threading.Lock()   # search() is shared by ask_corpus --batch threads
+
+  @property
+  def dim(self) -> int:
+    return self.model.dim
+
+  def n_rows(self) -> int:
+    if not self.vec_path.exists() or self.model is None:
+      return 0
+    return self.vec_path.stat().st_size // (self.dim * 2)
+
+  def vectors(self):
+    n = self.n_rows()
+    if self._mm is None or self._mm.shape[0] != n:
+      self._mm = np.memmap(self.vec_path, dtype=np.float16, mode="r", shape=(n, self.dim)) if n else \
+        np.zeros((0, self.dim), dtype=np.float16)
+    return self._mm
+
+  def repair(self) -> None:
+    # rows appended to vectors.f16 whose vec entries never committed (crash): cut them off
+    last = self.con.execute("SELECT max(row) FROM vec").fetchone()[0]
+    keep = 0 if last is None else last + 1
+    if self.n_rows() > keep:
+      with open(self.vec_path, "r+b") as f:
+        f.truncate(keep * self.dim * 2)
+
+  def append(self, chunk_ids, hashes, vecs) -> None:
+    start = self.n_rows()
+    lists = assign_lists(self.centroids, vecs) if self.centroids is not None else [None] * len(vecs)
+    with open(self.vec_path, "ab") as f:
+      f.write(vecs.astype(np.float16).tobytes())
+      f.flush()
+      os.fsync(f.fileno())
+    self.con.executemany(
+      "INSERT INTO vec(row, chunk_id, list, text_hash) VALUES(?,?,?,?)",
+      [(start + i, cid, None if l is None else int(l), h)
+       for i, (cid, l, h) in enumerate(zip(chunk_ids, lists, hashes))]
+    )
+    self.con.commit()
+
+  def reset(self) -> None:
+    self.con.execute("DELETE FROM vec")
+    self.con.commit()
+    for p in (self.vec_path, self.centroid_path):
+      if p.exists():
+        p.unlink()
+    self.centroids = None
+    self._mm = None
+
+  def train_ivf(self, nlist: int, sample: int = 0) -> int:
+    rows = [r for (r,) in self.con.execute("SELECT row FROM vec ORDER BY row")]
+    if not rows:
+      return 0
+    nlist = nlist or max(1, min(4096, int(len(rows) ** 0.5)))
+    nlist = min(nlist, len(rows))
+    V = self.vectors()
+    rng = np.random.default_rng(0)
+    take = rows if len(rows) <= (sample or nlist * 64) else sorted(rng.choice(rows, sample or nlist * 64, replace=False))
+    C = kmeans(V[np.asarray(take)].astype(np.float32), nlist)
+    np.save(self.centroid_path, C)
+    self.centroids = C
+    ids = np.asarray(rows)
+    lists = assign_lists(C, V[ids])
+    self.con.executemany("UPDATE vec SET list=? WHERE row=?", zip(lists.tolist(), ids.tolist()))
+    self.con.commit()
+    return nlist
+
+  def compact(self) -> int:
+    live = self.con.execute("SELECT row, chunk_id, list, text_hash FROM vec ORDER BY row").fetchall()
+    V = self.vectors()
+    tmp = self.vec_path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+      for s in range(0, len(live), 65536):
+        block = np.asarray([r for r, _, _, _ in live[s:s + 65536]])
+        f.write(np.ascontiguousarray(V[block]).tobytes())
+    self._mm = None
+    os.replace(tmp, self.vec_path)
+    self.con.execute("DELETE FROM vec")
+    self.con.executemany("INSERT INTO vec(row, chunk_id, list, text_hash) VALUES(?,?,?,?)",
+                         [(i, cid, l, h) for i, (_, cid, l, h) in enumerate(live)])
+    self.con.commit()
+    return len(live)
+
+  def search(self, text: str, n: int, nprobe: int = NPROBE):
+    """Top n (chunk_id, cosine) for a query text."""
+    with self._lock:
+      return self._search(text, n, nprobe)
+
+  def _search(self, text: str, n: int, nprobe: int):
+    q = self.model.embed([text])[0]
+    if not q.any():
+      return []
+    V = self.vectors()
+    if self.centroids is not None:
+      probe = np.argsort(-(self.centroids @ q))[:nprobe].tolist()
+      marks = ",".join("?" * len(probe))
+      cand = self.con.execute(f"SELECT row, chunk_id FROM vec WHERE list IN ({marks})", probe).fetchall()
+      if cand:
+        rows = np.asarray([r for r, _ in cand])
+        scores = V[rows].astype(np.float32) @ q
+        top = np.argsort(-scores)[:n]
+        return [(cand[i][1], float(scores[i])) for i in top]
+    # no IVF yet (small store): exact scan in blocks
+    best = []
+    for s in range(0, len(V), 262144):
+      sc = V[s:s + 262144].astype(np.float32) @ q
+      k = min(n * 4, len(sc))
+      idx = np.argpartition(-sc, k - 1)[:k]
+      best.extend((float(sc[i]), s + int(i)) for i in idx)
+    best.sort(reverse=True)
+    out = []
+    for score, row in best:
+      hit = self.con.execute("SELECT chunk_id FROM vec WHERE row=?", (row,)).fetchone()
+      if hit:  # dead rows (deleted chunks) have no vec entry
+        out.append((hit[0], score))
+        if len(out) >= n:
+          break
+    return out
+
+  def close(self):
+    self.con.close()
+
+
+# ---------- embedding run ----------
+
+_worker_model = None
+
+
+def _init_worker(model_path: str):
+  global _worker_model
+  _worker_model = Model.load(Path(model_path))
+
+
+def text_hash(text: str) -> str:
+  return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def embed_batch(batch):
+  ids = [cid for cid, _ in batch]
+  hashes = [text_hash(t) for _, t in batch]
+  return ids, hashes, _worker_model.embed([t for _, t in batch]).astype(np.float16)
+
+
+def drop_stale(store, since: str = "") -> int:
+  """
+  Forget vec rows whose chunk text changed under the same chunk_id (or whose hash is
+  unknown), so the run re-embeds them. Only chunks of docs updated at/after `since`
+  (manifest datetime) are read; '' checks every chunk.
+  """
+  sql = """
+    SELECT v.row, v.text_hash, c.text FROM vec v JOIN m.chunks c ON c.chunk_id = v.chunk_id
+    WHERE v.text_hash IS NOT NULL
+  """
+  params = []
+  if since:
+    sql += " AND c.doc_id IN (SELECT doc_id FROM m.docs WHERE updated_at >= ?)"
+    params.append(since)
+  stale = [(row,) for row, h, t in store.con.execute(sql, params) if text_hash(t) != h]
+  stale += store.con.execute("SELECT row FROM vec WHERE text_hash IS NULL").fetchall()
+  store.con.executemany("DELETE FROM vec WHERE row=?", stale)
+  store.con.commit()
+  return len(stale)
+
+
+def batches(cur, size: int):
+  while True:
+    rows = cur.fetchmany(size)
+    if not rows:
+      return
+    yield rows
+
+
+def main():
+  ap = argparse.ArgumentParser(description="Embed manifest.sqlite chunks for vector / hybrid retrieval.")
+  ap.add_argument("--db", default=str(DB))
+  ap.add_argument("--out-dir", default=str(EMBED_DIR))
+  ap.add_argument("--fit", action="store_true", help="(Re)fit the model on a sample; re-embeds every chunk")
+  ap.add_argument("--sample", type=int, default=FIT_SAMPLE, help="Chunks sampled for --fit")
+  ap.add_argument("--dim", type=int, default=DIM)
+  ap.add_argument("--features", type=int, default=N_FEATURES, help="Hash buckets (power of two)")
+  ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+  ap.add_argument("--batch", type=int, default=512, help="Chunks per worker task")
+  ap.add_argument("--limit", type=int, default=0, help="Embed at most N new chunks this run")
+  ap.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = sqrt(#vectors))")
+  ap.add_argument("--retrain-ivf", action="store_true", help="Re-run k-means over all vectors")
+  ap.add_argument("--compact", action="store_true", help="Rewrite vectors.f16 without dead rows")
+  ap.add_argument("--recheck", action="store_true",
+                  help="Compare every embedded chunk's text, not just docs updated since the last run")
+  ap.add_argument("--query", default="", help="Print the nearest chunks for this text and exit")
+  ap.add_argument("--n", type=int, default=10)
+  args = ap.parse_args()
+  require_numpy()
+  if args.features & (args.features - 1):
+    ap.error("--features must be a power of two")
+
+  store = EmbeddingStore(Path(args.out_dir), create=True)
+  if args.query:
+    if store.model is None:
+      raise SystemExit("No embedding model yet; run corpus_embed.py first.")
+    for cid, score in store.search(args.query, args.n):
+      print(f"{score:.3f}  {cid}")
+    return
+
+  store.con.execute("ATTACH DATABASE ? AS m", (args.db,))
+  store.repair()
+
+  if args.fit or store.model is None:
+    t0 = time.time()
+    n_all = store.con.execute("SELECT count(*) FROM m.chunks").fetchone()[0]
+    step = max(1, n_all // max(1, args.sample))
+    texts = [t for (t,) in store.con.execute(
+      "SELECT text FROM m.chunks WHERE id % ? = 0 AND boilerplate = 0 LIMIT ?", (step, args.sample)
+    )]
+    if not texts:
+      raise SystemExit("No chunks to fit on.")
+    model = fit_model(texts, args.dim, args.features)
+    store.reset()
+    model.save(store.model_path)
+    store.model = model
+    print(f"Fitted model on {len(texts):,} chunks (dim={args.dim}, features={args.features:,}) "
+          f"in {time.time() - t0:,.1f}s")
+
+  # chunks that are gone from the manifest: forget their rows
+  cur = store.con.execute("DELETE FROM vec WHERE chunk_id NOT IN (SELECT chunk_id FROM m.chunks)")
+  n_dead = cur.rowcount
+  store.con.commit()
+
+  # edited in place (same chunk_id, new text): forget those rows too
+  run_start = store.con.execute("SELECT datetime('now')").fetchone()[0]
+  row = store.con.execute("SELECT value FROM meta WHERE key='checked_utc'").fetchone()
+  n_stale = drop_stale(store, "" if args.recheck or not row else row[0])
+  # docs updated before run_start are settled: their changed rows are gone from vec and
+  # get re-embedded as new chunks (now or, with --limit / after a crash, next time)
+  store.con.execute("INSERT OR REPLACE INTO meta(key, value) VALUES('checked_utc', ?)", (run_start,))
+  store.con.commit()
+
+  todo = store.con.execute("""
+    SELECT count(*) FROM m.chunks c WHERE NOT EXISTS (SELECT 1 FROM vec v WHERE v.chunk_id = c.chunk_id)
+  """).fetchone()[0]
+  if args.limit:
+    todo = min(todo, args.limit)
+  print(f"Pre-pass: embedded={store.con.execute('SELECT count(*) FROM vec').fetchone()[0]:,} "
+        f"new={todo:,} removed={n_dead:,} changed={n_stale:,}")
+
+  t0 = time.time()
+  done = 0
+  if todo:
+    reader = sqlite3.connect(args.db)
+    reader.execute("ATTACH DATABASE ? AS e", (str(store.root / "embed.sqlite"),))
+    cur = reader.execute("""
+      SELECT c.chunk_id, c.text FROM chunks c
+      WHERE NOT EXISTS (SELECT 1 FROM e.vec v WHERE v.chunk_id = c.chunk_id)
+      ORDER BY c.id LIMIT ?
+    """, (todo,))
+    # the reader's snapshot is fixed by the first fetch; appends to vec don't disturb it
+    tasks = batches(cur, args.batch)
+    if args.workers > 1:
+      results = pool_map(embed_batch, tasks, args.workers, _init_worker, (str(store.model_path),))
+    else:
+      _init_worker(str(store.model_path))
+      results = map(embed_batch, tasks)
+    for ids, hashes, vecs in results:
+      store.append(ids, hashes, vecs)
+      done += len(ids)
+      if done % (args.batch * 50) < len(ids):
+        dt = max(time.time() - t0, 1e-9)
+        print(f"Embedded: {done:,}/{todo:,}  ({done / dt:,.0f} chunks/s)")
+    reader.close()
+
+  n_live = store.con.execute("SELECT count(*) FROM vec").fetchone()[0]
+  if args.compact:
+    store.compact()
+  if args.retrain_ivf or (store.centroids is None and n_live >= 1024):
+    nlist = store.train_ivf(args.nlist)
+    print(f"IVF: {nlist:,} lists over {n_live:,} vectors")
+
+  dead = store.n_rows() - n_live
+  dt = max(time.time() - t0, 1e-9)
+  print(f"Done. embedded={done:,} ({done / dt:,.0f} chunks/s) total={n_live:,} dead rows={dead:,}")
+  if dead > max(1000, n_live // 5):
+    print("NOTE: many dead rows in vectors.f16; run with --compact")
+  store.close()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark the in-process EPUB/HTML extractor (corpus_html_text) against the
+unzip + lynx subprocess path of corpus_digest_run.py on the same files.
+
+For every file both outputs go through corpus_digest_run.normalize_text; the report
+gives wall time per extractor, the speedup, and how close the texts are
+(word overlap: shared words / words in the larger output).
+
+  corpus_extract_bench.py book1.epub page.html ...
+  corpus_extract_bench.py --db /ai_data/ebooks/_corpus_index/corpus_index.sqlite --limit 50
+"""
+
+import argparse
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import corpus_digest_run as dr
+from corpus_html_text import epub_to_text, html_to_text
+
+EXTS = (".epub", ".html", ".htm", ".xhtml")
+_WORD = re.compile(r"\w+")
+
+
+def builtin(src: Path) -> str:
+    if src.suffix.lower() == ".epub":
+        return epub_to_text(src)
+    return html_to_text(src.read_bytes())
+
+
+def subprocess_path(src: Path) -> str:
+    if src.suffix.lower() == ".epub":
+        return dr.digest_epub_lynx(src)
+    return dr.digest_html_lynx(src)
+
+
+def word_overlap(a: str, b: str) -> float:
+    ca, cb = Counter(_WORD.findall(a.lower())), Counter(_WORD.findall(b.lower()))
+    total = max(sum(ca.values()), sum(cb.values()))
+    return sum((ca & cb).values()) / total if total else 1.0
+
+
+def timed(fn, src: Path):
+    t0 = time.perf_counter()
+    try:
+        text = dr.normalize_text(fn(src))
+        err = None
+    except Exception as e:
+        text, err = "", str(e) or type(e).__name__
+    return text, time.perf_counter() - t0, err
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Compare in-process vs unzip+lynx EPUB/HTML extraction.")
+    ap.add_argument("files", nargs="*", help="EPUB/HTML files to convert")
+    ap.add_argument("--db", default="", help="Take files from corpus_index.sqlite instead")
+    ap.add_argument("--root", default="/ai_data/ebooks", help="With --db: base path for rel_path")
+    ap.add_argument("--limit", type=int, default=20, help="With --db: files per extension")
+    ap.add_argument("--timeout", type=float, default=600, help="Seconds per lynx/unzip call")
+    ap.add_argument("--show-worst", type=int, default=3, help="List the files whose outputs differ most")
+    args = ap.parse_args()
+
+    files = [Path(f) for f in args.files]
+    if args.db:
+        db = sqlite3.connect(args.db)
+        for ext in EXTS:
+            rows = db.execute(
+                "select rel_path from corpus_items where ext=? and missing_utc is null order by random() limit ?",
+                (ext, args.limit),
+            )
+            files += [Path(args.root) / r[0] for r in rows]
+        db.close()
+    files = [f for f in files if f.suffix.lower() in EXTS]
+    if not files:
+        ap.error("no EPUB/HTML files given")
+
+    dr.init_worker(args.timeout, 0)
+
+    totals = {}  # ext -> [n, builtin_s, lynx_s, overlap_sum, builtin_chars, lynx_chars]
+    diffs = []
+    failures = 0
+    for f in files:
+        a, ta, ea = timed(builtin, f)
+        b, tb, eb = timed(subprocess_path, f)
+        if ea or eb:
+            failures += 1
+            print(f"FAIL {f}: builtin={ea or 'ok'} lynx={eb or 'ok'}", file=sys.stderr)
+            continue
+        ov = word_overlap(a, b)
+        diffs.append((ov, f))
+        t = totals.setdefault(f.suffix.lower(), [0, 0.0, 0.0, 0.0, 0, 0])
+        t[0] += 1
+        t[1] += ta
+        t[2] += tb
+        t[3] += ov
+        t[4] += len(a)
+        t[5] += len(b)
+
+    print(f"{'ext':<7} {'files':>5} {'builtin s':>10} {'lynx s':>9} {'speedup':>8} {'overlap':>8} {'chars b/l':>16}")
+    for ext, (n, ta, tb, ov, ca, cb) in sorted(totals.items()):
+        speed = f"{tb / ta:,.1f}x" if ta > 0 else "n/a"
+        print(f"{ext:<7} {n:>5} {ta:>10.2f} {tb:>9.2f} {speed:>8} {ov / n:>8.1%} {ca:>8,}/{cb:,}")
+    if failures:
+        print(f"{failures} file(s) failed in one of the extractors (see stderr)")
+
+    if args.show_worst and diffs:
+        print("\nLowest overlap:")
+        for ov, f in sorted(diffs)[:args.show_worst]:
+            print(f"  {ov:.1%}  {f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+In-process HTML / EPUB to text for corpus_digest_run.py (no unzip, no lynx).
+
+  - EPUB members are read straight from the zip in spine order (container.xml ->
+    OPF manifest + spine); books without a usable OPF fall back to every HTML member
+    in name order, which is what the unzip+lynx path did
+  - markup is fed to html.parser in pieces and the text is built block by block
+  - layout follows `lynx -dump -nolist`: blocks separated by blank lines, paragraphs
+    wrapped at 76 columns with a 3-space margin, list items as "*", links as plain text
+"""
+
+import posixpath
+import re
+import textwrap
+import zipfile
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+HTML_EXTS = (".html", ".htm", ".xhtml")
+HTML_MEDIA = ("application/xhtml+xml", "text/html")
+
+WIDTH = 76
+MARGIN = "   "
+
+SKIP_TAGS = {"head", "script", "style", "template", "noscript"}
+# a new paragraph starts before and after these
+PARA_TAGS = {
+    "p", "div", "section", "article", "blockquote", "pre", "table", "ul", "ol", "dl",
+    "h1", "h2", "h3", "h4", "h5", "h6", "header", "footer", "nav", "aside", "figure",
+    "figcaption", "address", "center", "hr", "body", "main",
+}
+# a new line (not a blank line) starts before these
+LINE_TAGS = {"li", "tr", "dt", "dd", "br", "caption"}
+HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+_WS = re.compile(r"\s+")
+_XML_ENC = re.compile(rb"""^<\?xml[^>]*encoding=["']([\w.-]+)["']""")
+_META_ENC = re.compile(rb"""<meta[^>]+charset=["']?([\w.-]+)""", re.IGNORECASE)
+
+
+class TextExtractor(HTMLParser):
+    def __init__(self, width: int = WIDTH):
+        super().__init__(convert_charrefs=True)
+        self.width = width
+        self.out: list[str] = []     # finished blocks
+        self.lines: list[str] = []   # lines of the block being built
+        self.cur: list[str] = []     # words of the line being built
+        self.skip = 0
+        self.pre = 0
+        self.heading = False
+
+    # -- layout --
+
+    def _end_line(self, prefix: str = "") -> None:
+        text = "".join(self.cur)
+        text = text.rstrip() if self.pre else _WS.sub(" ", text).strip()
+        self.cur = [prefix] if prefix else []
+        if text:
+            self.lines.append(text)
+
+    def _end_block(self) -> None:
+        self._end_line()
+        if not self.lines:
+            return
+        if self.pre:
+            self.out.append("\n".join(self.lines))
+        else:
+            margin = "" if self.heading else MARGIN
+            wrapped = []
+            for line in self.lines:
+                if self.width > 0:
+                    wrapped.extend(textwrap.wrap(line, self.width - len(margin), break_long_words=False,
+                                                 break_on_hyphens=False) or [""])
+                else:
+                    wrapped.append(line)
+            self.out.append("\n".join(margin + w for w in wrapped))
+        self.lines = []
+
+    # -- parser callbacks --
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip += 1
+            return
+        if self.skip:
+            return
+        if tag in PARA_TAGS:
+            self._end_block()
+            if tag in HEADINGS:
+                self.heading = True
+            elif tag == "pre":
+                self.pre += 1
+        elif tag == "li":
+            self._end_line("* ")
+        elif tag in LINE_TAGS:
+            self._end_line()
+        elif tag in ("td", "th"):
+            self.cur.append(" ")
+        elif tag == "img":
+            alt = dict(attrs).get("alt")
+            if alt:
+                self.cur.append(f"[{alt.strip()}]")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in ("br", "img", "hr"):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip = max(0, self.skip - 1)
+            return
+        if self.skip:
+            return
+        if tag in PARA_TAGS:
+            self._end_block()
+            if tag in HEADINGS:
+                self.heading = False
+            elif tag == "pre":
+                self.pre = max(0, self.pre - 1)
+        elif tag in LINE_TAGS:
+            self._end_line()
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        if self.pre:
+            # keep the line structure of <pre> as is
+            first, *rest = data.split("\n")
+            self.cur.append(first)
+            for piece in rest:
+                self.lines.append("".join(self.cur).rstrip())
+                self.cur = [piece]
+            return
+        text = _WS.sub(" ", data)
+        if text.strip() or (self.cur and not self.cur[-1].endswith(" ")):
+            self.cur.append(text)
+
+    def text(self) -> str:
+        self._end_block()
+        return "\n\n".join(self.out)
+
+
+def decode_markup(data: bytes) -> str:
+    """bytes -> str using the BOM, XML declaration or <meta charset>, else UTF-8 / cp1252."""
+    if data.startswith(b"\xef\xbb\xbf"):
+        return data[3:].decode("utf-8", errors="replace")
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return data.decode("utf-16", errors="replace")
+    head = data[:2048]
+    m = _XML_ENC.search(head) or _META_ENC.search(head)
+    if m:
+        try:
+            return data.decode(m.group(1).decode("ascii"), errors="replace")
+        except LookupError:
+            pass
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("cp1252", errors="replace")
+
+
+def html_to_text(markup, width: int = WIDTH, piece: int = 64 * 1024) -> str:
+    """Text of one HTML/XHTML document (str or bytes), fed to the parser piece by piece."""
+    if isinstance(markup, bytes):
+        markup = decode_markup(markup)
+    p = TextExtractor(width)
+    for i in range(0, len(markup), piece):
+        p.feed(markup[i:i + piece])
+    p.close()
+    return p.text()
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def epub_spine(zf: zipfile.ZipFile) -> list[str]:
+    """Member names of the book's content documents in reading order."""
+    names = set(zf.namelist())
+    try:
+        container = ElementTree.fromstring(zf.read("META-INF/container.xml"))
+        opf_path = next(el.get("full-path") for el in container.iter() if _local(el.tag) == "rootfile")
+        opf = ElementTree.fromstring(zf.read(opf_path))
+    except (KeyError, StopIteration, ElementTree.ParseError):
+        opf = None
+
+    spine = []
+    if opf is not None:
+        base = posixpath.dirname(opf_path)
+        items = {}
+        for el in opf.iter():
+            if _local(el.tag) == "item" and el.get("href"):
+                href = unquote(el.get("href").split("#", 1)[0])
+                items[el.get("id")] = (posixpath.normpath(posixpath.join(base, href)), el.get("media-type", ""))
+        for el in opf.iter():
+            if _local(el.tag) == "itemref":
+                name, media = items.get(el.get("idref"), (None, ""))
+                if name in names and (media in HTML_MEDIA or name.lower().endswith(HTML_EXTS)) and name not in spine:
+                    spine.append(name)
+    if not spine:
+        spine = sorted(n for n in names if n.lower().endswith(HTML_EXTS))
+    return spine
+
+
+def epub_to_text(path: Path, width: int = WIDTH) -> str:
+    with zipfile.ZipFile(path) as zf:
+        members = epub_spine(zf)
+        if not members:
+            raise RuntimeError("No HTML/XHTML found inside EPUB")
+        parts = []
+        for name in members:
+            text = html_to_text(zf.read(name), width)
+            if text.strip():
+                parts.append(text)
+    return "\n\n".join(parts)
@@ -9,6 +9,14 @@ Outputs:
 Design goals:
   - RAW/CLEAN/DIGESTED workflow (status tag)
   - stable identity by sha256
+  - --fast: items are keyed by a fingerprint (size + head/middle/tail blocks) instead of
+    a full read; the full sha256 is only computed when two fingerprints collide, or
+    for every file with --verify
+  - streaming scandir walk (corpus_walk); --resume continues after the last committed file
+  - --incremental: paths whose (rel_path, size, mtime) are unchanged since the last scan
+    are trusted, only new/modified files are hashed; items with no file left get missing_utc
+  - rel_path is always relative to --base (default /ai_data/ebooks), so --root can point
+    at any subtree without its rows clashing with a full scan's
   - minimal assumptions about metadata (title/author are "guesses")
 """
 
@@ -21,10 +29,14 @@ import re
 import sqlite3
 import sys
 import time
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
 from typing import Iterable, Optional, Tuple
 
+from corpus_walk import rel_path, walk
+
 DEFAULT_ROOT = Path("/ai_data/ebooks")
 DEFAULT_OUTDIR = DEFAULT_ROOT / "_corpus_index"
 
@@ -53,7 +65,7 @@ STATUS_DIGESTED = "DIGESTED"
 
 def sha256_file(path: Path, buf_size: int = 1024 * 1024) -> str:
     h = hashlib.sha256()
-    with path.open("rb") as f:
+    with open(path, "rb") as f:
         while True:
             b = f.read(buf_size)
             if not b:
@@ -61,7 +73,101 @@ def sha256_file(path: Path, buf_size: int = 1024 * 1024) -> str:
             h.update(b)
     return h.hexdigest()
 
-def safe_stat(path: Path) -> Tuple[int, float]:
+FP_BLOCK = 64 * 1024
+
+def fast_fingerprint(path: Path, size: int) -> str:
+    """sha256 over the size and the first, middle and last FP_BLOCK bytes (whole file if small)."""
+    h = hashlib.sha256(b"fp1:%d:" % size)
+    with open(path, "rb") as f:
+        if size <= 3 * FP_BLOCK:
+            h.update(f.read())
+        else:
+            for off in (0, (size - FP_BLOCK) // 2, size - FP_BLOCK):
+                f.seek(off)
+                h.update(f.read(FP_BLOCK))
+    return h.hexdigest()
+
+def full_hasher(path: Path, size: int) -> Tuple[str, int]:
+    return sha256_file(path), size
+
+def fingerprint_hasher(full: bool):
+    """hash_files hasher returning ((fast_fp, sha256 or None), bytes read)."""
+    def hasher(path: Path, size: int) -> Tuple[Tuple[str, Optional[str]], int]:
+        fp = fast_fingerprint(path, size)
+        if full or size <= 3 * FP_BLOCK:
+            # small files are read whole for the fingerprint anyway
+            return (fp, sha256_file(path)), size + min(size, 3 * FP_BLOCK)
+        return (fp, None), 3 * FP_BLOCK
+    return hasher
+
+def hash_files(paths: Iterable[os.DirEntry], jobs: int = 1, max_inflight_bytes: int = 512 * 1024 * 1024,
+               io_stats: Optional[dict] = None, hasher=full_hasher) -> Iterable[Tuple[Path, int, float, object]]:
+    """
+    (path, size, mtime, digest) for each path, in input order; digest is whatever
+    hasher(path, size) returns first (the sha256 by default). With jobs > 1 the hashing
+    runs on a thread pool (hashlib releases the GIL); files are submitted until
+    max_inflight_bytes of not-yet-yielded data is queued, so a run of huge PDFs can't
+    pile up unbounded work. Stat/read errors are reported and the path is skipped.
+    """
+    stats = io_stats if io_stats is not None else {}
+    stats.setdefault("bytes", 0)
+    t0 = time.time()
+
+    def done(p: Path, size: int, mtime: float, res, err: Optional[Exception]):
+        stats["secs"] = time.time() - t0
+        if err is not None:
+            print(f"WARN: sha256 failed: {p} ({err})", file=sys.stderr)
+            return None
+        digest, nbytes = res
+        stats["bytes"] += nbytes
+        return p, size, mtime, digest
+
+    def stat_all() -> Iterable[Tuple[Path, int, float]]:
+        for p in paths:
+            try:
+                size, mtime = safe_stat(p)
+            except Exception as e:
+                print(f"WARN: stat failed: {p.path} ({e})", file=sys.stderr)
+                continue
+            yield Path(p), size, mtime
+
+    if jobs <= 1:
+        for p, size, mtime in stat_all():
+            try:
+                res = done(p, size, mtime, hasher(p, size), None)
+            except Exception as e:
+                res = done(p, size, mtime, None, e)
+            if res:
+                yield res
+        return
+
+    pending: deque = deque()
+    inflight = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        def drain_one():
+            nonlocal inflight
+            p, size, mtime, fut = pending.popleft()
+            inflight -= size
+            try:
+                return done(p, size, mtime, fut.result(), None)
+            except Exception as e:
+                return done(p, size, mtime, None, e)
+
+        for p, size, mtime in stat_all():
+            # always admit one file, however large; otherwise wait for the oldest
+            while pending and (inflight + size > max_inflight_bytes or len(pending) >= jobs * 4):
+                res = drain_one()
+                if res:
+                    yield res
+            pending.append((p, size, mtime, pool.submit(hasher, p, size)))
+            inflight += size
+        while pending:
+            res = drain_one()
+            if res:
+                yield res
+
+def safe_stat(path) -> Tuple[int, float]:
+    # Path or os.DirEntry (whose stat() is cached from the directory scan)
     st = path.stat()
     return st.st_size, st.st_mtime
 
@@ -150,6 +256,8 @@ class Row:
     source_guess: Optional[str]
     notes: Optional[str]
     created_utc: int
+    fast_fp: Optional[str] = None
+    sha256_full: Optional[str] = None
 
 # ---------- DB ----------
 
@@ -174,7 +282,11 @@ CREATE TABLE IF NOT EXISTS corpus_items (
   source_guess TEXT,
   notes TEXT,
 
-  created_utc INTEGER NOT NULL
+  created_utc INTEGER NOT NULL,
+  missing_utc INTEGER,                      -- set when the file is gone from disk
+  fast_fp TEXT,                             -- size + head/middle/tail block hash
+  sha256_full TEXT                          -- full content hash when known; with --fast the
+                                            -- key (sha256) may be the fast_fp instead
 );
 
 CREATE INDEX IF NOT EXISTS idx_corpus_rel_path ON corpus_items(rel_path);
@@ -182,6 +294,25 @@ CREATE INDEX IF NOT EXISTS idx_corpus_status   ON corpus_items(status);
 CREATE INDEX IF NOT EXISTS idx_corpus_ext      ON corpus_items(ext);
 CREATE INDEX IF NOT EXISTS idx_corpus_author   ON corpus_items(author_guess);
 CREATE INDEX IF NOT EXISTS idx_corpus_title    ON corpus_items(title_guess);
+
+-- every file seen by the last scan (rel_path relative to --base, whatever --root was);
+-- identical copies share one corpus_items row
+CREATE TABLE IF NOT EXISTS corpus_paths (
+  rel_path TEXT PRIMARY KEY,
+  abs_path TEXT NOT NULL,
+  sha256 TEXT NOT NULL,
+  size_bytes INTEGER NOT NULL,
+  mtime_epoch REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_paths_sha256 ON corpus_paths(sha256);
+
+-- 'checkpoint:<root>' -> path (relative to root) of the last file committed by an unfinished scan
+-- 'base' -> the directory every rel_path in this DB is relative to
+CREATE TABLE IF NOT EXISTS scan_state (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
 """
 
 UPSERT_SQL = """
@@ -189,54 +320,167 @@ INSERT INTO corpus_items (
   sha256, sha256_prefix, rel_path, abs_path, ext,
   size_bytes, mtime_epoch,
   status, title_guess, author_guess, tradition_guess, language_guess, source_guess, notes,
-  created_utc
-) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+  created_utc, fast_fp, sha256_full
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
 ON CONFLICT(sha256) DO UPDATE SET
   rel_path=excluded.rel_path,
   abs_path=excluded.abs_path,
   ext=excluded.ext,
   size_bytes=excluded.size_bytes,
+  mtime_epoch=excluded.mtime_epoch,
+  missing_utc=NULL,
+  fast_fp=excluded.fast_fp,
+  sha256_full=coalesce(excluded.sha256_full, corpus_items.sha256_full)
+;
+"""
+
+PATH_UPSERT_SQL = """
+INSERT INTO corpus_paths (rel_path, abs_path, sha256, size_bytes, mtime_epoch) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(rel_path) DO UPDATE SET
+  abs_path=excluded.abs_path,
+  sha256=excluded.sha256,
+  size_bytes=excluded.size_bytes,
   mtime_epoch=excluded.mtime_epoch
 ;
 """
 
-# ---------- scan ----------
+def ensure_columns(con: sqlite3.Connection) -> None:
+    """Upgrade corpus_index.sqlite files created before missing_utc / fast_fp / corpus_paths existed."""
+    cols = {r[1] for r in con.execute("PRAGMA table_info(corpus_items)")}
+    for col in ("missing_utc INTEGER", "fast_fp TEXT", "sha256_full TEXT"):
+        if col.split()[0] not in cols:
+            con.execute(f"ALTER TABLE corpus_items ADD COLUMN {col}")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_corpus_fast_fp ON corpus_items(fast_fp)")
+    if con.execute("SELECT 1 FROM corpus_paths LIMIT 1").fetchone() is None:
+        # seed from the items so the first --incremental run doesn't rehash everything
+        con.execute("""
+          INSERT OR IGNORE INTO corpus_paths (rel_path, abs_path, sha256, size_bytes, mtime_epoch)
+          SELECT rel_path, abs_path, sha256, size_bytes, mtime_epoch FROM corpus_items WHERE missing_utc IS NULL
+        """)
+    con.commit()
+
+def resolve_key(cur: sqlite3.Cursor, path: Path, fp: str, full: Optional[str], prev_key: Optional[str],
+                fp_stats: dict[str, int]) -> Tuple[str, Optional[str]]:
+    """
+    (item key, full sha256 or None) for a file with fingerprint fp. No other item with
+    that fingerprint: the key is the full hash, or fp itself when it wasn't computed.
+    Otherwise both sides are fully hashed (lazily, once) so only identical bytes share
+    an item.
+    """
+    rows = cur.execute("SELECT sha256, sha256_full, abs_path FROM corpus_items WHERE fast_fp=?", (fp,)).fetchall()
+    if not rows:
+        return full or fp, full
+    for key, row_full, _ in rows:
+        if full is not None and full in (key, row_full):
+            return key, full
+        if full is None and key == prev_key:
+            # this path's own item, fingerprint unchanged: trust it like an unchanged mtime
+            return key, None
+
+    fp_stats["collisions"] += 1
+    if full is None:
+        full = sha256_file(path)
+    for key, row_full, abs_path in rows:
+        if row_full is None:
+            if abs_path == str(path):
+                row_full = full
+            else:
+                try:
+                    row_full = sha256_file(Path(abs_path))
+                except OSError:
+                    continue
+            cur.execute("UPDATE corpus_items SET sha256_full=? WHERE sha256=?", (row_full, key))
+        if row_full == full:
+            return key, full
+    return full, full
+
+def load_known(con: sqlite3.Connection) -> dict[str, Tuple[int, float]]:
+    """rel_path -> (size_bytes, mtime_epoch) as of the last scan."""
+    return {
+        rel: (size, mtime)
+        for rel, size, mtime in con.execute("SELECT rel_path, size_bytes, mtime_epoch FROM corpus_paths")
+    }
+
+def retire_hash(cur: sqlite3.Cursor, sha: str, now: int) -> int:
+    """
+    A file holding sha is gone (deleted, or rewritten with new content): point the
+    corpus_items row at a surviving copy, or flag it missing if there is none.
+    """
+    alt = cur.execute("SELECT rel_path, abs_path FROM corpus_paths WHERE sha256=? LIMIT 1", (sha,)).fetchone()
+    if alt:
+        cur.execute(
+            "UPDATE corpus_items SET rel_path=?, abs_path=? WHERE sha256=? "
+            "AND rel_path NOT IN (SELECT rel_path FROM corpus_paths WHERE sha256=?)",
+            (alt[0], alt[1], sha, sha),
+        )
+        return 0
+    cur.execute("UPDATE corpus_items SET missing_utc=? WHERE sha256=? AND missing_utc IS NULL", (now, sha))
+    return cur.rowcount
 
-def iter_files(root: Path, exts: set[str], exclude_dirs: set[str]) -> Iterable[Path]:
-    for dirpath, dirnames, filenames in os.walk(root):
-        dp = Path(dirpath)
+SEEN_SQL = "CREATE TEMP TABLE IF NOT EXISTS seen_paths (rel_path TEXT PRIMARY KEY)"
 
-        # prune excluded dirs
-        dirnames[:] = [d for d in dirnames if d not in exclude_dirs and not d.startswith(".")]
+def record_seen(con: sqlite3.Connection, rels: list[str]) -> None:
+    """Add a batch of walked rel_paths to the per-run temp.seen_paths table (and empty rels)."""
+    con.executemany("INSERT OR IGNORE INTO seen_paths (rel_path) VALUES (?)", ((r,) for r in rels))
+    rels.clear()
 
-        # also skip if *this* directory is excluded
-        if should_skip_dir(dp, exclude_dirs):
-            continue
+def mark_missing(con: sqlite3.Connection, root: Path, now: int) -> int:
+    """
+    Forget paths under root that this scan did not record in temp.seen_paths; returns
+    items newly flagged missing.
+    """
+    prefix = str(root).rstrip("/") + "/"
+    gone = con.execute("""
+      SELECT p.rel_path, p.sha256 FROM corpus_paths p
+      WHERE substr(p.abs_path, 1, ?) = ?
+        AND NOT EXISTS (SELECT 1 FROM seen_paths s WHERE s.rel_path = p.rel_path)
+    """, (len(prefix), prefix)).fetchall()
+    cur = con.cursor()
+    cur.executemany("DELETE FROM corpus_paths WHERE rel_path=?", [(rel,) for rel, _ in gone])
+    n = sum(retire_hash(cur, sha, now) for sha in {sha for _, sha in gone})
+    con.commit()
+    return n
 
-        for fn in filenames:
-            p = dp / fn
-            if not p.is_file():
-                continue
-            ext = p.suffix.lower()
-            if ext in exts:
-                yield p
+# ---------- scan ----------
 
-def build_rows(paths: Iterable[Path], root: Path) -> Iterable[Row]:
-    created_utc = int(time.time())
+def iter_files(root: Path, exts: set[str], exclude_dirs: set[str], start_after: str = "") -> Iterable[os.DirEntry]:
+    # also skip if the root directory itself is excluded
+    if should_skip_dir(root, exclude_dirs):
+        return
+    yield from walk(
+        root,
+        lambda name: os.path.splitext(name)[1].lower() in exts,
+        exclude_dirs,
+        skip_hidden=True,
+        start_after=start_after,
+    )
+
+def changed_files(paths: Iterable[os.DirEntry], base: Path, known: dict[str, Tuple[int, float]],
+                  stats: dict[str, int]) -> Iterable[os.DirEntry]:
+    """Drop files whose size and mtime match the last scan; count the rest."""
     for p in paths:
         try:
             size, mtime = safe_stat(p)
-        except Exception as e:
-            print(f"WARN: stat failed: {p} ({e})", file=sys.stderr)
+        except Exception:
+            yield p  # build_rows reports it
             continue
-
-        try:
-            s = sha256_file(p)
-        except Exception as e:
-            print(f"WARN: sha256 failed: {p} ({e})", file=sys.stderr)
+        prev = known.get(rel_path(p, base))
+        if prev is None:
+            stats["new"] += 1
+        elif prev == (size, mtime):
+            stats["unchanged"] += 1
             continue
+        else:
+            stats["modified"] += 1
+        yield p
 
-        rel = str(p.relative_to(root))
+def build_rows(paths: Iterable[os.DirEntry], base: Path, jobs: int = 1, max_inflight_bytes: int = 512 * 1024 * 1024,
+               io_stats: Optional[dict] = None, hasher=full_hasher) -> Iterable[Row]:
+    created_utc = int(time.time())
+    for p, size, mtime, digest in hash_files(paths, jobs, max_inflight_bytes, io_stats, hasher):
+        # full_hasher: the sha256; fingerprint_hasher: (fast_fp, sha256 or None)
+        fp, s = digest if isinstance(digest, tuple) else (None, digest)
+        rel = str(p.relative_to(base))
         ext = p.suffix.lower()
 
         author_guess, title_guess = guess_author_title_from_filename(p.name)
@@ -255,9 +499,10 @@ def build_rows(paths: Iterable[Path], root: Path) -> Iterable[Row]:
         elif "gutenberg" in pl:
             source_guess = "Project Gutenberg"
 
+        key = s or fp  # provisional; main() settles fingerprint collisions
         yield Row(
-            sha256=s,
-            sha256_prefix=s[:12],
+            sha256=key,
+            sha256_prefix=key[:12],
             rel_path=rel,
             abs_path=str(p),
             ext=ext,
@@ -271,6 +516,8 @@ def build_rows(paths: Iterable[Path], root: Path) -> Iterable[Row]:
             source_guess=source_guess,
             notes=None,
             created_utc=created_utc,
+            fast_fp=fp,
+            sha256_full=s,
         )
 
 def write_tsv(db_path: Path, tsv_path: Path) -> None:
@@ -292,13 +539,31 @@ def write_tsv(db_path: Path, tsv_path: Path) -> None:
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--root", default=str(DEFAULT_ROOT), help="Root directory to scan (default: /ai_data/ebooks)")
+    ap.add_argument("--base", default=str(DEFAULT_ROOT),
+                    help="Directory rel_path is stored relative to (default: /ai_data/ebooks); --root must lie "
+                         "under it, so scans of different subtrees share one set of paths")
     ap.add_argument("--outdir", default=str(DEFAULT_OUTDIR), help="Output directory for index files")
     ap.add_argument("--include-ext", action="append", default=[], help="Add extra file extension to include, e.g. .zip")
     ap.add_argument("--exclude-dir", action="append", default=[], help="Add dir name to exclude from scan")
     ap.add_argument("--no-exclude-defaults", action="store_true", help="Do not exclude default dirs")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Only hash files that are new or whose size/mtime changed since the last run")
+    ap.add_argument("--jobs", type=int, default=1, help="Hash this many files concurrently (threads)")
+    ap.add_argument("--inflight-mb", type=int, default=512,
+                    help="With --jobs: max MB of queued-but-unfinished files (default 512)")
+    ap.add_argument("--fast", action="store_true",
+                    help="Key new files by a head/middle/tail fingerprint; full sha256 only on fingerprint collisions")
+    ap.add_argument("--verify", action="store_true",
+                    help="With --fast: still compute the full sha256 of every file hashed (fills sha256_full)")
+    ap.add_argument("--resume", action="store_true",
+                    help="Continue an interrupted scan after the last file it committed")
     args = ap.parse_args()
 
     root = Path(args.root)
+    base = Path(args.base)
+    if root.resolve() != base.resolve() and base.resolve() not in root.resolve().parents:
+        print(f"ERROR: --root {root} is not under --base {base}", file=sys.stderr)
+        return 2
     outdir = Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
 
@@ -314,14 +579,65 @@ def main() -> int:
 
     con = sqlite3.connect(db_path)
     con.executescript(SCHEMA_SQL)
+    ensure_columns(con)
 
-    cur = con.cursor()
+    r = con.execute("SELECT value FROM scan_state WHERE key='base'").fetchone()
+    if r is None:
+        con.execute("INSERT INTO scan_state (key, value) VALUES ('base', ?)", (str(base.resolve()),))
+        con.commit()
+    elif r[0] != str(base.resolve()):
+        print(f"ERROR: {db_path} holds paths relative to {r[0]}, not --base {base}", file=sys.stderr)
+        return 2
+    con.execute(SEEN_SQL)
 
-    files = list(iter_files(root, exts, exclude_dirs))
-    print(f"SCAN: {len(files)} candidate files under {root}")
+    cur = con.cursor()
+    t0 = time.time()
+
+    ckpt_key = f"checkpoint:{root.resolve()}"
+    start_after = ""
+    if args.resume:
+        r = con.execute("SELECT value FROM scan_state WHERE key=?", (ckpt_key,)).fetchone()
+        start_after = r[0] if r else ""
+
+    # walked paths go to temp.seen_paths in batches; mark_missing() anti-joins against it
+    seen_batch: list[str] = []
+    n_seen = 0
+
+    def scan() -> Iterable[os.DirEntry]:
+        nonlocal n_seen
+        for e in iter_files(root, exts, exclude_dirs, start_after):
+            seen_batch.append(rel_path(e, base))
+            n_seen += 1
+            if len(seen_batch) >= 1000:
+                record_seen(con, seen_batch)
+            yield e
+
+    files: Iterable[os.DirEntry] = scan()
+    stats = {"new": 0, "modified": 0, "unchanged": 0}
+    mode = "incremental, hashing new/modified files" if args.incremental else "hashing all files"
+    if args.incremental:
+        files = changed_files(files, base, load_known(con), stats)
+    print(f"SCAN: {mode} under {root}" + (f" (resuming after {start_after})" if start_after else ""))
 
     n = 0
-    for row in build_rows(files, root):
+    n_missing = 0
+    io_stats = {"bytes": 0, "secs": 0.0}
+
+    def rate() -> str:
+        mb = io_stats["bytes"] / 1e6
+        return f"{mb:,.0f} MB, {mb / io_stats['secs']:,.1f} MB/s" if io_stats["secs"] > 0 else f"{mb:,.0f} MB"
+
+    # fingerprints are always recorded (they are nearly free next to a full read); only
+    # --fast without --verify skips the full hash
+    hasher = fingerprint_hasher(full=not args.fast or args.verify)
+    fp_stats = {"collisions": 0}
+
+    for row in build_rows(files, base, args.jobs, args.inflight_mb * 1024 * 1024, io_stats, hasher):
+        prev = cur.execute("SELECT sha256, size_bytes, mtime_epoch FROM corpus_paths WHERE rel_path=?",
+                           (row.rel_path,)).fetchone()
+        key, full = resolve_key(cur, Path(row.abs_path), row.fast_fp, row.sha256_full, prev[0] if prev else None,
+                                fp_stats)
+        row = replace(row, sha256=key, sha256_prefix=key[:12], sha256_full=full)
         cur.execute(
             UPSERT_SQL,
             (
@@ -329,20 +645,46 @@ def main() -> int:
                 row.size_bytes, row.mtime_epoch,
                 row.status, row.title_guess, row.author_guess,
                 row.tradition_guess, row.language_guess, row.source_guess, row.notes,
-                row.created_utc,
+                row.created_utc, row.fast_fp, row.sha256_full,
             ),
         )
+        if full is None and prev and prev[0] == key and (prev[1], prev[2]) != (row.size_bytes, row.mtime_epoch):
+            # --fast: rewritten without touching the fingerprinted blocks; the item keeps its
+            # key, but a full hash taken before the edit no longer describes the file
+            cur.execute("UPDATE corpus_items SET sha256_full=NULL WHERE sha256=?", (key,))
+        cur.execute(PATH_UPSERT_SQL, (row.rel_path, row.abs_path, row.sha256, row.size_bytes, row.mtime_epoch))
+        if prev and prev[0] != row.sha256:
+            # modified in place: the old item keeps its row (status history) unless no copy is left
+            n_missing += retire_hash(cur, prev[0], row.created_utc)
         n += 1
         if n % 200 == 0:
+            # rows come back in walk order, so everything up to this file is done
+            cur.execute("INSERT OR REPLACE INTO scan_state (key, value) VALUES (?, ?)",
+                        (ckpt_key, os.path.relpath(row.abs_path, root)))
             con.commit()
-            print(f"  indexed: {n}")
+            print(f"  indexed: {n}  ({rate()})")
 
+    cur.execute("DELETE FROM scan_state WHERE key=?", (ckpt_key,))
     con.commit()
+    if start_after:
+        # this run only saw the tail of the tree; vanished-file detection needs a full scan
+        print("NOTE: resumed scan; skipping missing-file detection")
+    else:
+        record_seen(con, seen_batch)
+        n_missing += mark_missing(con, root, int(time.time()))
     con.close()
 
     write_tsv(db_path, tsv_path)
 
-    print(f"DONE: indexed {n} files")
+    print(f"DONE: indexed {n} files in {time.time() - t0:,.1f}s  (hashed {rate()})")
+    if args.incremental:
+        print(f"      {n_seen} scanned: {stats['unchanged']} unchanged, "
+              f"{stats['new']} new, {stats['modified']} modified")
+    else:
+        print(f"      {n_seen} scanned")
+    print(f"      {n_missing} newly missing")
+    if args.fast:
+        print(f"      {fp_stats['collisions']} fingerprint collisions resolved by full sha256")
     print(f"DB:   {db_path}")
     print(f"TSV:  {tsv_path}")
     return 0
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import os
 import re
 import sqlite3
 import hashlib
@@ -7,24 +6,25 @@ import subprocess
 import argparse
 from pathlib import Path
 from datetime import datetime
-import itertools
+
+from corpus_manifest import (
+  scan_changes, ensure_schema, store_doc, bulk_begin, bulk_finish,
+  gone_hashes, repoint_doc, tombstone_docs, bump_generation, pool_map,
+)
+from corpus_docstore import DocStore, encode, norm_ref
 
 SRC_ROOT_DEFAULT = Path("/ai_data/ebooks")
 OUT_ROOT = Path("/ai_data/ai_corpus")
 NORM_DIR = OUT_ROOT / "normalized"
 DB = OUT_ROOT / "manifest.sqlite"
 LOG_DIR = OUT_ROOT / "logs"
-LOG_DIR.mkdir(parents=True, exist_ok=True)
-NORM_DIR.mkdir(parents=True, exist_ok=True)
 
 FAIL_LOG = LOG_DIR / "pdf_ingest_failures.log"
+MIN_TEXT = 200  # below this many extracted chars a PDF is taken to be scan-only
 
 def sha256_text(s: str) -> str:
   return hashlib.sha256(s.encode("utf-8", "ignore")).hexdigest()
 
-def doc_id_for(rel_path: str) -> str:
-  return hashlib.sha1(rel_path.encode("utf-8", "ignore")).hexdigest()
-
 def normalize_text(raw: str) -> str:
   raw = raw.replace("\r\n", "\n").replace("\r", "\n")
   raw = re.sub(r"[^\S\n]+", " ", raw)
@@ -71,31 +71,33 @@ def chunk_paragraph_aware(text: str, target_chars=2500, overlap_chars=200):
 
   return chunks
 
-def upsert_doc(con, doc):
-  con.execute("""
-    INSERT INTO docs(doc_id, rel_path, abs_path, ext, size_bytes, mtime_ns, norm_hash, norm_path, updated_at)
-    VALUES(?,?,?,?,?,?,?,?,datetime('now'))
-    ON CONFLICT(doc_id) DO UPDATE SET
-      rel_path=excluded.rel_path,
-      abs_path=excluded.abs_path,
-      ext=excluded.ext,
-      size_bytes=excluded.size_bytes,
-      mtime_ns=excluded.mtime_ns,
-      norm_hash=excluded.norm_hash,
-      norm_path=excluded.norm_path,
-      updated_at=datetime('now')
-  """, doc)
-
-def delete_chunks_for_doc(con, doc_id: str):
-  con.execute("DELETE FROM chunks WHERE doc_id=?", (doc_id,))
-
-def pdftotext_extract(pdf_path: Path) -> str:
+def pdftotext_extract(pdf_path: Path, timeout=None) -> str:
   cmd = ["pdftotext", "-nopgbrk", "-layout", str(pdf_path), "-"]
-  r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+  try:
+    r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False, timeout=timeout)
+  except subprocess.TimeoutExpired:
+    raise RuntimeError(f"pdftotext timed out after {timeout}s")
   if r.returncode != 0:
     raise RuntimeError(r.stderr.decode("utf-8", "ignore").strip() or f"pdftotext failed rc={r.returncode}")
   return r.stdout.decode("utf-8", "ignore")
 
+def pdf_text(pdf_path: Path, min_text: int = MIN_TEXT, timeout=None) -> str:
+  # normalized text of a PDF as it goes into manifest.sqlite (also corpus_digest_run.py --to-manifest)
+  norm = normalize_text(pdftotext_extract(pdf_path, timeout))
+  if len(norm.strip()) < min_text:
+    raise RuntimeError("extracted text too short (likely scanned/image-only PDF)")
+  return norm
+
+def extract_pdf(task):
+  # Worker side: everything except the DB write. Safe to run in a pool process.
+  rel, pdf, min_text = task
+  try:
+    norm = pdf_text(Path(pdf), min_text)
+    nh = sha256_text(norm)
+    return rel, nh, encode(norm), chunk_paragraph_aware(norm), None
+  except Exception as ex:
+    return rel, None, None, None, str(ex)
+
 def should_skip(rel: str) -> bool:
   if "/_text_unified/clean_txt/" in rel:
     return True
@@ -107,86 +109,114 @@ def main():
   ap = argparse.ArgumentParser()
   ap.add_argument("--root", default=str(SRC_ROOT_DEFAULT), help="Root directory to scan for PDFs")
   ap.add_argument("--src-root", default=str(SRC_ROOT_DEFAULT), help="Base root used to compute rel_path (usually /ai_data/ebooks)")
-  ap.add_argument("--limit", type=int, default=0, help="Process at most N PDFs (0 = no limit)")
-  ap.add_argument("--min-text", type=int, default=200, help="Minimum extracted chars to accept (scan-only below this)")
+  ap.add_argument("--limit", type=int, default=0, help="Process at most N new/changed PDFs (0 = no limit)")
+  ap.add_argument("--min-text", type=int, default=MIN_TEXT, help="Minimum extracted chars to accept (scan-only below this)")
+  ap.add_argument("--workers", type=int, default=1, help="Extraction worker processes (1 = serial, in-process)")
+  ap.add_argument("--batch", type=int, default=0, help="Commit to manifest.sqlite every N processed PDFs (default 25, 1000 with --bulk)")
+  ap.add_argument("--bulk", action="store_true",
+                  help="Bulk load: drop FTS triggers, load in large transactions, rebuild + optimize chunks_fts at the end")
+  ap.add_argument("--force", action="store_true", help="Re-extract and re-chunk every PDF, changed or not")
   args = ap.parse_args()
+  if not args.batch:
+    args.batch = 1000 if args.bulk else 25
 
   scan_root = Path(args.root)
   src_root = Path(args.src_root)
+  FAIL_LOG.parent.mkdir(parents=True, exist_ok=True)
 
+  store = DocStore()
   con = sqlite3.connect(DB)
   con.execute("PRAGMA journal_mode=WAL;")
   con.execute("PRAGMA synchronous=NORMAL;")
-
-  it = scan_root.rglob("*.pdf")
-  pdfs_iter = itertools.islice(it, args.limit) if args.limit and args.limit > 0 else it
-
-  done = 0
+  ensure_schema(con)
+
+  # Change detection pre-pass: one query + one scandir walk, no per-file SELECT/exists()
+  scan = scan_changes(con, scan_root, src_root, ".pdf", "pdf", NORM_DIR, skip=should_skip, force=args.force,
+                      stored=store.doc_ids())
+  todo = scan.todo
+  if args.limit and args.limit > 0:
+    todo = todo[:args.limit]
+  print(f"Pre-pass: scanned={scan.seen:,} unchanged={scan.unchanged:,} new={len(scan.new):,} "
+        f"changed={len(scan.changed):,} deleted={len(scan.deleted):,}")
+
+  # rename candidates: a new PDF whose text matches a vanished doc keeps that doc's chunks
+  gone = gone_hashes(con, scan.deleted)
+  new_ids = {item[0] for item in scan.new}
+  repointed = set()
+
+  done = scan.unchanged
+  written = 0  # docs stored or repointed by this run
   failed = 0
-  seen = 0
-
-  for pdf in pdfs_iter:
-    seen += 1
-    try:
-      rel = pdf.relative_to(src_root).as_posix()
-    except Exception:
-      # If root isn't under src_root, fall back to rel within scan_root
-      rel = pdf.relative_to(scan_root).as_posix()
-
-    if should_skip(rel):
-      continue
-
-    st = pdf.stat()
-    doc_id = doc_id_for(rel)
-    norm_path = (NORM_DIR / f"{doc_id}.txt").as_posix()
-
-    row = con.execute(
-      "SELECT size_bytes, mtime_ns FROM docs WHERE doc_id=?",
-      (doc_id,)
-    ).fetchone()
-
-    if row and row[0] == st.st_size and row[1] == st.st_mtime_ns and os.path.exists(norm_path):
-      done += 1
+  n_chunks = 0
+  seen = scan.seen
+  pending = {}  # rel -> doc tuple, for PDFs handed to extract_pdf
+  tasks = []
+  for doc_id, rel, abs_path, size, mtime_ns in todo:
+    pending[rel] = (doc_id, rel, abs_path, "pdf", size, mtime_ns, norm_ref(doc_id))
+    tasks.append((rel, abs_path, args.min_text))
+
+  if args.bulk and tasks:
+    bulk_begin(con)
+
+  if args.workers > 1:
+    results = pool_map(extract_pdf, tasks, args.workers)
+  else:
+    results = map(extract_pdf, tasks)
+
+  # Single writer: only this loop touches manifest.sqlite.
+  uncommitted = 0
+  for rel, nh, enc, chunks, err in results:
+    doc_id, rel, abs_path, ext, size, mtime_ns, norm_path = pending.pop(rel)
+
+    if err is not None:
+      failed += 1
+      with FAIL_LOG.open("a", encoding="utf-8") as f:
+        f.write(f"{datetime.now().isoformat()}  {rel}\n  {err}\n")
       continue
 
     try:
-      raw = pdftotext_extract(pdf)
-      norm = normalize_text(raw)
-
-      if len(norm.strip()) < args.min_text:
-        raise RuntimeError("extracted text too short (likely scanned/image-only PDF)")
-
-      nh = sha256_text(norm)
-      Path(norm_path).write_text(norm, encoding="utf-8")
-
-      upsert_doc(con, (
-        doc_id, rel, str(pdf.resolve()), "pdf", st.st_size, st.st_mtime_ns, nh, norm_path
-      ))
-
-      delete_chunks_for_doc(con, doc_id)
-      chunks = chunk_paragraph_aware(norm)
-
-      for idx, (ct, s, e) in enumerate(chunks):
-        chunk_id = hashlib.sha1(f"{doc_id}:{idx}:{s}:{e}".encode("utf-8")).hexdigest()
-        con.execute(
-          "INSERT INTO chunks(chunk_id, doc_id, chunk_idx, start_char, end_char, text) VALUES(?,?,?,?,?,?)",
-          (chunk_id, doc_id, idx, s, e, ct)
-        )
-
-      con.commit()
-      done += 1
-
-      if done % 25 == 0:
-        print(f"Processed PDFs: {done:,} (failures: {failed:,})  last={rel}")
-
+      store.put_encoded(doc_id, enc)
+      doc = (doc_id, rel, abs_path, ext, size, mtime_ns, nh, norm_path)
+      if doc_id in new_ids and nh in gone:
+        old_id = gone[nh]
+        repoint_doc(con, old_id, doc)
+        del gone[nh]
+        repointed.add(old_id)
+      else:
+        n_chunks += store_doc(con, doc, chunks, rechunk=args.force)
     except Exception as ex:
       failed += 1
       with FAIL_LOG.open("a", encoding="utf-8") as f:
         f.write(f"{datetime.now().isoformat()}  {rel}\n  {ex}\n")
+      continue
 
+    done += 1
+    written += 1
+    uncommitted += 1
+    if uncommitted >= args.batch:
+      store.commit()  # texts before the docs rows that point at them
+      con.commit()
+      uncommitted = 0
+
+    if done % 25 == 0:
+      print(f"Processed PDFs: {done:,} (failures: {failed:,})  last={rel}")
+
+  store.commit()
+  con.commit()
+
+  # Reconcile: whatever vanished and wasn't claimed by a rename is tombstoned
+  n_gone, n_dead = tombstone_docs(con, (d for d in scan.deleted if d not in repointed))
+  if written or n_gone:
+    bump_generation(con)
+  con.commit()
+  store.delete(scan.deleted)
+  store.close()
+  if args.bulk and tasks:
+    bulk_finish(con)
   con.close()
+  print(f"Reconciled: renamed={len(repointed):,} tombstoned={n_gone:,} (chunks removed: {n_dead:,})")
   print(f"Scan root: {scan_root}")
-  print(f"Done. PDFs processed: {done:,}, failures: {failed:,}, scanned: {seen:,}")
+  print(f"Done. PDFs processed: {done:,}, failures: {failed:,}, scanned: {seen:,}, chunks indexed: {n_chunks:,}")
   print(f"Failure log: {FAIL_LOG}")
 
 if __name__ == "__main__":
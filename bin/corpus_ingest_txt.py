@@ -1,23 +1,28 @@
 #!/usr/bin/env python3
-import os
 import re
+import sys
+import time
+import queue
 import sqlite3
 import hashlib
+import argparse
+import threading
 from pathlib import Path
 
+from corpus_manifest import (
+  scan_changes, ensure_schema, store_doc, bulk_begin, bulk_finish,
+  gone_hashes, repoint_doc, tombstone_docs, bump_generation, pool_map,
+)
+from corpus_docstore import DocStore, encode, norm_ref
+
 SRC_ROOT = Path("/ai_data/ebooks")
 OUT_ROOT = Path("/ai_data/ai_corpus")
 NORM_DIR = OUT_ROOT / "normalized"
 DB = OUT_ROOT / "manifest.sqlite"
 
-NORM_DIR.mkdir(parents=True, exist_ok=True)
-
 def sha256_text(s: str) -> str:
   return hashlib.sha256(s.encode("utf-8", "ignore")).hexdigest()
 
-def doc_id_for(rel_path: str) -> str:
-  return hashlib.sha1(rel_path.encode("utf-8", "ignore")).hexdigest()
-
 def normalize_text(raw: str) -> str:
   # conservative normalization: keep paragraph breaks, clean control chars
   raw = raw.replace("\r\n", "\n").replace("\r", "\n")
@@ -73,94 +78,164 @@ def chunk_paragraph_aware(text: str, target_chars=2500, overlap_chars=200):
 
   return chunks
 
-def upsert_doc(con, doc):
-  con.execute("""
-    INSERT INTO docs(doc_id, rel_path, abs_path, ext, size_bytes, mtime_ns, norm_hash, norm_path, updated_at)
-    VALUES(?,?,?,?,?,?,?,?,datetime('now'))
-    ON CONFLICT(doc_id) DO UPDATE SET
-      rel_path=excluded.rel_path,
-      abs_path=excluded.abs_path,
-      ext=excluded.ext,
-      size_bytes=excluded.size_bytes,
-      mtime_ns=excluded.mtime_ns,
-      norm_hash=excluded.norm_hash,
-      norm_path=excluded.norm_path,
-      updated_at=datetime('now')
-  """, doc)
-
-def delete_chunks_for_doc(con, doc_id: str):
-  con.execute("DELETE FROM chunks WHERE doc_id=?", (doc_id,))
+# ---------- pipeline stages ----------
+
+def read_normalize(task):
+  # stage 1 (pool process): read, normalize, hash, compress for the docstore
+  rel, ap = task
+  try:
+    raw = Path(ap).read_text(errors="ignore")
+    norm = normalize_text(raw)
+    nh = sha256_text(norm)
+    return rel, norm, nh, encode(norm), None
+  except Exception as ex:
+    return rel, None, None, None, str(ex)
+
+_DONE = object()
+
+def chunker(results, out_q: queue.Queue):
+  # stage 2 (thread): chunk normalized text as it arrives from stage 1
+  try:
+    for rel, norm, nh, enc, err in results:
+      chunks = chunk_paragraph_aware(norm) if err is None else None
+      out_q.put((rel, nh, enc, chunks, err))
+  except BaseException as ex:
+    out_q.put(ex)
+  finally:
+    out_q.put(_DONE)
+
+def should_skip(rel: str) -> bool:
+  # avoid merged duplicates
+  if rel.rsplit("/", 1)[-1].lower() == "merged.txt":
+    return True
+  # exclude derived digests inside canonical tree
+  if "/_digested/" in rel:
+    return True
+  return False
 
 def main():
+  ap = argparse.ArgumentParser(description="Ingest canonical TXT files into manifest.sqlite (docs + chunks + FTS).")
+  ap.add_argument("--workers", type=int, default=1, help="Reader/normalizer processes (1 = in-process)")
+  ap.add_argument("--commit-every", type=int, default=0, help="Writer commits every N documents (default 200, 5000 with --bulk)")
+  ap.add_argument("--queue", type=int, default=64, help="Max chunked docs buffered ahead of the writer")
+  ap.add_argument("--bulk", action="store_true",
+                  help="Bulk load: drop FTS triggers, load in large transactions, rebuild + optimize chunks_fts at the end")
+  ap.add_argument("--force", action="store_true", help="Re-ingest and re-chunk every file, changed or not")
+  args = ap.parse_args()
+  if not args.commit_every:
+    args.commit_every = 5000 if args.bulk else 200
+
+  store = DocStore()
   con = sqlite3.connect(DB)
   con.execute("PRAGMA journal_mode=WAL;")
   con.execute("PRAGMA synchronous=NORMAL;")
+  ensure_schema(con)
 
   # Canonical subtree only
   CANON = SRC_ROOT / "_text_unified" / "clean_txt"
-  paths = list(CANON.rglob("*.txt"))
   print(f"Using canonical subtree: {CANON}")
-  print(f"Found TXT: {len(paths):,}")
 
-  done = 0
-  for ap in paths:
-    # avoid merged duplicates
-    if ap.name.lower() == "merged.txt":
+  # Change detection pre-pass: one query + one scandir walk, no per-file SELECT/exists()
+  scan = scan_changes(con, CANON, SRC_ROOT, ".txt", "txt", NORM_DIR, skip=should_skip, force=args.force,
+                      stored=store.doc_ids())
+  print(f"Found TXT: {scan.seen:,}  (new={len(scan.new):,} changed={len(scan.changed):,} deleted={len(scan.deleted):,})")
+
+  # rename candidates: a new file whose text matches a vanished doc keeps that doc's chunks
+  gone = gone_hashes(con, scan.deleted)
+  new_ids = {item[0] for item in scan.new}
+  repointed = set()
+
+  done = scan.unchanged
+  todo = []
+  docs = {}  # rel -> doc tuple (minus norm_hash) for files going through the pipeline
+  for doc_id, rel, abs_path, size, mtime_ns in scan.todo:
+    docs[rel] = (doc_id, rel, abs_path, "txt", size, mtime_ns, norm_ref(doc_id))
+    todo.append((rel, abs_path))
+
+  print(f"Unchanged: {done:,}  to ingest: {len(todo):,}")
+
+  if args.bulk and todo:
+    bulk_begin(con)
+
+  # stage 1 -> stage 2 run off the main thread; the main thread is the single writer
+  if args.workers > 1:
+    results = pool_map(read_normalize, todo, args.workers)
+  else:
+    results = map(read_normalize, todo)
+  q = queue.Queue(maxsize=max(1, args.queue))
+  t = threading.Thread(target=chunker, args=(results, q), daemon=True)
+  t.start()
+
+  t0 = time.time()
+  written = 0
+  n_chunks = 0
+  failed = 0
+  uncommitted = 0
+
+  def rates() -> str:
+    dt = max(time.time() - t0, 1e-9)
+    return f"{written / dt:,.1f} docs/s, {n_chunks / dt:,.1f} chunks/s"
+
+  while True:
+    item = q.get()
+    if item is _DONE:
+      break
+    if isinstance(item, BaseException):
+      raise item
+
+    rel, nh, enc, chunks, err = item
+    doc_id, rel, abs_path, ext, size, mtime_ns, norm_path = docs.pop(rel)
+    if err is not None:
+      failed += 1
+      print(f"WARN: {rel}: {err}", file=sys.stderr)
       continue
 
     try:
-      rel = ap.relative_to(SRC_ROOT).as_posix()
-    except Exception:
-      continue
-
-    # exclude derived digests inside canonical tree
-    if "/_digested/" in rel:
-      continue
-
-    st = ap.stat()
-    doc_id = doc_id_for(rel)
-    norm_path = (NORM_DIR / f"{doc_id}.txt").as_posix()
-
-    row = con.execute(
-      "SELECT size_bytes, mtime_ns, norm_hash FROM docs WHERE doc_id=?",
-      (doc_id,)
-    ).fetchone()
-
-    # incremental: skip if size/mtime match and norm exists
-    if row and row[0] == st.st_size and row[1] == st.st_mtime_ns and os.path.exists(norm_path):
-      done += 1
+      store.put_encoded(doc_id, enc)
+      doc = (doc_id, rel, abs_path, ext, size, mtime_ns, nh, norm_path)
+      if doc_id in new_ids and nh in gone:
+        # rename: keep the existing chunks, just move them to the new doc_id
+        old_id = gone[nh]
+        repoint_doc(con, old_id, doc)
+        del gone[nh]
+        repointed.add(old_id)
+      else:
+        # update doc record, rebuild chunks (or share an identical doc's chunk set)
+        n_chunks += store_doc(con, doc, chunks, rechunk=args.force)
+    except Exception as ex:
+      # store_doc/repoint_doc rolled this doc back (a failed store write never got that far);
+      # it stays "changed" for the next run
+      failed += 1
+      print(f"WARN: {rel}: {ex}", file=sys.stderr)
       continue
 
-    raw = ap.read_text(errors="ignore")
-    norm = normalize_text(raw)
-    nh = sha256_text(norm)
-
-    # write normalized
-    Path(norm_path).write_text(norm, encoding="utf-8")
-
-    # update doc record
-    upsert_doc(con, (
-      doc_id, rel, str(ap.resolve()), "txt", st.st_size, st.st_mtime_ns, nh, norm_path
-    ))
-
-    # rebuild chunks for this doc
-    delete_chunks_for_doc(con, doc_id)
-    chunks = chunk_paragraph_aware(norm)
-
-    for idx, (ct, s, e) in enumerate(chunks):
-      chunk_id = hashlib.sha1(f"{doc_id}:{idx}:{s}:{e}".encode("utf-8")).hexdigest()
-      con.execute(
-        "INSERT INTO chunks(chunk_id, doc_id, chunk_idx, start_char, end_char, text) VALUES(?,?,?,?,?,?)",
-        (chunk_id, doc_id, idx, s, e, ct)
-      )
-
-    con.commit()
-    done += 1
-    if done % 500 == 0:
-      print(f"Processed: {done:,}/{len(paths):,}")
-
+    written += 1
+    uncommitted += 1
+    if uncommitted >= args.commit_every:
+      store.commit()  # texts before the docs rows that point at them
+      con.commit()
+      uncommitted = 0
+
+    if written % 500 == 0:
+      print(f"Processed: {done + written:,}/{scan.seen:,}  ({rates()})")
+
+  t.join()
+  store.commit()
+  con.commit()
+
+  # Reconcile: whatever vanished and wasn't claimed by a rename is tombstoned
+  n_gone, n_dead = tombstone_docs(con, (d for d in scan.deleted if d not in repointed))
+  if written or n_gone:
+    bump_generation(con)
+  con.commit()
+  store.delete(scan.deleted)
+  store.close()
+  if args.bulk and todo:
+    bulk_finish(con)
   con.close()
-  print("Done.")
+  print(f"Reconciled: renamed={len(repointed):,} tombstoned={n_gone:,} (chunks removed: {n_dead:,})")
+  done += written
+  print(f"Done. ingested={written:,} chunks={n_chunks:,} failed={failed:,} unchanged={done - written:,}  ({rates()})")
 
 if __name__ == "__main__":
   main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Streaming JSON for the Sefaria-style exports (corpus_digest_json_run.py,
+corpus_classify_json_raw.py).
+
+  - iter_events() reads a file in 64 KB pieces and yields ijson.basic_parse-style
+    events: ("start_map", None), ("map_key", k), ("string", s), ("number", n), ...
+    ijson is used when installed (its C backend is faster); otherwise a small
+    tokenizer built on json.decoder.scanstring does the same job
+  - peek_object() materializes only the first few KB as a (truncated) object, which
+    is enough for looks_like_text_json(), and records the events it consumed
+  - flatten_events() is flatten_text() over events: paragraphs come out as they
+    are parsed, so memory stays flat however large the file is
+
+  corpus_json_stream.py --self-test   # malformed / well-formed inputs, every installed backend
+"""
+
+import re
+from itertools import chain
+from json import JSONDecodeError
+from json.decoder import scanstring
+from typing import Any, Iterator, List, Tuple
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CHUNK = 64 * 1024
+CLASSIFY_CHARS = 16 * 1024   # roughly how much of a file peek_object() looks at
+
+# keys whose value is the text itself (flatten_text's priority list)
+PAYLOAD_KEYS = ("text", "he", "en", "content")
+# flatten_events: values seen before a dict's payload key are held back (flatten_text
+# drops them if one turns up); past this many chars they are emitted after all
+HOLD_CHARS = 1024 * 1024
+
+Event = Tuple[str, Any]
+
+_WS = re.compile(r"[ \t\n\r]*")
+_TOKEN = re.compile(r"[^ \t\n\r,:\[\]{}\"]+")
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+
+# what _parse_events accepts next: a value, an object key, the ':' after a key, the ','
+# (or closing bracket) after a container member, or nothing but whitespace
+VALUE, KEY, COLON, COMMA, END = "a value", "a key", "':'", "',' or a closing bracket", "end of input"
+
+
+def _parse_events(f, chunk_size: int = CHUNK) -> Iterator[Event]:
+    buf = ""
+    pos = 0
+    eof = False
+    stack: List[str] = []
+    want = VALUE
+    can_close = False   # right after '{' / '[': the container may be empty
+
+    def fill(grow: bool = False) -> None:
+        # grow: an unfinished token spans the whole buffer, read at least as much again
+        nonlocal buf, pos, eof
+        data = f.read(max(chunk_size, len(buf) - pos) if grow else chunk_size)
+        if not data:
+            eof = True
+        buf = buf[pos:] + data
+        pos = 0
+
+    def unexpected(what: str) -> ValueError:
+        return ValueError(f"expected {want}, got {what}")
+
+    while True:
+        pos = _WS.match(buf, pos).end()
+        if pos >= len(buf):
+            if eof:
+                break
+            fill()
+            continue
+        c = buf[pos]
+        if want is END:
+            raise ValueError(f"extra data after the top-level value: {buf[pos:pos + 20]!r}")
+
+        if c in "{[":
+            if want is not VALUE:
+                raise unexpected(repr(c))
+            stack.append(c)
+            want, can_close = (KEY if c == "{" else VALUE), True
+            pos += 1
+            yield ("start_map" if c == "{" else "start_array"), None
+        elif c in "}]":
+            if not (want is COMMA or can_close) or not stack or stack[-1] != ("{" if c == "}" else "["):
+                raise unexpected(repr(c))
+            stack.pop()
+            want, can_close = (COMMA if stack else END), False
+            pos += 1
+            yield ("end_map" if c == "}" else "end_array"), None
+        elif c == ",":
+            if want is not COMMA:
+                raise unexpected("','")
+            want = KEY if stack[-1] == "{" else VALUE
+            pos += 1
+        elif c == ":":
+            if want is not COLON:
+                raise unexpected("':'")
+            want = VALUE
+            pos += 1
+        elif c == '"':
+            if want is not KEY and want is not VALUE:
+                raise unexpected("a string")
+            try:
+                s, end = scanstring(buf, pos + 1, True)
+            except JSONDecodeError:
+                if eof:
+                    raise
+                fill(grow=True)
+                continue
+            pos = end
+            if want is KEY:
+                want, can_close = COLON, False
+                yield "map_key", s
+            else:
+                want, can_close = (COMMA if stack else END), False
+                yield "string", s
+        else:
+            m = _TOKEN.match(buf, pos)
+            if not m or want is not VALUE:
+                raise unexpected(repr(c))
+            if m.end() == len(buf) and not eof:
+                fill(grow=True)
+                continue
+            tok = m.group()
+            pos = m.end()
+            want, can_close = (COMMA if stack else END), False
+            if tok == "true":
+                yield "boolean", True
+            elif tok == "false":
+                yield "boolean", False
+            elif tok == "null":
+                yield "null", None
+            else:
+                num = _NUMBER.fullmatch(tok)
+                if not num:
+                    raise ValueError(f"invalid JSON literal {tok[:20]!r}")
+                yield "number", (float(tok) if num.group(1) or num.group(2) else int(tok))
+
+    if stack:
+        raise ValueError("truncated JSON")
+    if want is not END:
+        raise ValueError("no JSON value in the file")
+
+
+class _Utf8Replaced:
+    """Bytes reader over a text file opened with errors="replace": what ijson reads."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size: int = -1) -> bytes:
+        return self.f.read(size).encode("utf-8", "surrogatepass")
+
+
+def iter_events(path) -> Iterator[Event]:
+    """
+    basic_parse-style events for the JSON file at path, read incrementally. Both
+    backends behave alike: invalid UTF-8 is replaced (U+FFFD), and malformed or
+    truncated JSON raises ValueError.
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        yield from _events(f)
+
+
+def _events(f, use_ijson: bool = True) -> Iterator[Event]:
+    # f: text stream; use_ijson=False forces the stdlib tokenizer
+    if ijson is not None and use_ijson:
+        try:
+            yield from ijson.basic_parse(_Utf8Replaced(f), use_float=True)
+        except ijson.JSONError as e:
+            raise ValueError(str(e) or type(e).__name__) from e
+    else:
+        yield from _parse_events(f)
+
+
+def peek_object(events: Iterator[Event], max_chars: int = CLASSIFY_CHARS) -> Tuple[Any, List[Event]]:
+    """
+    The value at the start of events, built only until about max_chars of input have
+    been consumed (deeper/later parts are simply missing), plus the consumed events so
+    the caller can replay them: chain(recorded, events) is the full stream again.
+    """
+    recorded: List[Event] = []
+    left = max_chars
+
+    def take() -> Event:
+        nonlocal left
+        ev = next(events)
+        recorded.append(ev)
+        left -= 1 + (len(ev[1]) if isinstance(ev[1], str) else 0)
+        return ev
+
+    def build(ev: str, val: Any) -> Any:
+        if ev == "start_map":
+            d = {}
+            while left > 0:
+                ev, key = take()
+                if ev == "end_map":
+                    break
+                d[key] = build(*take())
+            return d
+        if ev == "start_array":
+            items = []
+            while left > 0:
+                ev, val = take()
+                if ev == "end_array":
+                    break
+                items.append(build(ev, val))
+            return items
+        return val
+
+    return build(*take()), recorded
+
+
+def _skip(ev: str, events: Iterator[Event]) -> None:
+    if ev not in ("start_map", "start_array"):
+        return
+    depth = 1
+    for ev, _ in events:
+        if ev in ("start_map", "start_array"):
+            depth += 1
+        elif ev in ("end_map", "end_array"):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def _value(ev: str, val: Any, events: Iterator[Event]) -> Iterator[str]:
+    if ev == "string":
+        t = val.strip()
+        if t:
+            yield t
+    elif ev in ("number", "boolean"):
+        yield str(val)
+    elif ev == "start_array":
+        for ev, val in events:
+            if ev == "end_array":
+                return
+            yield from _value(ev, val, events)
+    elif ev == "start_map":
+        yield from _map(events)
+
+
+def _map(events: Iterator[Event]) -> Iterator[str]:
+    held: List[str] = []
+    held_chars = 0
+    spilled = False
+    payload = False
+    for ev, key in events:
+        if ev == "end_map":
+            break
+        ev, val = next(events)
+        if payload:
+            # flatten_text only keeps the payload once a dict has one
+            _skip(ev, events)
+        elif key in PAYLOAD_KEYS:
+            payload = True
+            if not spilled:
+                held = []
+            yield from _value(ev, val, events)
+        else:
+            for t in _value(ev, val, events):
+                if spilled:
+                    yield t
+                    continue
+                held.append(t)
+                held_chars += len(t)
+                if held_chars > HOLD_CHARS:
+                    yield from held
+                    held = []
+                    spilled = True
+    if not payload:
+        yield from held
+
+
+def flatten_events(events: Iterator[Event]) -> Iterator[str]:
+    """
+    Paragraph strings in document order, as flatten_text() would return them. One
+    difference: a dict's payload key is the first of PAYLOAD_KEYS in the file rather
+    than the first in PAYLOAD_KEYS order.
+    """
+    for ev, val in events:
+        yield from _value(ev, val, events)
+
+
+def classify_and_flatten(path, looks_like_text_json) -> Tuple[bool, Iterator[str]]:
+    """
+    (is_text, paragraphs) from one read of the file: the classification looks at the
+    first CLASSIFY_CHARS only; the paragraphs iterator continues the same parse.
+    """
+    events = iter_events(path)
+    obj, recorded = peek_object(events)
+    if not looks_like_text_json(obj):
+        events.close()
+        return False, iter(())
+    return True, flatten_events(chain(recorded, events))
+
+
+# ---------- self-test ----------
+
+# each must raise ValueError from either backend
+MALFORMED = (
+    "", "  ", "[", "]", "{", '{"a"', '{"a":', "[1 2]", '{"a" 1}', "[1,]", "[,1]", "{,}", '{"a":1,}',
+    '{"a":}', '{"a":1 "b":2}', "{1:2}", "[1]]", '"a" "b"', '{"a":1}x', "nan", "inf", "-Infinity",
+    "NaN", "01", "-01", "1.", ".5", "1e", "1e+", "+1", "-", "0x10", "tru", "nul", "[true false]",
+)
+
+# text -> events, identical from both backends
+WELL_FORMED = {
+    "[]": [("start_array", None), ("end_array", None)],
+    "{}": [("start_map", None), ("end_map", None)],
+    ' {"a": [1, -0, 2.5, 1e2, -1.5E-3, true, false, null, "x"]} ': [
+        ("start_map", None), ("map_key", "a"), ("start_array", None),
+        ("number", 1), ("number", 0), ("number", 2.5), ("number", 100.0), ("number", -0.0015),
+        ("boolean", True), ("boolean", False), ("null", None), ("string", "x"),
+        ("end_array", None), ("end_map", None),
+    ],
+    '{"t": "a\\u00e9\\n", "n": {"k": []}}': [
+        ("start_map", None), ("map_key", "t"), ("string", "aé\n"), ("map_key", "n"),
+        ("start_map", None), ("map_key", "k"), ("start_array", None), ("end_array", None),
+        ("end_map", None), ("end_map", None),
+    ],
+    "123": [("number", 123)],
+}
+
+
+def self_test() -> int:
+    """Check both backends (ijson only if installed) against MALFORMED / WELL_FORMED."""
+    import io
+
+    backends = [("stdlib", lambda t, n: _parse_events(io.StringIO(t), n))]
+    if ijson is not None:
+        backends.append(("ijson", lambda t, n: _events(io.StringIO(t))))
+    failures = 0
+    for name, parse in backends:
+        for size in (1, 3, CHUNK):
+            for text in MALFORMED:
+                try:
+                    events = list(parse(text, size))
+                except ValueError:
+                    continue
+                failures += 1
+                print(f"FAIL {name} chunk={size}: accepted {text!r} -> {events}")
+            for text, want in WELL_FORMED.items():
+                try:
+                    events = list(parse(text, size))
+                except ValueError as e:
+                    events = e
+                if events != want or any(type(a[1]) is not type(b[1]) for a, b in zip(events, want)):
+                    failures += 1
+                    print(f"FAIL {name} chunk={size}: {text!r} -> {events}")
+    print(f"{'FAILED' if failures else 'OK'}: {', '.join(n for n, _ in backends)}; {failures} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Streaming JSON events (library module; see the docstring).")
+    ap.add_argument("--self-test", action="store_true",
+                    help="Run the malformed / well-formed input checks against each installed backend")
+    args = ap.parse_args()
+    if not args.self_test:
+        ap.error("nothing to do (use --self-test)")
+    raise SystemExit(self_test())
@@ -0,0 +1,727 @@
+#!/usr/bin/env python3
+"""
+Shared manifest.sqlite helpers for the corpus ingest scripts
+(corpus_ingest_txt.py, corpus_ingest_pdf.py).
+
+Change detection:
+  - one query loads (doc_id, size_bytes, mtime_ns) for everything under the scan root
+  - the tree is walked with os.scandir via corpus_walk (no Path objects, one stat per file)
+  - the result is only the new / changed / deleted set; unchanged files cost nothing else
+
+Reconciliation:
+  - docs whose source file is gone lose their chunks/FTS entries in bulk and are
+    tombstoned (status='GONE', norm_hash/norm_path cleared) rather than left to rot
+  - a "new" file whose norm_hash matches a gone doc is a rename: its chunks are
+    re-pointed to the new doc_id instead of being re-chunked and re-indexed
+  - normalized texts live in corpus_docstore (docs.norm_path = "docstore:<doc_id>");
+    the ingest scripts drop the store entries of deleted docs themselves
+
+Content dedup:
+  - docs with the same norm_hash share one chunk set. The first one to be indexed
+    owns the chunks; the others carry docs.dup_of = <owner doc_id> and no chunks.
+  - when the owner changes or disappears, its chunks are handed to one of its
+    duplicates (release_doc) instead of being dropped and re-indexed.
+  - search joins map filtered docs to coalesce(dup_of, doc_id), and copies_of()
+    lists every path that holds a given text.
+
+Chunk quality:
+  - chunk_quality() computes boilerplate, garbage_ratio, char_len and lang once at
+    insert time, so search filters them in SQL (quality_clause) instead of
+    over-fetching and checking every candidate's text in Python.
+  - ensure_schema() adds the columns and recomputes existing rows whenever the
+    BOILERPLATE list or QUALITY_VERSION changes.
+
+Generation:
+  - meta.generation is bumped by every write path that changes what search returns
+    (ingest runs, quality recompute, dedup collapse, work_link.py); result caches
+    such as ask_corpus.py's retrieval cache include it in their key.
+
+Worker pool:
+  - pool_map() is the bounded ProcessPoolExecutor fan-out every ingest / digest /
+    embed script runs its per-file work through.
+
+Bulk load (--bulk in the ingest scripts):
+  - bulk_begin() drops the chunks -> chunks_fts triggers, bulk_finish() rebuilds the
+    external-content index with FTS5 'rebuild' + 'optimize' and restores them.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from corpus_walk import walk
+
+
+STATUS_GONE = "GONE"
+
+# chunk text containing any of these (lowercased) is flagged chunks.boilerplate=1
+BOILERPLATE = (
+  "project gutenberg",
+  "start of the project gutenberg ebook",
+  "transcriber's note",
+  "gutenberg license",
+)
+
+# bump when chunk_quality() changes so ensure_schema() recomputes stored values
+QUALITY_VERSION = 2
+
+# bump when chunk_key() (or how moved chunks are keyed) changes; ensure_schema() re-keys
+CHUNK_KEY_VERSION = 1
+
+# default cut-off for search: chunks with more odd characters than this are OCR noise
+MAX_GARBAGE = 0.25
+
+# characters that count as ordinary text for garbage_ratio (besides letters/digits)
+_PLAIN_PUNCT = set(".,;:!?'\"()[]-–—’‘“”&/")
+
+# a few high-frequency function words per language; enough to label a 1-2k char chunk
+_LANG_WORDS = {
+  "en": set("the and of to in that is it for with as was his he be not by but which".split()),
+  "la": set("et in est non ad cum quod ut sed qui enim per esse quae autem sunt".split()),
+  "de": set("der die und den das ist nicht mit sich des auf für dem ein eine zu".split()),
+  "fr": set("le la les et des est que une dans qui pour pas du sur au ne".split()),
+  "es": set("el la de que y en los del se las por un para con no una".split()),
+  "it": set("il di che la e per non un del della sono le con si da".split()),
+  "nl": set("de het een van en is dat niet op te zijn voor met".split()),
+}
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def doc_id_for(rel_path: str) -> str:
+  return hashlib.sha1(rel_path.encode("utf-8", "ignore")).hexdigest()
+
+
+def chunk_key(doc_id: str, idx: int, start: int, end: int) -> str:
+  """chunks.chunk_id: always derived from the doc_id that currently holds the chunk."""
+  return hashlib.sha1(f"{doc_id}:{idx}:{start}:{end}".encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ScanResult:
+  # (doc_id, rel_path, abs_path, size_bytes, mtime_ns) per file that needs ingest
+  new: List[Tuple[str, str, str, int, int]] = field(default_factory=list)
+  changed: List[Tuple[str, str, str, int, int]] = field(default_factory=list)
+  # doc_ids known to manifest.sqlite under the scan root whose file is gone
+  deleted: List[str] = field(default_factory=list)
+  unchanged: int = 0
+  seen: int = 0
+
+  @property
+  def todo(self):
+    return self.new + self.changed
+
+
+def scan_files(root: Path, suffix: str) -> Iterator[Tuple[str, int, int]]:
+  """Yield (path, size, mtime_ns) for files under root whose name ends with suffix."""
+  for e in walk(root, lambda name: name.endswith(suffix)):
+    try:
+      st = e.stat()
+    except OSError:
+      continue
+    yield e.path, st.st_size, st.st_mtime_ns
+
+
+def rel_prefix(scan_root: Path, src_root: Path) -> Optional[str]:
+  """rel_path prefix covered by scan_root ('' for src_root itself), or None if outside src_root."""
+  try:
+    rel = scan_root.relative_to(src_root).as_posix()
+  except ValueError:
+    return None
+  return "" if rel == "." else rel + "/"
+
+
+def load_known_docs(con, ext: str, prefix: str = "") -> Dict[str, Tuple[int, int]]:
+  """doc_id -> (size_bytes, mtime_ns) for docs of this ext whose rel_path starts with prefix."""
+  sql = "SELECT doc_id, size_bytes, mtime_ns FROM docs WHERE ext=? AND norm_hash IS NOT NULL"
+  params = [ext]
+  if prefix:
+    # range scan on idx_docs_rel_path instead of LIKE
+    sql += " AND rel_path >= ? AND rel_path < ?"
+    params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+  return {doc_id: (size, mtime) for doc_id, size, mtime in con.execute(sql, params)}
+
+
+def existing_norm_ids(norm_dir: Path) -> Set[str]:
+  """
+  doc_ids that still have a normalized file (<doc_id>.txt or .txt.gz) from before
+  corpus_docstore, in one directory listing rather than one stat per doc.
+  """
+  try:
+    names = os.listdir(norm_dir)
+  except FileNotFoundError:
+    return set()
+  ids = set()
+  for n in names:
+    if n.endswith(".txt"):
+      ids.add(n[:-4])
+    elif n.endswith(".txt.gz"):
+      ids.add(n[:-7])
+  return ids
+
+
+def scan_changes(
+  con,
+  scan_root: Path,
+  src_root: Path,
+  suffix: str,
+  ext: str,
+  norm_dir: Path,
+  skip: Optional[Callable[[str], bool]] = None,
+  force: bool = False,
+  stored: Iterable[str] = (),
+) -> ScanResult:
+  """
+  Compare the tree under scan_root against manifest.sqlite.
+
+  A doc counts as unchanged only if its normalized text still exists: a file in
+  norm_dir or one of the doc_ids in stored (corpus_docstore.DocStore.doc_ids()).
+
+  rel_path is relative to src_root; if scan_root lies outside src_root it falls back
+  to scan_root and deletion tracking is disabled (we can't tell which rows are ours).
+  force=True reports every known file as changed (re-chunk everything).
+  """
+  prefix = rel_prefix(scan_root, src_root)
+  base = src_root if prefix is not None else scan_root
+  known = load_known_docs(con, ext, prefix or "") if prefix is not None else {}
+  have_norm = existing_norm_ids(norm_dir)
+  have_norm.update(stored)
+
+  base_s = str(base).rstrip("/") + "/"
+  res = ScanResult()
+  seen_ids = set()
+
+  for path, size, mtime_ns in scan_files(scan_root, suffix):
+    rel = path[len(base_s):] if path.startswith(base_s) else os.path.relpath(path, base)
+    if skip and skip(rel):
+      continue
+
+    res.seen += 1
+    doc_id = doc_id_for(rel)
+    seen_ids.add(doc_id)
+
+    prev = known.get(doc_id)
+    if not force and prev == (size, mtime_ns) and doc_id in have_norm:
+      res.unchanged += 1
+      continue
+
+    item = (doc_id, rel, os.path.realpath(path), size, mtime_ns)
+    if prev is None:
+      res.new.append(item)
+    else:
+      res.changed.append(item)
+
+  if prefix is not None:
+    res.deleted = [d for d in known if d not in seen_ids]
+  return res
+
+
+# ---------- worker pool ----------
+
+def pool_map(fn, tasks: Iterable, workers: int,
+             initializer: Optional[Callable] = None, initargs: tuple = ()) -> Iterator:
+  """
+  fn over tasks in a process pool, results in completion order.
+
+  Bounded fan-out: at most workers*4 tasks are in flight, so tasks can be a lazy
+  scan or a paged query instead of a materialized list. Closing the generator
+  early (an exception in the consumer) cancels whatever hasn't started yet.
+  """
+  with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as ex:
+    pending = set()
+    try:
+      for t in tasks:
+        pending.add(ex.submit(fn, t))
+        if len(pending) >= workers * 4:
+          finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+          for fut in finished:
+            yield fut.result()
+      while pending:
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in finished:
+          yield fut.result()
+    finally:
+      for fut in pending:
+        fut.cancel()
+
+
+# ---------- schema / writes ----------
+
+def fts_is_external(con) -> bool:
+  """True when chunks_fts is an external-content index over chunks (corpus_db_init.py layout)."""
+  row = con.execute("SELECT sql FROM sqlite_master WHERE name='chunks_fts'").fetchone()
+  return bool(row) and re.search(r"\bcontent\s*=", row[0]) is not None
+
+
+def ensure_schema(con) -> None:
+  """Idempotent upgrades for manifest.sqlite files created by older corpus_db_init.py."""
+  if not fts_is_external(con):
+    raise SystemExit(
+      "manifest.sqlite still has the old self-contained chunks_fts; "
+      "run corpus_db_init.py --migrate-fts first."
+    )
+
+  con.execute("CREATE INDEX IF NOT EXISTS idx_docs_norm_hash ON docs(norm_hash)")
+  con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+  cols = {r[1] for r in con.execute("PRAGMA table_info(docs)")}
+  if "dup_of" not in cols:
+    con.execute("ALTER TABLE docs ADD COLUMN dup_of TEXT")
+    # first run with dedup: fold identical texts that were indexed separately
+    n_docs, n_chunks = collapse_duplicates(con)
+    if n_docs:
+      print(f"Dedup: {n_docs:,} docs now share an identical doc's chunks ({n_chunks:,} chunks dropped)")
+      bump_generation(con)
+  con.execute("CREATE INDEX IF NOT EXISTS idx_docs_dup_of ON docs(dup_of)")
+
+  cols = {r[1] for r in con.execute("PRAGMA table_info(chunks)")}
+  for col, decl in (("boilerplate", "INTEGER NOT NULL DEFAULT 0"),
+                    ("garbage_ratio", "REAL NOT NULL DEFAULT 0"),
+                    ("char_len", "INTEGER NOT NULL DEFAULT 0"),
+                    ("lang", "TEXT NOT NULL DEFAULT ''")):
+    if col not in cols:
+      con.execute(f"ALTER TABLE chunks ADD COLUMN {col} {decl}")
+  con.execute("CREATE INDEX IF NOT EXISTS idx_chunks_quality ON chunks(boilerplate, lang, garbage_ratio)")
+
+  if get_meta(con, "chunk_key_version") != str(CHUNK_KEY_VERSION):
+    # chunks moved by renames / dedup hand-overs used to keep the previous doc's ids,
+    # which then collided with that doc's next chunk set: re-key them once
+    n = rekey_chunks(con)
+    set_meta(con, "chunk_key_version", CHUNK_KEY_VERSION)
+    if n:
+      print(f"Chunk ids: re-keyed {n:,} chunks moved from another doc")
+      bump_generation(con)
+
+  sig = hashlib.sha1("\n".join((str(QUALITY_VERSION),) + BOILERPLATE).encode("utf-8")).hexdigest()[:16]
+  if get_meta(con, "quality_sig") != sig:
+    # new columns, migrated table or changed rules: recompute every chunk once
+    t0 = time.time()
+    con.create_function("is_boilerplate", 1, is_boilerplate, deterministic=True)
+    con.create_function("garbage_ratio", 1, garbage_ratio, deterministic=True)
+    con.create_function("detect_lang", 1, detect_lang, deterministic=True)
+    con.execute("""
+      UPDATE chunks SET boilerplate = is_boilerplate(text), garbage_ratio = garbage_ratio(text),
+                        char_len = length(text), lang = detect_lang(text)
+    """)
+    set_meta(con, "quality_sig", sig)
+    bump_generation(con)
+    nb, ng = con.execute(
+      "SELECT coalesce(sum(boilerplate), 0), coalesce(sum(garbage_ratio > ?), 0) FROM chunks", (MAX_GARBAGE,)
+    ).fetchone()
+    print(f"Chunk quality: {nb:,} boilerplate, {ng:,} over garbage {MAX_GARBAGE} ({time.time() - t0:,.1f}s)")
+  con.commit()
+
+  if get_meta(con, "fts_dirty") == "1":
+    # a --bulk run died before its rebuild: triggers are missing and the index is stale
+    print("NOTE: previous bulk load did not finish; rebuilding chunks_fts ...")
+    bulk_finish(con)
+
+
+def get_meta(con, key: str, default: Optional[str] = None) -> Optional[str]:
+  row = con.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+  return row[0] if row else default
+
+
+def set_meta(con, key: str, value) -> None:
+  con.execute(
+    "INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+    (key, str(value))
+  )
+
+
+def bump_generation(con) -> int:
+  """
+  Advance meta.generation. Call (in the same transaction) whenever docs/chunks change
+  in a way searches can see; readers key cached results on it (db_generation).
+  """
+  con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+  gen = int(get_meta(con, "generation", "0")) + 1
+  set_meta(con, "generation", gen)
+  return gen
+
+
+def db_generation(con) -> int:
+  try:
+    return int(get_meta(con, "generation", "0"))
+  except sqlite3.OperationalError:
+    # read-only handle on a DB that predates the meta table
+    return 0
+
+
+def bulk_begin(con) -> None:
+  """
+  Bulk-load mode: drop the FTS sync triggers so chunk inserts/deletes don't touch
+  chunks_fts row by row. The index is marked dirty until bulk_finish() rebuilds it,
+  so a crashed run is repaired by the next ensure_schema().
+  """
+  import corpus_db_init
+
+  set_meta(con, "fts_dirty", "1")
+  for trig in corpus_db_init.FTS_TRIGGERS:
+    con.execute(f"DROP TRIGGER IF EXISTS {trig}")
+  con.commit()
+  con.execute("PRAGMA cache_size=-1048576")  # ~1 GiB page cache for the big transactions
+
+
+def bulk_finish(con) -> None:
+  """Rebuild chunks_fts from chunks in one pass, optimize it, and re-create the triggers."""
+  import corpus_db_init
+
+  con.commit()
+  t0 = time.time()
+  con.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+  con.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('optimize')")
+  con.executescript("BEGIN;\n" + corpus_db_init.FTS_TRIGGERS_SQL + "COMMIT;\n")
+  set_meta(con, "fts_dirty", "0")
+  con.commit()
+  print(f"chunks_fts rebuilt + optimized in {time.time() - t0:,.1f}s")
+
+
+def upsert_doc(con, doc):
+  con.execute("""
+    INSERT INTO docs(doc_id, rel_path, abs_path, ext, size_bytes, mtime_ns, norm_hash, norm_path, updated_at)
+    VALUES(?,?,?,?,?,?,?,?,datetime('now'))
+    ON CONFLICT(doc_id) DO UPDATE SET
+      rel_path=excluded.rel_path,
+      abs_path=excluded.abs_path,
+      ext=excluded.ext,
+      size_bytes=excluded.size_bytes,
+      mtime_ns=excluded.mtime_ns,
+      norm_hash=excluded.norm_hash,
+      norm_path=excluded.norm_path,
+      status=CASE WHEN docs.status='GONE' THEN NULL ELSE docs.status END,
+      updated_at=datetime('now')
+  """, doc)
+
+
+def delete_chunks_for_doc(con, doc_id: str):
+  con.execute("DELETE FROM chunks WHERE doc_id=?", (doc_id,))
+
+
+def is_boilerplate(text: Optional[str]) -> int:
+  if not text:
+    return 0
+  low = text.lower()
+  return int(any(b in low for b in BOILERPLATE))
+
+
+def garbage_ratio(text: Optional[str]) -> float:
+  """
+  Share of non-space characters that are neither alphanumeric nor plain punctuation.
+  Combining marks (Hebrew points and cantillation, decomposed Greek accents) belong
+  to the letter before them and are not counted at all.
+  """
+  n = bad = 0
+  for ch in unicodedata.normalize("NFC", text or ""):
+    if ch.isspace() or unicodedata.category(ch).startswith("M"):
+      continue
+    n += 1
+    if not ch.isalnum() and ch not in _PLAIN_PUNCT:
+      bad += 1
+  return round(bad / n, 3) if n else 0.0
+
+
+def detect_lang(text: Optional[str], max_words: int = 400) -> str:
+  """Best-guess language code from function-word counts; '' when nothing stands out."""
+  words = _WORD_RE.findall((text or "").lower())[:max_words]
+  if not words:
+    return ""
+  best, best_n = "", 0
+  for lang, vocab in _LANG_WORDS.items():
+    n = sum(1 for w in words if w in vocab)
+    if n > best_n:
+      best, best_n = lang, n
+  if best_n < 3 or best_n < 0.05 * len(words):
+    return ""
+  return best
+
+
+def chunk_quality(text: Optional[str]) -> Tuple[int, float, int, str]:
+  """(boilerplate, garbage_ratio, char_len, lang) as stored on chunks."""
+  return is_boilerplate(text), garbage_ratio(text), len(text or ""), detect_lang(text)
+
+
+def quality_clause(alias: str = "c", skip_boilerplate: bool = True,
+                   max_garbage: Optional[float] = MAX_GARBAGE, min_chars: int = 0,
+                   lang: str = "") -> Tuple[str, list]:
+  """SQL fragment (starting with AND, or empty) + params filtering chunks on the quality columns."""
+  where, params = [], []
+  if skip_boilerplate:
+    where.append(f"{alias}.boilerplate = 0")
+  if max_garbage is not None:
+    where.append(f"{alias}.garbage_ratio <= ?")
+    params.append(max_garbage)
+  if min_chars:
+    where.append(f"{alias}.char_len >= ?")
+    params.append(min_chars)
+  if lang:
+    where.append(f"{alias}.lang = ?")
+    params.append(lang.lower())
+  return "".join(f" AND {w}" for w in where), params
+
+
+def insert_chunks(con, doc_id: str, chunks):
+  rows = []
+  for idx, (ct, s, e) in enumerate(chunks):
+    rows.append((chunk_key(doc_id, idx, s, e), doc_id, idx, s, e, ct, *chunk_quality(ct)))
+  con.executemany(
+    "INSERT INTO chunks(chunk_id, doc_id, chunk_idx, start_char, end_char, text, "
+    "boilerplate, garbage_ratio, char_len, lang) VALUES(?,?,?,?,?,?,?,?,?,?)",
+    rows
+  )
+
+
+# ---------- reconciliation ----------
+
+def _temp_ids(con, doc_ids: Iterable[str]) -> None:
+  con.execute("CREATE TEMP TABLE IF NOT EXISTS _ids(doc_id TEXT PRIMARY KEY)")
+  con.execute("DELETE FROM temp._ids")
+  con.executemany("INSERT OR IGNORE INTO temp._ids(doc_id) VALUES(?)", ((d,) for d in doc_ids))
+
+
+def gone_hashes(con, doc_ids: Iterable[str]) -> Dict[str, str]:
+  """norm_hash -> doc_id for deleted docs, i.e. the rename candidates."""
+  _temp_ids(con, doc_ids)
+  return {
+    nh: doc_id
+    for doc_id, nh in con.execute(
+      "SELECT doc_id, norm_hash FROM docs WHERE doc_id IN (SELECT doc_id FROM temp._ids) AND norm_hash IS NOT NULL"
+    )
+  }
+
+
+def _drop_norm_file(norm_path: Optional[str]) -> None:
+  # docstore:<doc_id> texts are not files; the ingest scripts delete them from the store
+  if norm_path and not norm_path.startswith("docstore:"):
+    try:
+      os.unlink(norm_path)
+    except OSError:
+      pass
+
+
+def _move_chunks(con, old_id: str, new_id: str) -> int:
+  # chunk_id is re-keyed to the new owner: old_id may be re-chunked later and must be
+  # free to reuse its own ids. chunks_fts reads chunk_id/doc_id from chunks (external
+  # content, both UNINDEXED): nothing to re-index.
+  rows = con.execute(
+    "SELECT id, chunk_idx, start_char, end_char FROM chunks WHERE doc_id=?", (old_id,)
+  ).fetchall()
+  con.executemany(
+    "UPDATE chunks SET doc_id=?, chunk_id=? WHERE id=?",
+    [(new_id, chunk_key(new_id, idx, s, e), rid) for rid, idx, s, e in rows]
+  )
+  return len(rows)
+
+
+def rekey_chunks(con) -> int:
+  """Give every chunk whose chunk_id doesn't match chunk_key() of its doc the right one."""
+  con.create_function("chunk_key", 4, chunk_key, deterministic=True)
+  where = "chunk_id <> chunk_key(doc_id, chunk_idx, start_char, end_char)"
+  # two steps: a stale id can be exactly the id another stale row is about to get
+  n = con.execute(f"UPDATE chunks SET chunk_id = 'rekey:' || id WHERE {where}").rowcount
+  if n:
+    con.execute("UPDATE chunks SET chunk_id = chunk_key(doc_id, chunk_idx, start_char, end_char) "
+                "WHERE chunk_id LIKE 'rekey:%'")
+  return n
+
+
+def canonical_for(con, norm_hash: str, doc_id: str) -> Optional[str]:
+  """doc_id that owns the chunk set for this text, other than doc_id itself."""
+  row = con.execute(
+    "SELECT doc_id FROM docs WHERE norm_hash=? AND dup_of IS NULL AND doc_id<>? "
+    "AND coalesce(status,'')<>? ORDER BY rel_path LIMIT 1",
+    (norm_hash, doc_id, STATUS_GONE)
+  ).fetchone()
+  return row[0] if row else None
+
+
+def copies_of(con, doc_id: str) -> List[str]:
+  """rel_paths of the duplicates sharing doc_id's chunk set."""
+  return [r[0] for r in con.execute(
+    "SELECT rel_path FROM docs WHERE dup_of=? ORDER BY rel_path", (doc_id,)
+  )]
+
+
+def release_doc(con, doc_id: str) -> Optional[str]:
+  """
+  Detach doc_id from its chunk set: if other docs are duplicates of it, the first one
+  inherits the chunks (and the remaining duplicates follow it); otherwise the chunks
+  are deleted. Returns the heir's doc_id, if any.
+  """
+  heir = con.execute(
+    "SELECT doc_id FROM docs WHERE dup_of=? ORDER BY rel_path LIMIT 1", (doc_id,)
+  ).fetchone()
+  if not heir:
+    delete_chunks_for_doc(con, doc_id)
+    return None
+
+  heir = heir[0]
+  _move_chunks(con, doc_id, heir)
+  con.execute("UPDATE docs SET dup_of=NULL WHERE doc_id=?", (heir,))
+  con.execute("UPDATE docs SET dup_of=? WHERE dup_of=?", (heir, doc_id))
+  return heir
+
+
+@contextmanager
+def savepoint(con, name: str = "doc"):
+  """
+  All-or-nothing for one doc's writes inside the caller's batch transaction: on an
+  exception everything since the savepoint is rolled back (the batch itself survives)
+  and the exception propagates.
+  """
+  if not con.in_transaction:
+    # otherwise the savepoint would be the outermost transaction and RELEASE would commit
+    con.execute("BEGIN")
+  con.execute(f"SAVEPOINT {name}")
+  try:
+    yield
+  except BaseException:
+    con.execute(f"ROLLBACK TO {name}")
+    con.execute(f"RELEASE {name}")
+    raise
+  con.execute(f"RELEASE {name}")
+
+
+def store_doc(con, doc, chunks, rechunk: bool = False) -> int:
+  """
+  Write one ingested doc (upsert_doc tuple) and its chunks, sharing chunk sets by norm_hash.
+  Returns the number of chunks inserted (0 for a duplicate or unchanged text).
+  rechunk=True replaces the chunks even when the text is unchanged (--force).
+  On failure nothing of it is left in the transaction, so the doc is retried next run.
+  """
+  with savepoint(con):
+    return _store_doc(con, doc, chunks, rechunk)
+
+
+def _store_doc(con, doc, chunks, rechunk: bool) -> int:
+  doc_id, nh = doc[0], doc[6]
+  prev = con.execute("SELECT norm_hash, dup_of FROM docs WHERE doc_id=?", (doc_id,)).fetchone()
+
+  if prev and prev[0] == nh and prev[1] is None:
+    # touched but same text, and we already own its chunk set
+    has = con.execute("SELECT 1 FROM chunks WHERE doc_id=? LIMIT 1", (doc_id,)).fetchone()
+    if has:
+      upsert_doc(con, doc)
+      if not rechunk:
+        return 0
+      # forced re-chunk: replace our chunks in place, duplicates keep pointing at us
+      delete_chunks_for_doc(con, doc_id)
+      insert_chunks(con, doc_id, chunks)
+      return len(chunks)
+
+  if prev and prev[1] is None:
+    release_doc(con, doc_id)
+  upsert_doc(con, doc)
+
+  canon = canonical_for(con, nh, doc_id)
+  con.execute("UPDATE docs SET dup_of=? WHERE doc_id=?", (canon, doc_id))
+  if canon:
+    return 0
+
+  insert_chunks(con, doc_id, chunks)
+  return len(chunks)
+
+
+def repoint_doc(con, old_id: str, doc) -> int:
+  """
+  Rename: write the new docs row, hand the old doc's chunks to it, tombstone the old row.
+  Returns the number of chunks moved. All or nothing, like store_doc().
+  """
+  with savepoint(con):
+    return _repoint_doc(con, old_id, doc)
+
+
+def _repoint_doc(con, old_id: str, doc) -> int:
+  new_id = doc[0]
+  row = con.execute("SELECT norm_path, dup_of FROM docs WHERE doc_id=?", (old_id,)).fetchone()
+  prev = con.execute("SELECT dup_of FROM docs WHERE doc_id=?", (new_id,)).fetchone()
+  if prev and prev[0] is None:
+    release_doc(con, new_id)
+  upsert_doc(con, doc)
+
+  n = 0
+  if row and row[1]:
+    # the old path was itself a duplicate: so is the new one
+    con.execute("UPDATE docs SET dup_of=? WHERE doc_id=?", (row[1], new_id))
+  else:
+    con.execute("UPDATE docs SET dup_of=NULL WHERE doc_id=?", (new_id,))
+    n = _move_chunks(con, old_id, new_id)
+    con.execute("UPDATE docs SET dup_of=? WHERE dup_of=?", (new_id, old_id))
+  con.execute(
+    "UPDATE docs SET status=?, norm_hash=NULL, norm_path=NULL, dup_of=NULL, updated_at=datetime('now') WHERE doc_id=?",
+    (STATUS_GONE, old_id)
+  )
+  if row and row[0] != doc[7]:
+    _drop_norm_file(row[0])
+  return n
+
+
+def _bulk_delete_chunks(con) -> int:
+  """Delete chunks (and, via chunks_ad, their FTS entries) for every doc_id in temp._ids."""
+  return con.execute("DELETE FROM chunks WHERE doc_id IN (SELECT doc_id FROM temp._ids)").rowcount
+
+
+def collapse_duplicates(con) -> Tuple[int, int]:
+  """
+  One-off dedup of docs indexed before dup_of existed: per norm_hash the first doc
+  (by rel_path) keeps its chunks, the rest become duplicates of it.
+  Returns (docs collapsed, chunks deleted).
+  """
+  losers = []
+  for nh, ids in con.execute("""
+    SELECT norm_hash, group_concat(doc_id, ' ') FROM (
+      SELECT norm_hash, doc_id FROM docs
+      WHERE norm_hash IS NOT NULL AND dup_of IS NULL AND coalesce(status,'')<>?
+      ORDER BY norm_hash, rel_path
+    ) GROUP BY norm_hash HAVING count(*) > 1
+  """, (STATUS_GONE,)).fetchall():
+    owner, *rest = ids.split(" ")
+    losers += [(owner, d) for d in rest]
+  if not losers:
+    return 0, 0
+
+  con.executemany("UPDATE docs SET dup_of=? WHERE doc_id=?", losers)
+  _temp_ids(con, (d for _, d in losers))
+  return len(losers), _bulk_delete_chunks(con)
+
+
+def tombstone_docs(con, doc_ids: Iterable[str]) -> Tuple[int, int]:
+  """
+  Bulk-remove chunks + FTS rows for docs whose source is gone and tombstone the docs rows.
+  Returns (docs tombstoned, chunks deleted).
+  """
+  _temp_ids(con, doc_ids)
+  n_docs = con.execute("SELECT count(*) FROM temp._ids").fetchone()[0]
+  if not n_docs:
+    return 0, 0
+
+  # Owners with a surviving duplicate hand their chunks over instead of losing them.
+  con.execute("UPDATE docs SET dup_of=NULL WHERE doc_id IN (SELECT doc_id FROM temp._ids) AND dup_of IS NOT NULL")
+  owners = [r[0] for r in con.execute("""
+    SELECT DISTINCT d.dup_of FROM docs d
+    WHERE d.dup_of IN (SELECT doc_id FROM temp._ids)
+      AND d.doc_id NOT IN (SELECT doc_id FROM temp._ids)
+  """)]
+  for owner in owners:
+    release_doc(con, owner)
+
+  n_chunks = _bulk_delete_chunks(con)
+
+  norm_paths = [r[0] for r in con.execute(
+    "SELECT norm_path FROM docs WHERE doc_id IN (SELECT doc_id FROM temp._ids)"
+  )]
+  con.execute(
+    "UPDATE docs SET status=?, norm_hash=NULL, norm_path=NULL, dup_of=NULL, updated_at=datetime('now') "
+    "WHERE doc_id IN (SELECT doc_id FROM temp._ids)",
+    (STATUS_GONE,)
+  )
+  for np_ in norm_paths:
+    _drop_norm_file(np_)
+  return n_docs, n_chunks
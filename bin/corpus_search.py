@@ -1,160 +1,165 @@
 #!/usr/bin/env python3
 import argparse
-import re
 import sqlite3
 from pathlib import Path
 
+from corpus_manifest import MAX_GARBAGE, quality_clause
+
 DB = Path("/ai_data/ai_corpus/manifest.sqlite")
+SEARCHD_URL = "http://127.0.0.1:8790"
 
-BOILERPLATE = (
-  "project gutenberg",
-  "start of the project gutenberg ebook",
-  "transcriber's note",
-  "gutenberg license",
-)
-
-def pick_focus_term(query: str) -> str:
-  q = query.replace('"', " ").replace("'", " ")
-  tokens = re.split(r"\s+", q.strip())
-  for t in tokens:
-    up = t.upper()
-    if up in ("AND", "OR", "NOT"):
-      continue
-    t = re.sub(r"[^0-9A-Za-z_-]", "", t)
-    if len(t) >= 3:
-      return t
-  return ""
-
-def extract_window(text: str, term: str, width: int = 220) -> str:
-  if not text:
-    return ""
-  clean = " ".join(text.split())
-  if not term:
-    return clean[: (2 * width)] + ("…" if len(clean) > 2 * width else "")
-  m = re.search(re.escape(term), clean, flags=re.IGNORECASE)
-  if not m:
-    return clean[: (2 * width)] + ("…" if len(clean) > 2 * width else "")
-
-  start = max(0, m.start() - width)
-  end = min(len(clean), m.end() + width)
-  left_ellipsis = "…" if start > 0 else ""
-  right_ellipsis = "…" if end < len(clean) else ""
-  window = clean[start:end]
-
-  window = re.sub(
-    re.escape(term),
-    lambda mm: f"[[{mm.group(0)}]]",
-    window,
-    flags=re.IGNORECASE,
-  )
-  return f"{left_ellipsis}{window}{right_ellipsis}"
+# FTS5 snippet() takes a token count (max 64); --window is in chars per side
+SNIPPET_MAX_TOKENS = 64
+CHARS_PER_TOKEN = 6
 
-def main():
-  ap = argparse.ArgumentParser(
-    description="Search the AI corpus (SQLite FTS) and print top matching chunks."
-  )
-  ap.add_argument("query", nargs="+", help='FTS query (quotes for phrases; AND/OR/NOT supported).')
-  ap.add_argument("--limit", type=int, default=10, help="Number of results to show (default: 10).")
-  ap.add_argument("--ext", default="", help="Restrict to a file extension, e.g. pdf or txt.")
-  ap.add_argument("--like", default="", help="Restrict to docs whose rel_path contains this substring (case-insensitive).")
-  ap.add_argument("--path-eq", default="", help="Restrict to an exact rel_path match (single file).")
-  ap.add_argument("--work-id", default="", help="Restrict to a linked work_id (multi-volume sets).")
-  ap.add_argument("--work-like", default="", help="Restrict to work_title containing this substring (case-insensitive).")
-  ap.add_argument("--window", type=int, default=220, help="Context window size (chars on each side of match). Default 220.")
-  ap.add_argument("--no-boilerplate-skip", action="store_true", help="Do not skip common boilerplate chunks.")
-  args = ap.parse_args()
-
-  q = " ".join(args.query).strip()
-  if not q:
-    ap.error("query is required")
+# chunks columns added by ensure_schema() (corpus_db_init.py)
+QUALITY_COLUMNS = ("boilerplate", "garbage_ratio", "char_len", "lang")
 
-  focus = pick_focus_term(q)
-  con = sqlite3.connect(str(DB))
+def snippet_tokens(window: int) -> int:
+  return max(8, min(SNIPPET_MAX_TOKENS, (2 * window) // CHARS_PER_TOKEN))
 
+def search(con, q, limit=10, ext="", like="", path_eq="", work_id="", work_like="", window=220,
+           skip_boilerplate=True, max_garbage=MAX_GARBAGE, min_chars=0, lang=""):
+  """Top `limit` hits for FTS query `q` as dicts (also served by corpus_searchd.py)."""
   where_meta = []
   params_meta = []
 
-  if args.ext:
+  if ext:
     where_meta.append("ext = ?")
-    params_meta.append(args.ext.lower())
+    params_meta.append(ext.lower())
 
-  if args.like:
+  if like:
     where_meta.append("lower(rel_path) like ?")
-    params_meta.append(f"%{args.like.lower()}%")
+    params_meta.append(f"%{like.lower()}%")
 
-  if args.path_eq:
+  if path_eq:
     where_meta.append("rel_path = ?")
-    params_meta.append(args.path_eq)
+    params_meta.append(path_eq)
 
-  if args.work_id:
+  if work_id:
     where_meta.append("work_id = ?")
-    params_meta.append(args.work_id)
+    params_meta.append(work_id)
 
-  if args.work_like:
+  if work_like:
     where_meta.append("lower(work_title) like ?")
-    params_meta.append(f"%{args.work_like.lower()}%")
-
-  meta_clause = ("WHERE " + " AND ".join(where_meta)) if where_meta else ""
-  fetch_n = max(args.limit * 8, args.limit)
+    params_meta.append(f"%{work_like.lower()}%")
+
+  meta_clause = ""
+  if where_meta:
+    # a filter hit on a duplicate counts for the doc that holds the shared chunks
+    meta_clause = (
+      "AND c.doc_id IN (SELECT coalesce(dup_of, doc_id) FROM docs WHERE "
+      + " AND ".join(where_meta) + ")"
+    )
+  quality_sql, quality_params = quality_clause(
+    "c", skip_boilerplate=skip_boilerplate,
+    max_garbage=max_garbage, min_chars=min_chars, lang=lang,
+  )
 
+  # One statement: ranking, doc metadata, the highlighted snippet and the paths of
+  # identical copies all come back per hit; no per-row follow-up queries.
   sql = f"""
     SELECT
       bm25(chunks_fts) AS score,
-      chunks_fts.chunk_id,
-      chunks_fts.doc_id
+      c.chunk_id, c.doc_id,
+      d.rel_path, d.ext, d.work_title, d.work_id, d.vol_idx, d.vol_total,
+      snippet(chunks_fts, 2, '[[', ']]', '…', ?) AS snip,
+      (SELECT group_concat(x.rel_path, char(10)) FROM docs x WHERE x.dup_of = c.doc_id) AS copies
     FROM chunks_fts
-    JOIN (
-      SELECT doc_id
-      FROM docs
-      {meta_clause}
-    ) d ON d.doc_id = chunks_fts.doc_id
+    JOIN chunks c ON c.id = chunks_fts.rowid
+    JOIN docs d ON d.doc_id = c.doc_id
     WHERE chunks_fts MATCH ?
+      {quality_sql}
+      {meta_clause}
     ORDER BY score
     LIMIT ?
   """
 
-  rows = con.execute(sql, (*params_meta, q, fetch_n)).fetchall()
-  if not rows:
+  try:
+    rows = con.execute(sql, (snippet_tokens(window), q, *quality_params, *params_meta, limit)).fetchall()
+  except sqlite3.OperationalError as e:
+    # "no such column: c.garbage_ratio" -> garbage_ratio
+    missing = str(e).partition("no such column:")[2].strip().rpartition(".")[2]
+    if missing in QUALITY_COLUMNS:
+      raise sqlite3.OperationalError(
+        f"manifest.sqlite predates the chunk quality columns ({e}); run corpus_db_init.py first."
+      )
+    raise
+
+  out = []
+  for score, chunk_id, doc_id, rel, ext_, title, wid, vol_idx, vol_total, snip, copies in rows:
+    out.append({
+      "score": score, "chunk_id": chunk_id, "doc_id": doc_id,
+      "rel_path": rel, "ext": ext_,
+      "work_title": title, "work_id": wid, "vol_idx": vol_idx, "vol_total": vol_total,
+      "snippet": " ".join((snip or "").split()),
+      "copies": sorted(copies.split("\n")) if copies else [],
+    })
+  return out
+
+def print_results(hits):
+  if not hits:
     print("No results.")
-    con.close()
     return
 
-  printed = 0
-  for score, chunk_id, doc_id in rows:
-    meta = con.execute(
-      "SELECT rel_path, ext, work_title, work_id, vol_idx, vol_total FROM docs WHERE doc_id=?",
-      (doc_id,)
-    ).fetchone()
-    if meta:
-      rel, ext, work_title, work_id, vol_idx, vol_total = meta
-    else:
-      rel, ext, work_title, work_id, vol_idx, vol_total = ("?", "?", None, None, None, None)
-
-    text_row = con.execute("SELECT text FROM chunks WHERE chunk_id=?", (chunk_id,)).fetchone()
-    full_text = text_row[0] if text_row else ""
+  for h in hits:
+    extra = ""
+    if h["work_id"] and h["work_title"]:
+      v = ""
+      if h["vol_idx"] is not None:
+        v = f" vol={h['vol_idx']}" + (f"/{h['vol_total']}" if h["vol_total"] else "")
+      extra = f"  work='{h['work_title']}' work_id={h['work_id'][:12]}…{v}"
 
-    if (not args.no_boilerplate_skip) and full_text:
-      low = full_text.lower()
-      if any(b in low for b in BOILERPLATE):
-        continue
+    print(f"\n[{h['rel_path']}] ({h['ext']})  chunk={h['chunk_id']}{extra}")
+    for other in h["copies"]:
+      print(f"  also: {other}")
+    print(h["snippet"])
 
-    snip = extract_window(full_text, focus, width=args.window)
+def main():
+  ap = argparse.ArgumentParser(
+    description="Search the AI corpus (SQLite FTS) and print top matching chunks."
+  )
+  ap.add_argument("query", nargs="+", help='FTS query (quotes for phrases; AND/OR/NOT supported).')
+  ap.add_argument("--limit", type=int, default=10, help="Number of results to show (default: 10).")
+  ap.add_argument("--ext", default="", help="Restrict to a file extension, e.g. pdf or txt.")
+  ap.add_argument("--like", default="", help="Restrict to docs whose rel_path contains this substring (case-insensitive).")
+  ap.add_argument("--path-eq", default="", help="Restrict to an exact rel_path match (single file).")
+  ap.add_argument("--work-id", default="", help="Restrict to a linked work_id (multi-volume sets).")
+  ap.add_argument("--work-like", default="", help="Restrict to work_title containing this substring (case-insensitive).")
+  ap.add_argument("--window", type=int, default=220, help="Snippet size, roughly chars on each side of the match. Default 220.")
+  ap.add_argument("--no-boilerplate-skip", action="store_true", help="Do not skip common boilerplate chunks.")
+  ap.add_argument("--max-garbage", type=float, default=MAX_GARBAGE,
+                  help=f"Skip chunks whose OCR-garbage ratio exceeds this (default {MAX_GARBAGE}; 1 = keep all).")
+  ap.add_argument("--min-chars", type=int, default=0, help="Skip chunks shorter than this many characters.")
+  ap.add_argument("--lang", default="", help="Restrict to chunks detected as this language (en, la, de, fr, ...).")
+  ap.add_argument("--server", action="store_true", help="Ask a running corpus_searchd.py instead of opening the DB.")
+  ap.add_argument("--server-url", default=SEARCHD_URL, help=f"corpus_searchd.py address (default {SEARCHD_URL}).")
+  args = ap.parse_args()
 
-    extra = ""
-    if work_id and work_title:
-      v = ""
-      if vol_idx is not None:
-        v = f" vol={vol_idx}" + (f"/{vol_total}" if vol_total else "")
-      extra = f"  work='{work_title}' work_id={work_id[:12]}…{v}"
+  q = " ".join(args.query).strip()
+  if not q:
+    ap.error("query is required")
 
-    print(f"\n[{rel}] ({ext})  chunk={chunk_id}{extra}")
-    print(snip)
+  params = dict(
+    limit=args.limit, ext=args.ext, like=args.like, path_eq=args.path_eq,
+    work_id=args.work_id, work_like=args.work_like, window=args.window,
+    skip_boilerplate=not args.no_boilerplate_skip, max_garbage=args.max_garbage,
+    min_chars=args.min_chars, lang=args.lang,
+  )
 
-    printed += 1
-    if printed >= args.limit:
-      break
+  if args.server:
+    from corpus_searchd import query_server
+    print_results(query_server(args.server_url, "/search", {"q": q, **params})["hits"])
+    return
 
-  con.close()
+  con = sqlite3.connect(str(DB))
+  try:
+    hits = search(con, q, **params)
+  except sqlite3.OperationalError as e:
+    raise SystemExit(str(e))
+  finally:
+    con.close()
+  print_results(hits)
 
 if __name__ == "__main__":
   main()
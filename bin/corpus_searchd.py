@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Long-lived search service for manifest.sqlite (localhost HTTP, JSON in/out).
+
+corpus_search.py and ask_corpus.py pay Python startup and a cold SQLite page cache
+on every run. This keeps a pool of read-only connections open (large cache_size,
+mmap'd DB file) and remembers recent results, so repeated queries are answered
+from memory. Both CLIs talk to it with --server.
+
+Endpoints:
+  GET  /health     -> {"ok": true, "db": ..., "cache": {...}}
+  POST /search     -> corpus_search.search(**body)       -> {"hits": [...]}
+  POST /retrieve   -> ask_corpus.retrieve + load_sources -> {"chunk_ids", "tried", "sources", "copies"}
+
+Every response also carries "cached" and "ms". The result cache is an LRU keyed by
+endpoint + request body; it is dropped whenever PRAGMA data_version reports that
+another connection (an ingest run) committed to the DB.
+"""
+
+import argparse
+import json
+import queue
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import ask_corpus
+import corpus_search
+
+DB = Path("/ai_data/ai_corpus/manifest.sqlite")
+HOST = "127.0.0.1"
+PORT = 8790
+
+
+def open_ro(db, cache_mb, mmap_mb):
+    con = sqlite3.connect(f"file:{db}?mode=ro", uri=True, check_same_thread=False)
+    con.row_factory = sqlite3.Row
+    con.execute(f"PRAGMA cache_size=-{cache_mb * 1024}")
+    con.execute(f"PRAGMA mmap_size={mmap_mb * 1024 * 1024}")
+    con.execute("PRAGMA query_only=1")
+    return con
+
+
+class ConnectionPool:
+    def __init__(self, db, size, cache_mb, mmap_mb):
+        self._q = queue.Queue()
+        for _ in range(size):
+            self._q.put(open_ro(db, cache_mb, mmap_mb))
+
+    @contextmanager
+    def connection(self):
+        con = self._q.get()
+        try:
+            yield con
+        finally:
+            self._q.put(con)
+
+
+class ResultCache:
+    """LRU of JSON-able results, emptied when manifest.sqlite changes underneath it."""
+
+    def __init__(self, db, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        # data_version only moves for commits made by *other* connections, which is
+        # exactly what we want to watch; keep one connection just for that
+        self._watch = sqlite3.connect(f"file:{db}?mode=ro", uri=True, check_same_thread=False)
+        self._version = self._data_version()
+
+    def _data_version(self):
+        return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def _check_version(self):
+        v = self._data_version()
+        if v != self._version:
+            self._version = v
+            self._data.clear()
+
+    def get(self, key):
+        with self._lock:
+            self._check_version()
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "max": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+def do_search(con, body):
+    q = str(body.pop("q", "")).strip()
+    if not q:
+        raise ValueError("q is required")
+    return {"hits": corpus_search.search(con, q, **body)}
+
+
+def do_retrieve(con, body):
+    question = str(body.pop("question", "")).strip()
+    k = int(body.pop("k", 8))
+    fts = body.pop("fts", "")
+    with_copies = bool(body.pop("with_copies", False))
+    chunk_ids, tried = ask_corpus.retrieve(con, question, k, fts=fts, **body)
+    sources, copies = ask_corpus.load_sources(con, chunk_ids, with_copies=with_copies)
+    return {"chunk_ids": chunk_ids, "tried": tried, "sources": sources, "copies": copies}
+
+
+ROUTES = {
+    "/search": do_search,
+    "/retrieve": do_retrieve,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    # set by main()
+    pool = None
+    cache = None
+    db = None
+    quiet = False
+
+    def send_json(self, code, obj):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] == "/health":
+            self.send_json(200, {"ok": True, "db": str(self.db), "cache": self.cache.stats()})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        route = ROUTES.get(self.path.split("?", 1)[0])
+        if route is None:
+            self.send_json(404, {"error": "not found"})
+            return
+
+        t0 = time.perf_counter()
+        try:
+            n = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(n) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("request body must be a JSON object")
+        except ValueError as e:
+            self.send_json(400, {"error": f"bad request: {e}"})
+            return
+
+        key = self.path + "\0" + json.dumps(body, sort_keys=True)
+        result = self.cache.get(key)
+        cached = result is not None
+        if not cached:
+            try:
+                with self.pool.connection() as con:
+                    result = route(con, body)
+            except (ValueError, TypeError, sqlite3.OperationalError) as e:
+                # bad FTS syntax, unknown filter names, ...
+                self.send_json(400, {"error": str(e)})
+                return
+            self.cache.put(key, result)
+
+        self.send_json(200, {**result, "cached": cached, "ms": round((time.perf_counter() - t0) * 1000, 2)})
+
+    def log_message(self, fmt, *args):
+        if not self.quiet:
+            super().log_message(fmt, *args)
+
+
+def query_server(url, path, payload, timeout=60):
+    """Client side for the --server mode of corpus_search.py / ask_corpus.py."""
+    req = urllib.request.Request(
+        url.rstrip("/") + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return json.loads(r.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        try:
+            msg = json.loads(e.read().decode("utf-8")).get("error", "")
+        except ValueError:
+            msg = ""
+        raise SystemExit(f"corpus_searchd: HTTP {e.code} {msg}".rstrip())
+    except urllib.error.URLError as e:
+        raise SystemExit(f"corpus_searchd not reachable at {url} ({e.reason}); start bin/corpus_searchd.py")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve corpus searches from warm read-only SQLite connections.")
+    ap.add_argument("--db", default=str(DB))
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--conns", type=int, default=4, help="Pooled read-only connections (= concurrent queries).")
+    ap.add_argument("--cache-mb", type=int, default=256, help="SQLite page cache per connection (MB).")
+    ap.add_argument("--mmap-mb", type=int, default=8192, help="mmap_size per connection (MB); pages are shared via the OS.")
+    ap.add_argument("--lru", type=int, default=1024, help="Cached query results kept in memory (0 = off).")
+    ap.add_argument("--quiet", action="store_true", help="No per-request log lines.")
+    args = ap.parse_args()
+
+    db = Path(args.db)
+    if not db.exists():
+        raise SystemExit(f"DB not found: {db}")
+
+    Handler.pool = ConnectionPool(db, args.conns, args.cache_mb, args.mmap_mb)
+    Handler.cache = ResultCache(db, args.lru)
+    Handler.db = db
+    Handler.quiet = args.quiet
+
+    httpd = ThreadingHTTPServer((args.host, args.port), Handler)
+    httpd.daemon_threads = True
+    print(f"corpus_searchd: {db} on http://{args.host}:{args.port}  ({args.conns} conns, LRU {args.lru})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
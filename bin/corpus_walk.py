@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Streaming directory walker shared by the corpus index builders
+(corpus_index_build.py, corpus_manifest.scan_files, bookshelf_reindex.py).
+
+  - os.scandir all the way down: entries come back as os.DirEntry, whose is_dir /
+    is_file / stat() answers are cached (one stat per file, usually none for dirs)
+  - nothing is materialized beyond the directories on the current path, so the first
+    file is yielded immediately and memory stays flat on 100k+ file trees
+  - names are visited in sorted order, which makes the walk order stable: a run can
+    record the last path it finished and a later run resumes after it (start_after)
+"""
+
+import os
+from typing import Callable, Iterator, Optional, Sequence, Tuple
+
+
+def _parts(rel: str) -> Tuple[str, ...]:
+  return tuple(p for p in rel.replace(os.sep, "/").split("/") if p and p != ".")
+
+
+def walk(
+  root,
+  name_filter: Optional[Callable[[str], bool]] = None,
+  exclude_dirs: Sequence[str] = (),
+  skip_hidden: bool = False,
+  start_after: str = "",
+) -> Iterator[os.DirEntry]:
+  """
+  Yield a DirEntry for every regular file under root (symlinks to files included,
+  symlinked dirs not followed), in sorted depth-first order.
+
+  name_filter(name) -> False skips a file; directories named in exclude_dirs (or
+  starting with "." when skip_hidden) are pruned. start_after is a path relative to
+  root as yielded by an earlier walk: everything up to and including it is skipped
+  without being listed.
+  """
+  exclude = set(exclude_dirs)
+  after = _parts(start_after)
+
+  # stack of (path parts relative to root, remaining sorted entries of that dir)
+  stack = []
+
+  def listing(path, parts):
+    try:
+      with os.scandir(path) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+      return
+    stack.append((parts, iter(entries)))
+
+  listing(os.fspath(root), ())
+  while stack:
+    parts, entries = stack[-1]
+    e = next(entries, None)
+    if e is None:
+      stack.pop()
+      continue
+
+    rel = parts + (e.name,)
+    if after:
+      # the checkpoint's own ancestors must still be entered; anything sorting before it is done
+      if rel == after[:len(rel)]:
+        if len(rel) == len(after):
+          after = ()  # the checkpoint file itself: resume with the next entry
+          continue
+      elif rel < after:
+        continue
+      else:
+        after = ()
+
+    try:
+      if e.is_dir(follow_symlinks=False):
+        if e.name in exclude or (skip_hidden and e.name.startswith(".")):
+          continue
+        listing(e.path, rel)
+        continue
+      if name_filter is not None and not name_filter(e.name):
+        continue
+      if not e.is_file():
+        continue
+    except OSError:
+      continue
+    yield e
+
+
+def rel_path(entry: os.DirEntry, root) -> str:
+  """entry.path relative to root (the form walk(start_after=...) takes)."""
+  base = os.fspath(root).rstrip("/") + "/"
+  return entry.path[len(base):] if entry.path.startswith(base) else os.path.relpath(entry.path, root)
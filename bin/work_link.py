@@ -2,6 +2,8 @@
 import re, sqlite3, hashlib
 from pathlib import Path
 
+from corpus_manifest import bump_generation
+
 DB = Path("/ai_data/ai_corpus/manifest.sqlite")
 
 VOL_PATTERNS = [
@@ -99,17 +101,22 @@ def main():
 
         work_id = make_work_id(work_title)
 
-        con.execute("""
+        # only rows whose link actually changes count (and move meta.generation)
+        cur = con.execute("""
             UPDATE docs
             SET work_id=?, work_title=?, vol_idx=?, vol_total=?
             WHERE doc_id=?
-        """, (work_id, work_title, vol_idx, vol_total, r["doc_id"]))
-        updated += 1
+              AND (work_id IS NOT ? OR work_title IS NOT ? OR vol_idx IS NOT ? OR vol_total IS NOT ?)
+        """, (work_id, work_title, vol_idx, vol_total, r["doc_id"],
+              work_id, work_title, vol_idx, vol_total))
+        updated += cur.rowcount
 
         if i % 2000 == 0:
             con.commit()
             print(f"Progress: {i:,}/{total:,} docs scanned; {updated:,} updated")
 
+    if updated:
+        bump_generation(con)  # --work-id / --work-like results may have changed
     con.commit()
     con.close()
     print(f"Done. Scanned: {total:,}. Updated: {updated:,}.")